@@ -103,6 +103,14 @@ class Agent(Daemon):
         hostname = get_hostname(self._agentConfig)
         self._checksd = load_check_directory(self._agentConfig, hostname)
 
+        # Stop the checks initialized again, they may keep connections open
+        replaced_checks = self._checksd['replaced_checks']
+        if self.collector:
+            self.collector.stop_checks(replaced_checks)
+        else:
+            for check in replaced_checks:
+                check.stop()
+
         # Logging
         num_checks = len(self._checksd['initialized_checks'])
         if num_checks > 0:
@@ -178,6 +186,7 @@ class Agent(Daemon):
                     log.warn("Cannot enable profiler: %s" % str(e))
 
             # Do the work.
+            collection_start = time.time()
             self.collector.run(checksd=self._checksd,
                                start_event=self.start_event,
                                configs_reloaded=self.configs_reloaded)
@@ -203,7 +212,7 @@ class Agent(Daemon):
                 if profiled:
                     collector_profiled_runs += 1
                 log.debug("Sleeping for {0} seconds".format(self.check_frequency))
-                time.sleep(self.check_frequency)
+                self._run_scheduled_checks_until(collection_start + self.check_frequency)
 
         # Now clean-up.
         try:
@@ -215,6 +224,23 @@ class Agent(Daemon):
         log.info("Exiting. Bye bye.")
         sys.exit(0)
 
+    def _run_scheduled_checks_until(self, deadline):
+        """
+        Run the check instances with their own collection interval as they
+        are due until `deadline`, when the next collection run starts.
+        """
+        while self.run_forever:
+            now = time.time()
+            next_run_time = self.collector.next_scheduled_run_time()
+            if next_run_time is None or next_run_time >= deadline:
+                if deadline > now:
+                    time.sleep(deadline - now)
+                return
+            if next_run_time > now:
+                time.sleep(next_run_time - now)
+            else:
+                self.collector.run_scheduled_checks()
+
     def _get_emitters(self):
         return [http_emitter]
 
@@ -4,6 +4,9 @@ from time import time
 
 # project
 from checks.metric_types import MetricTypes
+from utils.cache import LRUCache
+from utils.hyperloglog import HyperLogLog
+from utils.sketch import LogBucketSketch
 
 log = logging.getLogger(__name__)
 
@@ -19,6 +22,37 @@ log = logging.getLogger(__name__)
 # MetricsBucketAggregator constructor.
 RECENT_POINT_THRESHOLD_DEFAULT = 3600
 
+# Number of distinct `name|type|@rate|#tags` packet metadata whose parsed
+# context is kept by the aggregator, see `Aggregator.submit_metric_packet`.
+DEFAULT_CONTEXT_CACHE_SIZE = 16384
+
+# The table of interned contexts and tags is reset on flush once it holds
+# more than INTERN_TABLE_RESET_RATIO entries per live context.
+INTERN_TABLE_RESET_RATIO = 4
+INTERN_TABLE_MIN_SIZE = 10000
+
+# What the ContextLimiter does with the contexts over its limits: drop
+# their points, or fold them into a single series per metric name tagged
+# with CONTEXT_OVERFLOW_TAG
+CONTEXT_OVERFLOW_DROP = 'drop'
+CONTEXT_OVERFLOW_FOLD = 'fold'
+CONTEXT_OVERFLOW_TAG = 'dd.context_overflow:true'
+
+# Metric names whose number of dropped contexts is reported individually,
+# the others are reported together
+MAX_CONTEXTS_DROPPED_NAMES = 500
+OTHER_METRIC_NAMES = '_other'
+
+# Metrics about the agent itself are never limited
+INTERNAL_METRICS_PREFIX = 'datadog.'
+
+
+def intern_string(value):
+    """ Return the interned `value` if it's a str, python 2 can't intern unicode """
+    if type(value) is str:
+        return intern(value)
+    return value
+
 
 class Infinity(Exception):
     pass
@@ -32,7 +66,11 @@ class Metric(object):
     """
     A base metric class that accepts points, slices them into time intervals
     and performs roll-ups within those intervals.
+
+    There is one instance per live context, so metrics use __slots__ to
+    spare the memory of an instance __dict__.
     """
+    __slots__ = ('formatter', 'name', 'tags', 'hostname', 'device_name', 'last_sample_time')
 
     def sample(self, value, sample_rate, timestamp=None):
         """ Add a point to the given metric. """
@@ -42,9 +80,17 @@ class Metric(object):
         """ Flush all metrics up to the given timestamp. """
         raise NotImplementedError()
 
+    def merge(self, other):
+        """
+        Merge the points of another metric of the same type and context,
+        e.g. sampled by another dogstatsd worker, into this one.
+        """
+        raise NotImplementedError()
+
 
 class Gauge(Metric):
     """ A metric that tracks a value at particular points in time. """
+    __slots__ = ('value', 'timestamp')
 
     def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
         self.formatter = formatter
@@ -61,6 +107,12 @@ class Gauge(Metric):
         self.last_sample_time = time()
         self.timestamp = timestamp
 
+    def merge(self, other):
+        # Last sampled value wins
+        if other.value is not None and other.last_sample_time >= self.last_sample_time:
+            self.value = other.value
+            self.last_sample_time = other.last_sample_time
+            self.timestamp = other.timestamp
 
     def flush(self, timestamp, interval):
         if self.value is not None:
@@ -86,6 +138,7 @@ class BucketGauge(Gauge):
     opposed to the time that the sample was collected.
 
     """
+    __slots__ = ()
 
     def flush(self, timestamp, interval):
         if self.value is not None:
@@ -107,6 +160,7 @@ class BucketGauge(Gauge):
 
 class Count(Metric):
     """ A metric that tracks a count. """
+    __slots__ = ('value',)
 
     def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
         self.formatter = formatter
@@ -121,6 +175,11 @@ class Count(Metric):
         self.value = (self.value or 0) + value
         self.last_sample_time = time()
 
+    def merge(self, other):
+        if other.value is not None:
+            self.value = (self.value or 0) + other.value
+        self.last_sample_time = max(self.last_sample_time, other.last_sample_time)
+
     def flush(self, timestamp, interval):
         if self.value is None:
             return []
@@ -139,6 +198,7 @@ class Count(Metric):
             self.value = None
 
 class MonotonicCount(Metric):
+    __slots__ = ('prev_counter', 'curr_counter', 'count')
 
     def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
         self.formatter = formatter
@@ -187,6 +247,7 @@ class MonotonicCount(Metric):
 
 class Counter(Metric):
     """ A metric that tracks a counter value. """
+    __slots__ = ('value',)
 
     def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
         self.formatter = formatter
@@ -201,6 +262,10 @@ class Counter(Metric):
         self.value += value * int(1 / sample_rate)
         self.last_sample_time = time()
 
+    def merge(self, other):
+        self.value += other.value
+        self.last_sample_time = max(self.last_sample_time, other.last_sample_time)
+
     def flush(self, timestamp, interval):
         try:
             value = self.value / interval
@@ -222,6 +287,7 @@ DEFAULT_HISTOGRAM_PERCENTILES = [0.95]
 
 class Histogram(Metric):
     """ A metric to track the distribution of a set of values. """
+    __slots__ = ('count', 'samples', 'aggregates', 'percentiles')
 
     def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
         self.formatter = formatter
@@ -244,6 +310,11 @@ class Histogram(Metric):
         self.samples.append(value)
         self.last_sample_time = time()
 
+    def merge(self, other):
+        self.count += other.count
+        self.samples.extend(other.samples)
+        self.last_sample_time = max(self.last_sample_time, other.last_sample_time)
+
     def flush(self, ts, interval):
         if not self.count:
             return []
@@ -255,7 +326,17 @@ class Histogram(Metric):
         max_ = self.samples[-1]
         med = self.samples[int(round(length/2 - 1))]
         avg = sum(self.samples) / float(length)
+        percentiles = [(p, self.samples[int(round(p * length - 1))]) for p in self.percentiles]
+
+        metrics = self._format_metrics(ts, interval, min_, max_, med, avg, percentiles)
 
+        # Reset our state.
+        self.samples = []
+        self.count = 0
+
+        return metrics
+
+    def _format_metrics(self, ts, interval, min_, max_, med, avg, percentiles):
         aggregators = [
             ('min', min_, MetricTypes.GAUGE),
             ('max', max_, MetricTypes.GAUGE),
@@ -281,8 +362,7 @@ class Histogram(Metric):
             interval=interval) for suffix, value, metric_type in metric_aggrs
         ]
 
-        for p in self.percentiles:
-            val = self.samples[int(round(p * length - 1))]
+        for p, val in percentiles:
             name = '%s.%spercentile' % (self.name, int(p * 100))
             metrics.append(self.formatter(
                 hostname=self.hostname,
@@ -294,8 +374,48 @@ class Histogram(Metric):
                 interval=interval,
             ))
 
+        return metrics
+
+
+class SketchHistogram(Histogram):
+    """
+    A histogram that keeps a bounded-memory quantile sketch of its samples
+    instead of the samples themselves. min, max, avg and count are exact,
+    the median and percentiles are within the sketch's relative accuracy.
+    """
+    __slots__ = ('relative_accuracy', 'sketch')
+
+    def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
+        Histogram.__init__(self, formatter, name, tags, hostname, device_name, extra_config)
+        self.samples = None
+        self.relative_accuracy = extra_config['relative_accuracy']
+        self.sketch = LogBucketSketch(self.relative_accuracy)
+
+    def sample(self, value, sample_rate, timestamp=None):
+        self.count += int(1 / sample_rate)
+        self.sketch.add(value)
+        self.last_sample_time = time()
+
+    def merge(self, other):
+        self.count += other.count
+        self.sketch.merge(other.sketch)
+        self.last_sample_time = max(self.last_sample_time, other.last_sample_time)
+
+    def flush(self, ts, interval):
+        if not self.count:
+            return []
+
+        sketch = self.sketch
+        # Use the same ranks as Histogram for the median and percentiles
+        length = sketch.count
+        med = sketch.value_at_rank(int(round(length/2 - 1)) % length)
+        percentiles = [(p, sketch.value_at_rank(int(round(p * length - 1)) % length))
+                       for p in self.percentiles]
+
+        metrics = self._format_metrics(ts, interval, sketch.min, sketch.max, med, sketch.avg(), percentiles)
+
         # Reset our state.
-        self.samples = []
+        self.sketch = LogBucketSketch(self.relative_accuracy)
         self.count = 0
 
         return metrics
@@ -303,6 +423,7 @@ class Histogram(Metric):
 
 class Set(Metric):
     """ A metric to track the number of unique elements in a set. """
+    __slots__ = ('values',)
 
     def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
         self.formatter = formatter
@@ -317,6 +438,10 @@ class Set(Metric):
         self.values.add(value)
         self.last_sample_time = time()
 
+    def merge(self, other):
+        self.values.update(other.values)
+        self.last_sample_time = max(self.last_sample_time, other.last_sample_time)
+
     def flush(self, timestamp, interval):
         if not self.values:
             return []
@@ -337,6 +462,7 @@ class Set(Metric):
 
 class Rate(Metric):
     """ Track the rate of metrics over each flush interval """
+    __slots__ = ('samples',)
 
     def __init__(self, formatter, name, tags, hostname, device_name, extra_config=None):
         self.formatter = formatter
@@ -387,6 +513,95 @@ class Rate(Metric):
         finally:
             self.samples = self.samples[-1:]
 
+class ContextLimiter(object):
+    """
+    Cap the number of live contexts, globally and per metric name, so that
+    a client putting unique ids in its tags can't make the aggregator grow
+    without bounds.
+
+    Contexts over a limit are dropped or folded (see CONTEXT_OVERFLOW_*),
+    and the number of distinct contexts over the limits is estimated in
+    fixed memory per metric name, with a HyperLogLog.
+    """
+
+    def __init__(self, max_contexts=None, max_contexts_per_metric=None,
+                 overflow=CONTEXT_OVERFLOW_DROP):
+        if overflow not in (CONTEXT_OVERFLOW_DROP, CONTEXT_OVERFLOW_FOLD):
+            raise ValueError("Unknown context overflow policy: %s" % overflow)
+        self.max_contexts = max_contexts
+        self.max_contexts_per_metric = max_contexts_per_metric
+        self.overflow = overflow
+
+        # metric name -> live contexts of the metric
+        self.contexts_by_name = {}
+        self.context_count = 0
+        # metric name -> HyperLogLog of the contexts over the limits
+        self.dropped_by_name = {}
+
+    def admit(self, context, tags):
+        """
+        Return the context and tags the point submitted with `context` and
+        `tags` should be aggregated in, or (None, None) to drop it.
+        """
+        name = context[0]
+        contexts = self.contexts_by_name.get(name)
+        if contexts is not None and context in contexts:
+            return context, tags
+
+        if not name.startswith(INTERNAL_METRICS_PREFIX) and (
+                (self.max_contexts and self.context_count >= self.max_contexts) or
+                (self.max_contexts_per_metric and contexts is not None and
+                 len(contexts) >= self.max_contexts_per_metric)):
+            self._count_dropped(context)
+            if self.overflow == CONTEXT_OVERFLOW_DROP:
+                return None, None
+            tags = (CONTEXT_OVERFLOW_TAG,)
+            context = (name, tags, context[2], context[3])
+            if contexts is not None and context in contexts:
+                return context, tags
+
+        self._add(context)
+        return context, tags
+
+    def _add(self, context):
+        contexts = self.contexts_by_name.get(context[0])
+        if contexts is None:
+            contexts = self.contexts_by_name[context[0]] = set()
+        contexts.add(context)
+        self.context_count += 1
+
+    def _count_dropped(self, context):
+        name = context[0]
+        dropped = self.dropped_by_name.get(name)
+        if dropped is None:
+            if len(self.dropped_by_name) >= MAX_CONTEXTS_DROPPED_NAMES:
+                name = OTHER_METRIC_NAMES
+                dropped = self.dropped_by_name.get(name)
+            if dropped is None:
+                dropped = self.dropped_by_name[name] = HyperLogLog()
+        dropped.add(context)
+
+    def reset(self, live_contexts):
+        """ Forget the contexts that aren't in `live_contexts` anymore """
+        self.contexts_by_name = {}
+        self.context_count = 0
+        for context in live_contexts:
+            self._add(context)
+
+    def merge_dropped(self, dropped_by_name):
+        for name, dropped in dropped_by_name.iteritems():
+            if name in self.dropped_by_name:
+                self.dropped_by_name[name].merge(dropped)
+            else:
+                self.dropped_by_name[name] = dropped
+
+    def pop_dropped(self):
+        """ Return the estimated number of contexts dropped by metric name since the last call """
+        dropped_by_name = self.dropped_by_name
+        self.dropped_by_name = {}
+        return dict((name, dropped.count()) for name, dropped in dropped_by_name.iteritems())
+
+
 class Aggregator(object):
     """
     Abstract metric aggregator class.
@@ -397,7 +612,9 @@ class Aggregator(object):
     def __init__(self, hostname, interval=1.0, expiry_seconds=300,
             formatter=None, recent_point_threshold=None,
             histogram_aggregates=None, histogram_percentiles=None,
-            utf8_decoding=False):
+            utf8_decoding=False, context_cache_size=DEFAULT_CONTEXT_CACHE_SIZE,
+            histogram_sketch_accuracy=None, max_contexts=None,
+            max_contexts_per_metric=None, context_overflow=CONTEXT_OVERFLOW_DROP):
         self.events = []
         self.service_checks = []
         self.total_count = 0
@@ -418,41 +635,83 @@ class Aggregator(object):
             Histogram: {
                 'aggregates': histogram_aggregates,
                 'percentiles': histogram_percentiles
-            }
+            },
+            SketchHistogram: {
+                'aggregates': histogram_aggregates,
+                'percentiles': histogram_percentiles,
+                'relative_accuracy': histogram_sketch_accuracy,
+            },
         }
+        # Histograms keep all their samples unless a sketch accuracy is set
+        self.histogram_class = SketchHistogram if histogram_sketch_accuracy else Histogram
 
         self.utf8_decoding = utf8_decoding
 
+        # Parsed metadata of the metric packets, by packet without its value
+        self.context_cache = LRUCache(context_cache_size) if context_cache_size else None
+
+        # Canonical instances of the contexts and tag tuples, shared by all
+        # the metrics (and buckets) of a series, see `intern_context`
+        self._interned = {}
+
+        self.context_limiter = None
+        if max_contexts or max_contexts_per_metric:
+            self.context_limiter = ContextLimiter(max_contexts, max_contexts_per_metric,
+                                                  context_overflow)
+
     def packets_per_second(self, interval):
         if interval == 0:
             return 0
         return round(float(self.count)/interval, 2)
 
+    def parse_metric_value(self, name, raw_value, metric_type):
+        if metric_type in self.ALLOW_STRINGS:
+            return raw_value
+
+        # Try to cast as an int first to avoid precision issues, then as a
+        # float. Don't bother with int() when it's bound to fail.
+        if '.' not in raw_value:
+            try:
+                return int(raw_value)
+            except ValueError:
+                pass
+        try:
+            return float(raw_value)
+        except ValueError:
+            # Otherwise, raise an error saying it must be a number
+            raise Exception('Metric value must be a number: %s, %s' % (name, raw_value))
+
     def parse_metric_packet(self, packet):
         """
         Schema of a dogstatsd packet:
         <name>:<value>|<metric_type>|@<sample_rate>|#<tag1_name>:<tag1_value>,<tag2_name>:<tag2_value>:<value>|<metric_type>...
         """
         parsed_packets = []
-        name_and_metadata = packet.split(':', 1)
+        name_end = packet.find(':')
 
-        if len(name_and_metadata) != 2:
+        if name_end < 0:
             raise Exception('Unparseable metric packet: %s' % packet)
 
-        name = name_and_metadata[0]
-        broken_split = name_and_metadata[1].split(':')
-        data = []
-        partial_datum = None
-        for token in broken_split:
-            # We need to fix the tag groups that got broken by the : split
-            if partial_datum is None:
-                partial_datum = token
-            elif "|" not in token:
-                partial_datum += ":" + token
-            else:
-                data.append(partial_datum)
-                partial_datum = token
-        data.append(partial_datum)
+        name = packet[:name_end]
+        first_colon = packet.find(':', name_end + 1)
+        if first_colon < 0 or packet.rfind('|') < first_colon:
+            # A single value, the ':' left can only be in the tags
+            data = (packet[name_end + 1:],)
+        else:
+            # A packet may batch several values, separated by ':'. Tags can
+            # hold ':' too, a ':' only starts a new value if the next one comes
+            # after a '|'.
+            data = []
+            packet_end = len(packet)
+            datum_start = name_end + 1
+            colon = first_colon
+            while colon >= 0:
+                next_colon = packet.find(':', colon + 1)
+                if packet.find('|', colon + 1, next_colon if next_colon >= 0 else packet_end) >= 0:
+                    data.append(packet[datum_start:colon])
+                    datum_start = colon + 1
+                colon = next_colon
+            data.append(packet[datum_start:])
 
         for datum in data:
             value_and_metadata = datum.split('|')
@@ -463,21 +722,7 @@ class Aggregator(object):
             # Submit the metric
             raw_value = value_and_metadata[0]
             metric_type = value_and_metadata[1]
-
-            if metric_type in self.ALLOW_STRINGS:
-                value = raw_value
-            else:
-                # Try to cast as an int first to avoid precision issues, then as a
-                # float.
-                try:
-                    value = int(raw_value)
-                except ValueError:
-                    try:
-                        value = float(raw_value)
-                    except ValueError:
-                        # Otherwise, raise an error saying it must be a number
-                        raise Exception('Metric value must be a number: %s, %s' % (name, raw_value))
-
+            value = self.parse_metric_value(name, raw_value, metric_type)
 
             # Parse the optional values - sample rate & tags.
             sample_rate = 1
@@ -601,11 +846,47 @@ class Aggregator(object):
                 self.service_check(**service_check)
             else:
                 self.count += 1
-                parsed_packets = self.parse_metric_packet(packet)
-                for name, value, mtype, tags, sample_rate in parsed_packets:
-                    hostname, device_name, tags = self._extract_magic_tags(tags)
-                    self.submit_metric(name, value, mtype, tags=tags, hostname=hostname,
-                        device_name=device_name, sample_rate=sample_rate)
+                self.submit_metric_packet(packet)
+
+    def submit_metric_packet(self, packet):
+        """
+        Parse and submit a metric packet.
+
+        Clients send the same series over and over, so for packets holding a
+        single value, what's parsed from the rest of the packet (type, sample
+        rate, tags) and the resulting context are cached, keyed by the packet
+        without its value. Known series then skip tag parsing, sorting and
+        context building.
+        """
+        context_cache = self.context_cache
+        name_end = packet.find(':')
+        value_end = packet.find('|', name_end + 1)
+        if context_cache is None or name_end < 1 or value_end < 0:
+            return self._submit_parsed_packets(self.parse_metric_packet(packet))
+
+        raw_value = packet[name_end + 1:value_end]
+        key = packet[:name_end] + packet[value_end:]
+        cached = context_cache.get(key)
+        if cached is None or ':' in raw_value:
+            parsed_packets = self.parse_metric_packet(packet)
+            if len(parsed_packets) != 1:
+                return self._submit_parsed_packets(parsed_packets)
+
+            name, value, mtype, tags, sample_rate = parsed_packets[0]
+            hostname, device_name, tags = self._extract_magic_tags(tags)
+            context = self.get_context(name, tags, hostname, device_name)
+            context_cache[key] = (context, tags, mtype, sample_rate)
+        else:
+            context, tags, mtype, sample_rate = cached
+            value = self.parse_metric_value(context[0], raw_value, mtype)
+
+        self.submit_context_metric(context, tags, value, mtype, sample_rate=sample_rate)
+
+    def _submit_parsed_packets(self, parsed_packets):
+        for name, value, mtype, tags, sample_rate in parsed_packets:
+            hostname, device_name, tags = self._extract_magic_tags(tags)
+            self.submit_metric(name, value, mtype, tags=tags, hostname=hostname,
+                device_name=device_name, sample_rate=sample_rate)
 
 
     def _extract_magic_tags(self, tags):
@@ -630,9 +911,77 @@ class Aggregator(object):
                 tags = tuple(tags) or None
         return hostname, device_name, tags
 
+    def get_context(self, name, tags, hostname, device_name):
+        """
+        Return the context identifying the series of a metric.
+        Note: if you change the way that context is created, please also change
+        `MetricsBucketAggregator.create_empty_metrics`, which counts on this order
+        """
+        # Keep hostname with empty string to unset it
+        hostname = hostname if hostname is not None else self.hostname
+
+        # Avoid calling extra functions to dedupe tags if there are none
+        if tags is None:
+            return (name, tuple(), hostname, device_name)
+        return (name, tuple(sorted(set(tags))), hostname, device_name)
+
+    def _intern_tags(self, tags):
+        # Checks may submit tags as lists, only share tuples
+        if not tags or type(tags) is not tuple:
+            return tags
+        interned = self._interned.get(tags)
+        if interned is None:
+            interned = tuple([intern_string(tag) for tag in tags])
+            self._interned[interned] = interned
+        return interned
+
+    def intern_context(self, context, tags):
+        """
+        Return the canonical instances of `context` and `tags`, with their
+        strings interned, so that the many series sharing the same tags,
+        hostname and metric name don't each hold a copy of them.
+        """
+        interned = self._interned.get(context)
+        if interned is None:
+            name, context_tags, hostname, device_name = context
+            interned = (intern_string(name), self._intern_tags(context_tags),
+                        intern_string(hostname), intern_string(device_name))
+            self._interned[interned] = interned
+        return interned, self._intern_tags(tags)
+
+    def _reset_interned(self, live_contexts):
+        """ Forget the interned values of expired contexts once there are too many """
+        if len(self._interned) > max(INTERN_TABLE_MIN_SIZE, INTERN_TABLE_RESET_RATIO * live_contexts):
+            log.debug("Resetting the table of %s interned contexts and tags" % len(self._interned))
+            self._interned = {}
+
+    def create_metric(self, metric_by_context, context, tags, mtype):
+        """
+        Create the metric of a new context in `metric_by_context` and return
+        it, or return None if the context limiter drops it.
+        """
+        if self.context_limiter is not None:
+            context, tags = self.context_limiter.admit(context, tags)
+            if context is None:
+                return None
+            # The context may have been folded into an existing one
+            if context in metric_by_context:
+                return metric_by_context[context]
+
+        context, tags = self.intern_context(context, tags)
+        metric_class = self.metric_type_to_class[mtype]
+        metric = metric_by_context[context] = metric_class(self.formatter, context[0], tags,
+            context[2], context[3], self.metric_config.get(metric_class))
+        return metric
+
     def submit_metric(self, name, value, mtype, tags=None, hostname=None,
                       device_name=None, timestamp=None, sample_rate=1):
         """ Add a metric to be aggregated """
+        context = self.get_context(name, tags, hostname, device_name)
+        self.submit_context_metric(context, tags, value, mtype, timestamp, sample_rate)
+
+    def submit_context_metric(self, context, tags, value, mtype, timestamp=None, sample_rate=1):
+        """ Add a metric to be aggregated, with its context already built """
         raise NotImplementedError()
 
     def event(self, title, text, date_happened=None, alert_type=None, aggregation_key=None, source_type_name=None, priority=None, tags=None, hostname=None):
@@ -709,6 +1058,13 @@ class Aggregator(object):
     def send_packet_count(self, metric_name):
         self.submit_metric(metric_name, self.count, 'g')
 
+    def send_contexts_dropped(self, metric_name):
+        """ Submit the number of contexts dropped by the context limiter, by metric name """
+        if self.context_limiter is None:
+            return
+        for name, count in self.context_limiter.pop_dropped().iteritems():
+            self.submit_metric(metric_name, count, 'g', tags=['metric_name:%s' % name])
+
 class MetricsBucketAggregator(Aggregator):
     """
     A metric aggregator class.
@@ -717,7 +1073,9 @@ class MetricsBucketAggregator(Aggregator):
     def __init__(self, hostname, interval=1.0, expiry_seconds=300,
             formatter=None, recent_point_threshold=None,
             histogram_aggregates=None, histogram_percentiles=None,
-            utf8_decoding=False):
+            utf8_decoding=False, context_cache_size=DEFAULT_CONTEXT_CACHE_SIZE,
+            histogram_sketch_accuracy=None, max_contexts=None,
+            max_contexts_per_metric=None, context_overflow=CONTEXT_OVERFLOW_DROP):
         super(MetricsBucketAggregator, self).__init__(
             hostname,
             interval,
@@ -726,43 +1084,38 @@ class MetricsBucketAggregator(Aggregator):
             recent_point_threshold,
             histogram_aggregates,
             histogram_percentiles,
-            utf8_decoding
+            utf8_decoding,
+            context_cache_size,
+            histogram_sketch_accuracy,
+            max_contexts,
+            max_contexts_per_metric,
+            context_overflow
         )
         self.metric_by_bucket = {}
         self.last_sample_time_by_context = {}
+        # Contexts of last_sample_time_by_context by bucket of their last
+        # sample time, so that expiring counters doesn't go through all of them
+        self.counter_expiry_index = {}
         self.current_bucket = None
         self.current_mbc = {}
         self.last_flush_cutoff_time = 0
         self.metric_type_to_class = {
             'g': BucketGauge,
             'c': Counter,
-            'h': Histogram,
-            'ms': Histogram,
+            'h': self.histogram_class,
+            'ms': self.histogram_class,
             's': Set,
         }
 
     def calculate_bucket_start(self, timestamp):
         return timestamp - (timestamp % self.interval)
 
-    def submit_metric(self, name, value, mtype, tags=None, hostname=None,
-                      device_name=None, timestamp=None, sample_rate=1):
-        # Avoid calling extra functions to dedupe tags if there are none
-        # Note: if you change the way that context is created, please also change create_empty_metrics,
-        #  which counts on this order
-
-        # Keep hostname with empty string to unset it
-        hostname = hostname if hostname is not None else self.hostname
-
-        if tags is None:
-            context = (name, tuple(), hostname, device_name)
-        else:
-            context = (name, tuple(sorted(set(tags))), hostname, device_name)
-
+    def submit_context_metric(self, context, tags, value, mtype, timestamp=None, sample_rate=1):
         cur_time = time()
         # Check to make sure that the timestamp that is passed in (if any) is not older than
         #  recent_point_threshold.  If so, discard the point.
         if timestamp is not None and cur_time - int(timestamp) > self.recent_point_threshold:
-            log.debug("Discarding %s - ts = %s , current ts = %s " % (name, timestamp, cur_time))
+            log.debug("Discarding %s - ts = %s , current ts = %s " % (context[0], timestamp, cur_time))
             self.num_discarded_old_points += 1
         else:
             timestamp = timestamp or cur_time
@@ -777,25 +1130,135 @@ class MetricsBucketAggregator(Aggregator):
                 self.current_bucket = bucket_start_timestamp
                 self.current_mbc = metric_by_context
 
-            if context not in metric_by_context:
-                metric_class = self.metric_type_to_class[mtype]
-                metric_by_context[context] = metric_class(self.formatter, name, tags,
-                    hostname, device_name, self.metric_config.get(metric_class))
+            metric = metric_by_context.get(context)
+            if metric is None:
+                metric = self.create_metric(metric_by_context, context, tags, mtype)
+                if metric is None:
+                    return
+
+            metric.sample(value, sample_rate, timestamp)
 
-            metric_by_context[context].sample(value, sample_rate, timestamp)
+    def export_state(self):
+        """
+        Detach and return everything that is ready to be flushed: the closed
+        buckets, events, service checks and packet counts.
+        Used by dogstatsd workers, whose state is merged with `merge_state`
+        into the aggregator that actually flushes.
+        """
+        flush_cutoff_time = self.calculate_bucket_start(time())
+        buckets = {}
+        for bucket_start_timestamp in self.metric_by_bucket.keys():
+            if bucket_start_timestamp < flush_cutoff_time:
+                buckets[bucket_start_timestamp] = self.metric_by_bucket.pop(bucket_start_timestamp)
+        if self.current_bucket in buckets:
+            self.current_bucket = None
+            self.current_mbc = {}
+
+        state = {
+            'buckets': buckets,
+            'events': self.events,
+            'service_checks': self.service_checks,
+            'count': self.count,
+            'event_count': self.event_count,
+            'service_check_count': self.service_check_count,
+            'num_discarded_old_points': self.num_discarded_old_points,
+            'contexts_dropped': {},
+        }
+        if self.context_limiter is not None:
+            state['contexts_dropped'] = self.context_limiter.dropped_by_name
+            self.context_limiter.dropped_by_name = {}
+            # Contexts only stay live in a worker until they're exported
+            self.context_limiter.reset(self._live_contexts())
+        self.events = []
+        self.service_checks = []
+        self.total_count += self.count + self.event_count + self.service_check_count
+        self.count = 0
+        self.event_count = 0
+        self.service_check_count = 0
+        self.num_discarded_old_points = 0
 
-    def create_empty_metrics(self, sample_time_by_context, expiry_timestamp, flush_timestamp, metrics):
+        return state
+
+    def merge_state(self, state):
+        """ Merge the state exported by another aggregator with `export_state` """
+        for bucket_start_timestamp, metric_by_context in state['buckets'].iteritems():
+            if bucket_start_timestamp not in self.metric_by_bucket:
+                self.metric_by_bucket[bucket_start_timestamp] = {}
+            current_by_context = self.metric_by_bucket[bucket_start_timestamp]
+
+            for context, metric in metric_by_context.iteritems():
+                if context in current_by_context:
+                    current_by_context[context].merge(metric)
+                else:
+                    metric.formatter = self.formatter
+                    current_by_context[context] = metric
+
+        self.events.extend(state['events'])
+        self.service_checks.extend(state['service_checks'])
+        self.count += state['count']
+        self.event_count += state['event_count']
+        self.service_check_count += state['service_check_count']
+        self.num_discarded_old_points += state['num_discarded_old_points']
+        if state['contexts_dropped']:
+            if self.context_limiter is None:
+                self.context_limiter = ContextLimiter()
+            self.context_limiter.merge_dropped(state['contexts_dropped'])
+
+    def _live_contexts(self):
+        """ Contexts with points in a bucket, or counters not expired yet """
+        live_contexts = set(self.last_sample_time_by_context)
+        # Walk copies, the server thread may be adding buckets and contexts
+        for metric_by_context in self.metric_by_bucket.values():
+            live_contexts.update(metric_by_context.keys())
+        return live_contexts
+
+    def index_counter(self, context, last_sample_time):
+        """ Record the last sample time of a flushed counter """
+        previous_sample_time = self.last_sample_time_by_context.get(context)
+        self.last_sample_time_by_context[context] = last_sample_time
+        bucket_start_timestamp = self.calculate_bucket_start(last_sample_time)
+        if previous_sample_time is None or \
+                self.calculate_bucket_start(previous_sample_time) != bucket_start_timestamp:
+            # The entry of the previous bucket becomes stale, it's skipped on expiry
+            self.counter_expiry_index.setdefault(bucket_start_timestamp, []).append(context)
+
+    def expire_counters(self, expiry_timestamp):
+        """ Stop reporting the counters that haven't been sampled since `expiry_timestamp` """
+        expiry_bucket = self.calculate_bucket_start(expiry_timestamp)
+        for bucket_start_timestamp in [b for b in self.counter_expiry_index if b <= expiry_bucket]:
+            not_expired = []
+            for context in self.counter_expiry_index.pop(bucket_start_timestamp):
+                last_sample_time = self.last_sample_time_by_context.get(context)
+                if last_sample_time is None or \
+                        self.calculate_bucket_start(last_sample_time) != bucket_start_timestamp:
+                    continue
+                if last_sample_time < expiry_timestamp:
+                    log.debug("%s hasn't been submitted in %ss. Expiring." % (context, self.expiry_seconds))
+                    del self.last_sample_time_by_context[context]
+                else:
+                    not_expired.append(context)
+            if not_expired:
+                self.counter_expiry_index[bucket_start_timestamp] = not_expired
+
+    def create_empty_metrics(self, flush_timestamp, metrics, sampled_contexts=()):
         # Even if no data is submitted, Counters keep reporting "0" for expiry_seconds.  The other Metrics
         #  (Set, Gauge, Histogram) do not report if no data is submitted
-        for context, last_sample_time in sample_time_by_context.items():
-            if last_sample_time < expiry_timestamp:
-                log.debug("%s hasn't been submitted in %ss. Expiring." % (context, self.expiry_seconds))
-                self.last_sample_time_by_context.pop(context, None)
-            else:
-                # The expiration currently only applies to Counters
-                # This counts on the ordering of the context created in submit_metric not changing
-                metric = Counter(self.formatter, context[0], context[1], context[2], context[3])
-                metrics += metric.flush(flush_timestamp, self.interval)
+        formatter = self.formatter
+        interval = self.interval
+        for context in self.last_sample_time_by_context:
+            if context in sampled_contexts:
+                continue
+            # This counts on the ordering of the context created in submit_metric not changing
+            metrics.append(formatter(
+                metric=context[0],
+                value=0.0,
+                timestamp=flush_timestamp,
+                tags=context[1],
+                hostname=context[2],
+                device_name=context[3],
+                metric_type=MetricTypes.RATE,
+                interval=interval,
+            ))
 
     def flush(self):
         cur_time = time()
@@ -803,42 +1266,46 @@ class MetricsBucketAggregator(Aggregator):
         expiry_timestamp = cur_time - self.expiry_seconds
 
         metrics = []
+        self.expire_counters(expiry_timestamp)
 
         if self.metric_by_bucket:
-            # We want to process these in order so that we can check for and expired metrics and
-            #  re-create non-expired metrics.  We also mutate self.metric_by_bucket.
+            # We want to process these in order so that non-expired counters that were not
+            #  sampled in a bucket report 0 for it.  We also mutate self.metric_by_bucket.
             for bucket_start_timestamp in sorted(self.metric_by_bucket.keys()):
-                metric_by_context = self.metric_by_bucket[bucket_start_timestamp]
-                if bucket_start_timestamp < flush_cutoff_time:
-                    not_sampled_in_this_bucket = self.last_sample_time_by_context.copy()
-                    # We mutate this dictionary while iterating so don't use an iterator.
-                    for context, metric in metric_by_context.items():
-                        if metric.last_sample_time < expiry_timestamp:
-                            # This should never happen
-                            log.warning("%s hasn't been submitted in %ss. Expiring." % (context, self.expiry_seconds))
-                            not_sampled_in_this_bucket.pop(context, None)
-                            self.last_sample_time_by_context.pop(context, None)
-                        else:
-                            metrics += metric.flush(bucket_start_timestamp, self.interval)
-                            if isinstance(metric, Counter):
-                                self.last_sample_time_by_context[context] = metric.last_sample_time
-                                not_sampled_in_this_bucket.pop(context, None)
-                    # We need to account for Metrics that have not expired and were not flushed for this bucket
-                    self.create_empty_metrics(not_sampled_in_this_bucket, expiry_timestamp, bucket_start_timestamp, metrics)
-
-                    del self.metric_by_bucket[bucket_start_timestamp]
+                if bucket_start_timestamp >= flush_cutoff_time:
+                    continue
+                metric_by_context = self.metric_by_bucket.pop(bucket_start_timestamp)
+                # A submit_metric still holding the bucket may add to it, so don't use an iterator.
+                for context, metric in metric_by_context.items():
+                    if metric.last_sample_time < expiry_timestamp:
+                        # This should never happen
+                        log.warning("%s hasn't been submitted in %ss. Expiring." % (context, self.expiry_seconds))
+                        self.last_sample_time_by_context.pop(context, None)
+                    else:
+                        metrics += metric.flush(bucket_start_timestamp, self.interval)
+                        if isinstance(metric, Counter):
+                            self.index_counter(context, metric.last_sample_time)
+                # We need to account for Counters that have not expired and were not flushed for this bucket
+                self.create_empty_metrics(bucket_start_timestamp, metrics, metric_by_context)
         else:
             # Even if there are no metrics in this flush, there may be some non-expired counters
             #  We should only create these non-expired metrics if we've passed an interval since the last flush
             if flush_cutoff_time >= self.last_flush_cutoff_time + self.interval:
-                self.create_empty_metrics(self.last_sample_time_by_context.copy(), expiry_timestamp,
-                                          flush_cutoff_time-self.interval, metrics)
+                self.create_empty_metrics(flush_cutoff_time - self.interval, metrics)
 
         # Log a warning regarding metrics with old timestamps being submitted
         if self.num_discarded_old_points > 0:
             log.warn('%s points were discarded as a result of having an old timestamp' % self.num_discarded_old_points)
             self.num_discarded_old_points = 0
 
+        # The server thread may be adding a bucket, walk a copy
+        live_contexts = len(self.last_sample_time_by_context)
+        for metric_by_context in self.metric_by_bucket.values():
+            live_contexts += len(metric_by_context)
+        self._reset_interned(live_contexts)
+        if self.context_limiter is not None:
+            self.context_limiter.reset(self._live_contexts())
+
         # Save some stats.
         log.debug("received %s payloads since last flush" % self.count)
         self.total_count += self.count
@@ -857,7 +1324,9 @@ class MetricsAggregator(Aggregator):
     def __init__(self, hostname, interval=1.0, expiry_seconds=300,
             formatter=None, recent_point_threshold=None,
             histogram_aggregates=None, histogram_percentiles=None,
-            utf8_decoding=False):
+            utf8_decoding=False, context_cache_size=DEFAULT_CONTEXT_CACHE_SIZE,
+            histogram_sketch_accuracy=None, max_contexts=None,
+            max_contexts_per_metric=None, context_overflow=CONTEXT_OVERFLOW_DROP):
         super(MetricsAggregator, self).__init__(
             hostname,
             interval,
@@ -866,7 +1335,12 @@ class MetricsAggregator(Aggregator):
             recent_point_threshold,
             histogram_aggregates,
             histogram_percentiles,
-            utf8_decoding
+            utf8_decoding,
+            context_cache_size,
+            histogram_sketch_accuracy,
+            max_contexts,
+            max_contexts_per_metric,
+            context_overflow
         )
         self.metrics = {}
         self.metric_type_to_class = {
@@ -874,33 +1348,24 @@ class MetricsAggregator(Aggregator):
             'ct': Count,
             'ct-c': MonotonicCount,
             'c': Counter,
-            'h': Histogram,
-            'ms': Histogram,
+            'h': self.histogram_class,
+            'ms': self.histogram_class,
             's': Set,
             '_dd-r': Rate,
         }
 
-    def submit_metric(self, name, value, mtype, tags=None, hostname=None,
-                      device_name=None, timestamp=None, sample_rate=1):
-        # Avoid calling extra functions to dedupe tags if there are none
-
-        # Keep hostname with empty string to unset it
-        hostname = hostname if hostname is not None else self.hostname
-
-        if tags is None:
-            context = (name, tuple(), hostname, device_name)
-        else:
-            context = (name, tuple(sorted(set(tags))), hostname, device_name)
-        if context not in self.metrics:
-            metric_class = self.metric_type_to_class[mtype]
-            self.metrics[context] = metric_class(self.formatter, name, tags,
-                hostname, device_name, self.metric_config.get(metric_class))
+    def submit_context_metric(self, context, tags, value, mtype, timestamp=None, sample_rate=1):
+        metric = self.metrics.get(context)
+        if metric is None:
+            metric = self.create_metric(self.metrics, context, tags, mtype)
+            if metric is None:
+                return
         cur_time = time()
         if timestamp is not None and cur_time - int(timestamp) > self.recent_point_threshold:
-            log.debug("Discarding %s - ts = %s , current ts = %s " % (name, timestamp, cur_time))
+            log.debug("Discarding %s - ts = %s , current ts = %s " % (context[0], timestamp, cur_time))
             self.num_discarded_old_points += 1
         else:
-            self.metrics[context].sample(value, sample_rate, timestamp)
+            metric.sample(value, sample_rate, timestamp)
 
     def gauge(self, name, value, tags=None, hostname=None, device_name=None, timestamp=None):
         self.submit_metric(name, value, 'g', tags, hostname, device_name, timestamp)
@@ -942,6 +1407,10 @@ class MetricsAggregator(Aggregator):
             else:
                 metrics += metric.flush(timestamp, self.interval)
 
+        self._reset_interned(len(self.metrics))
+        if self.context_limiter is not None:
+            self.context_limiter.reset(self.metrics)
+
         # Log a warning regarding metrics with old timestamps being submitted
         if self.num_discarded_old_points > 0:
             log.warn('%s points were discarded as a result of having an old timestamp' % self.num_discarded_old_points)
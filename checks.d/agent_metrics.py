@@ -11,6 +11,7 @@ except ImportError:
 from checks import AgentCheck
 from checks.metric_types import MetricTypes
 from config import _is_affirmative
+from utils.http import session_pool
 
 MAX_THREADS_COUNT = 50
 MAX_COLLECTION_TIME = 30
@@ -37,6 +38,9 @@ class AgentMetrics(AgentCheck):
         AgentCheck.__init__(self, *args, **kwargs)
         self._collector_payload = {}
         self._metric_context = {}
+        # Requests sent through the shared HTTP sessions and their total
+        # time, at the previous run
+        self._last_http_stats = (0, 0.0)
 
     def _psutil_config_to_stats(self, instance):
         """
@@ -101,6 +105,24 @@ class AgentMetrics(AgentCheck):
                 full_metric_name = 'datadog.agent.collector.{0}'.format(k)
                 self._send_single_metric(full_metric_name, v, metric_type)
 
+    def _submit_http_stats(self):
+        """
+        Report the requests the checks sent through the shared HTTP sessions,
+        the connections opened to send them and their average latency
+        """
+        stats = session_pool.stats()
+        if not stats['requests']:
+            return
+
+        self.monotonic_count('datadog.agent.http.requests', stats['requests'])
+        self.monotonic_count('datadog.agent.http.connections', stats['connections'])
+
+        last_requests, last_request_time = self._last_http_stats
+        if stats['requests'] > last_requests:
+            self.gauge('datadog.agent.http.latency',
+                       (stats['request_time'] - last_request_time) / (stats['requests'] - last_requests))
+        self._last_http_stats = (stats['requests'], stats['request_time'])
+
     def set_metric_context(self, payload, context):
         self._collector_payload = payload
         self._metric_context = context
@@ -113,6 +135,8 @@ class AgentMetrics(AgentCheck):
             stats, names_to_metric_types = self._psutil_config_to_stats(instance)
             self._register_psutil_metrics(stats, names_to_metric_types)
 
+        self._submit_http_stats()
+
         payload, context = self.get_metric_context()
         collection_time = context.get('collection_time', None)
         emit_time = context.get('emit_time', None)
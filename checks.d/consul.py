@@ -6,6 +6,7 @@ from urlparse import urljoin
 
 # project
 from checks import AgentCheck
+from utils.http import session_pool
 
 # 3p
 import requests
@@ -48,11 +49,11 @@ class ConsulCheck(AgentCheck):
 
             if clientcertfile:
                 if privatekeyfile:
-                    resp = requests.get(url, cert=(clientcertfile,privatekeyfile), verify=cabundlefile)
+                    resp = session_pool.get(url, cert=(clientcertfile,privatekeyfile), verify=cabundlefile)
                 else:
-                    resp = requests.get(url, cert=clientcertfile, verify=cabundlefile)
+                    resp = session_pool.get(url, cert=clientcertfile, verify=cabundlefile)
             else:
-                resp = requests.get(url, verify=cabundlefile)
+                resp = session_pool.get(url, verify=cabundlefile)
 
         except requests.exceptions.Timeout:
             self.log.exception('Consul request to {0} timed out'.format(url))
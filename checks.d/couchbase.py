@@ -7,6 +7,7 @@ import requests
 # project
 from checks import AgentCheck
 from util import headers
+from utils.http import session_pool
 
 # Constants
 COUCHBASE_STATS_PATH = '/pools/default'
@@ -135,7 +136,7 @@ class Couchbase(AgentCheck):
         if 'user' in instance and 'password' in instance:
             auth = (instance['user'], instance['password'])
 
-        r = requests.get(url, auth=auth, headers=headers(self.agentConfig),
+        r = session_pool.get(url, auth=auth, headers=headers(self.agentConfig),
             timeout=timeout)
         r.raise_for_status()
         return r.json()
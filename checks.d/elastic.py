@@ -1,15 +1,14 @@
 # stdlib
 from collections import defaultdict, namedtuple
+import functools
 import time
 import urlparse
 
-# 3p
-import requests
-
 # project
 from checks import AgentCheck
 from config import _is_affirmative
 from util import headers
+from utils.http import session_pool
 
 
 class NodeNotFound(Exception):
@@ -299,26 +298,38 @@ class ESCheck(AgentCheck):
         health_url, nodes_url, stats_url, pshard_stats_url, pending_tasks_url, stats_metrics, \
             pshard_stats_metrics = self._define_params(version, config.cluster_stats)
 
-        # Load clusterwise data
+        # Load the clusterwise, stats, health and pending_tasks data at once
+        urls = {
+            'stats': urlparse.urljoin(config.url, stats_url),
+            'health': urlparse.urljoin(config.url, health_url),
+            'pending_tasks': urlparse.urljoin(config.url, pending_tasks_url),
+        }
         if config.pshard_stats:
-            pshard_stats_url = urlparse.urljoin(config.url, pshard_stats_url)
-            pshard_stats_data = self._get_data(pshard_stats_url, config)
-            self._process_pshard_stats_data(pshard_stats_data, config, pshard_stats_metrics)
-
-        # Load stats data.
-        stats_url = urlparse.urljoin(config.url, stats_url)
-        stats_data = self._get_data(stats_url, config)
-        self._process_stats_data(nodes_url, stats_data, stats_metrics, config)
-
-        # Load the health data.
-        health_url = urlparse.urljoin(config.url, health_url)
-        health_data = self._get_data(health_url, config)
-        self._process_health_data(health_data, config)
-
-        # Load the pending_tasks data.
-        pending_tasks_url = urlparse.urljoin(config.url, pending_tasks_url)
-        pending_tasks_data = self._get_data(pending_tasks_url, config)
-        self._process_pending_tasks_data(pending_tasks_data, config)
+            urls['pshard_stats'] = urlparse.urljoin(config.url, pshard_stats_url)
+        calls = dict(
+            (key, functools.partial(self._get_data, url, config, send_sc=False))
+            for key, url in urls.iteritems()
+        )
+        data, errors = self.fetch_concurrently(calls, config.timeout)
+
+        if 'pshard_stats' in data:
+            self._process_pshard_stats_data(data['pshard_stats'], config, pshard_stats_metrics)
+        if 'stats' in data:
+            self._process_stats_data(nodes_url, data['stats'], stats_metrics, config)
+        if 'health' in data:
+            self._process_health_data(data['health'], config)
+        if 'pending_tasks' in data:
+            self._process_pending_tasks_data(data['pending_tasks'], config)
+
+        for key in ('pshard_stats', 'stats', 'health', 'pending_tasks'):
+            if key in errors:
+                self.service_check(
+                    self.SERVICE_CHECK_CONNECT_NAME,
+                    AgentCheck.CRITICAL,
+                    message="Error {0} when hitting {1}".format(errors[key], urls[key]),
+                    tags=config.service_check_tags
+                )
+                raise errors[key]
 
         # If we're here we did not have any ES conn issues
         self.service_check(
@@ -421,7 +432,7 @@ class ESCheck(AgentCheck):
             auth = None
 
         try:
-            resp = requests.get(
+            resp = session_pool.get(
                 url,
                 timeout=config.timeout,
                 headers=headers(self.agentConfig),
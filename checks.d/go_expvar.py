@@ -2,11 +2,9 @@
 from collections import defaultdict
 import re
 
-# 3rd party
-import requests
-
 # project
 from checks import AgentCheck
+from utils.http import session_pool
 
 DEFAULT_MAX_METRICS = 350
 PATH = "path"
@@ -59,7 +57,7 @@ class GoExpvar(AgentCheck):
         self._last_gc_count = defaultdict(int)
 
     def _get_data(self, url):
-        r = requests.get(url, timeout=10)
+        r = session_pool.get(url, timeout=10)
         r.raise_for_status()
         return r.json()
 
@@ -3,13 +3,11 @@ from collections import defaultdict
 import re
 import time
 
-# 3rd party
-import requests
-
 # project
 from checks import AgentCheck
 from config import _is_affirmative
 from util import headers
+from utils.http import session_pool
 
 STATS_URL = "/;csv;norefresh"
 EVENT_TYPE = SOURCE_TYPE_NAME = 'haproxy'
@@ -110,7 +108,7 @@ class HAProxy(AgentCheck):
 
         self.log.debug("HAProxy Fetching haproxy search data from: %s" % url)
 
-        r = requests.get(url, auth=auth, headers=headers(self.agentConfig))
+        r = session_pool.get(url, auth=auth, headers=headers(self.agentConfig))
         r.raise_for_status()
 
         return r.content.splitlines()
@@ -6,17 +6,16 @@ import numbers
 from fnmatch import fnmatch
 import re
 
-# 3rd party
-import requests
-
 # project
 from checks import AgentCheck
 from config import _is_affirmative
 from utils.kubeutil import set_kube_settings, get_kube_settings, get_kube_labels
-from utils.http import retrieve_json
+from utils.http import retrieve_json, session_pool
 
 NAMESPACE = "kubernetes"
 DEFAULT_MAX_DEPTH = 10
+# Seconds given to the kubelet, cadvisor and master endpoints to answer
+DEFAULT_TIMEOUT = 10
 
 DEFAULT_USE_HISTOGRAM = False
 DEFAULT_PUBLISH_ALIASES = False
@@ -51,12 +50,22 @@ class Kubernetes(AgentCheck):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
         self.kube_settings = set_kube_settings(instances[0])
 
-    def _perform_kubelet_checks(self, url):
+    def _retrieve_kubelet_health(self, url, timeout):
+        r = session_pool.get(url, timeout=timeout)
+        return list(r.iter_lines())
+
+    def _retrieve_master_nodes(self, url, timeout):
+        r = session_pool.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.json()['items']
+
+    def _perform_kubelet_checks(self, health_lines, error=None):
         service_check_base = NAMESPACE + '.kubelet.check'
         is_ok = True
         try:
-            r = requests.get(url)
-            for line in r.iter_lines():
+            if error is not None:
+                raise error
+            for line in health_lines:
 
                 # avoid noise; this check is expected to fail since we override the container hostname
                 if line.find('hostname') != -1:
@@ -85,11 +94,9 @@ class Kubernetes(AgentCheck):
             else:
                 self.service_check(service_check_base, AgentCheck.CRITICAL)
 
-    def _perform_master_checks(self, url):
+    def _perform_master_checks(self, url, nodes):
         try:
-            r = requests.get(url)
-            r.raise_for_status()
-            for nodeinfo in r.json()['items']:
+            for nodeinfo in nodes:
                 nodename = nodeinfo['name']
                 service_check_name = "{0}.master.{1}.check".format(NAMESPACE, nodename)
                 cond = nodeinfo['status'][-1]['type']
@@ -122,18 +129,41 @@ class Kubernetes(AgentCheck):
         self.publish_rate = FUNC_MAP[RATE][self.use_histogram]
         self.publish_gauge = FUNC_MAP[GAUGE][self.use_histogram]
 
+        enable_master_checks = instance.get('enable_master_checks', False)
+        enable_kubelet_checks = instance.get('enable_kubelet_checks', True)
+        timeout = float(instance.get('timeout', DEFAULT_TIMEOUT))
+
+        # Query the master, the kubelet and cadvisor all at once. The requests
+        # time out too, so that a hanging endpoint doesn't hold a fetch thread
+        master_url = kube_settings["master_url_nodes"]
+        metrics_url = kube_settings["metrics_url"]
+        calls = {
+            'metrics': lambda: self._retrieve_metrics(metrics_url, timeout),
+            'labels': lambda: self._retrieve_kube_labels(timeout),
+        }
+        if enable_master_checks:
+            calls['master'] = lambda: self._retrieve_master_nodes(master_url, timeout)
+        if enable_kubelet_checks:
+            kube_health_url = kube_settings["kube_health_url"]
+            calls['kubelet'] = lambda: self._retrieve_kubelet_health(kube_health_url, timeout)
+        results, errors = self.fetch_concurrently(calls, timeout)
+
         # master health checks
-        if instance.get('enable_master_checks', False):
-            master_url = kube_settings["master_url_nodes"]
-            self._perform_master_checks(master_url)
+        if enable_master_checks:
+            if 'master' in errors:
+                self.log.warning('master checks url=%s exception=%s' % (master_url, str(errors['master'])))
+                raise errors['master']
+            self._perform_master_checks(master_url, results['master'])
 
         # kubelet health checks
-        if instance.get('enable_kubelet_checks', True):
-            kube_health_url = kube_settings["kube_health_url"]
-            self._perform_kubelet_checks(kube_health_url)
+        if enable_kubelet_checks:
+            self._perform_kubelet_checks(results.get('kubelet'), errors.get('kubelet'))
 
         # kubelet metrics
-        self._update_metrics(instance, kube_settings)
+        for key in ('metrics', 'labels'):
+            if key in errors:
+                raise errors[key]
+        self._update_metrics(instance, results['metrics'], results['labels'])
 
     def _publish_raw_metrics(self, metric, dat, tags, depth=0):
         if depth >= self.max_depth:
@@ -214,16 +244,14 @@ class Kubernetes(AgentCheck):
                               sum(float(net[x]) for x in NET_ERRORS),
                               tags)
 
-    def _retrieve_metrics(self, url):
-        return retrieve_json(url)
+    def _retrieve_metrics(self, url, timeout=None):
+        return retrieve_json(url, timeout=timeout)
 
-    def _retrieve_kube_labels(self):
-        return get_kube_labels()
+    def _retrieve_kube_labels(self, timeout=None):
+        return get_kube_labels(timeout=timeout)
 
 
-    def _update_metrics(self, instance, kube_settings):
-        metrics = self._retrieve_metrics(kube_settings["metrics_url"])
-        kube_labels = self._retrieve_kube_labels()
+    def _update_metrics(self, instance, metrics, kube_labels):
         if not metrics:
             raise Exception('No metrics retrieved cmd=%s' % self.metrics_cmd)
 
@@ -6,6 +6,7 @@ import requests
 
 # project
 from checks import AgentCheck
+from utils.http import session_pool
 
 
 class Marathon(AgentCheck):
@@ -58,7 +59,7 @@ class Marathon(AgentCheck):
 
     def get_json(self, url, timeout, auth):
         try:
-            r = requests.get(url, timeout=timeout, auth=auth)
+            r = session_pool.get(url, timeout=timeout, auth=auth)
             r.raise_for_status()
         except requests.exceptions.Timeout:
             # If there's a timeout
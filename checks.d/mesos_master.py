@@ -6,7 +6,18 @@ Collects metrics from mesos master node, only the leader is sending metrics.
 import requests
 
 # project
-from checks import AgentCheck, CheckException
+from checks import AgentCheck, CheckException, FetchTimeout
+from utils.http import session_pool
+
+
+class MesosRequestError(Exception):
+    """
+    A request to the master failed, `message` is the message of the service check
+    """
+    def __init__(self, url, message):
+        Exception.__init__(self, message)
+        self.url = url
+        self.message = message
 
 
 class MesosMaster(AgentCheck):
@@ -119,49 +130,55 @@ class MesosMaster(AgentCheck):
         'master/valid_status_updates'                       : ('mesos.cluster.valid_status_updates', GAUGE),
     }
 
-    def _get_json(self, url, timeout):
-        tags = ["url:%s" % url]
-        msg = None
-        status = None
+    def _fetch_json(self, url, timeout):
+        """
+        Return the JSON document at `url`, raise a `MesosRequestError` if it
+        can't be retrieved. It doesn't submit anything, so that it can run in
+        the fetch threads.
+        """
         try:
-            r = requests.get(url, timeout=timeout)
-            if r.status_code != 200:
-                status = AgentCheck.CRITICAL
-                msg = "Got %s when hitting %s" % (r.status_code, url)
-            else:
-                status = AgentCheck.OK
-                msg = "Mesos master instance detected at %s " % url
-        except requests.exceptions.Timeout as e:
-            # If there's a timeout
-            msg = "%s seconds timeout when hitting %s" % (timeout, url)
-            status = AgentCheck.CRITICAL
+            r = session_pool.get(url, timeout=timeout)
+        except requests.exceptions.Timeout:
+            raise MesosRequestError(url, "%s seconds timeout when hitting %s" % (timeout, url))
         except Exception as e:
-            msg = str(e)
-            status = AgentCheck.CRITICAL
-        finally:
-            if self.service_check_needed:
-                self.service_check(self.SERVICE_CHECK_NAME, status, tags=tags,
-                                   message=msg)
-                self.service_check_needed = False
-            if status is AgentCheck.CRITICAL:
-                self.service_check(self.SERVICE_CHECK_NAME, status, tags=tags,
-                                   message=msg)
-                raise CheckException("Cannot connect to mesos, please check your configuration.")
-
+            raise MesosRequestError(url, str(e))
+        if r.status_code != 200:
+            raise MesosRequestError(url, "Got %s when hitting %s" % (r.status_code, url))
         return r.json()
 
+    def _get_json(self, url, timeout):
+        try:
+            data = self._fetch_json(url, timeout)
+        except MesosRequestError as e:
+            self._report_request_error(e)
+
+        if self.service_check_needed:
+            self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=["url:%s" % url],
+                               message="Mesos master instance detected at %s " % url)
+            self.service_check_needed = False
+        return data
+
+    def _report_request_error(self, error):
+        self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, tags=["url:%s" % error.url],
+                           message=error.message)
+        self.service_check_needed = False
+        raise CheckException("Cannot connect to mesos, please check your configuration.")
+
     def _get_master_state(self, url, timeout):
         return self._get_json(url + '/state.json', timeout)
 
-    def _get_master_stats(self, url, timeout):
+    # The stats and roles are fetched concurrently, the errors are reported
+    # from the check thread
+    def _get_stats_endpoint(self):
         if self.version >= [0, 22, 0]:
-            endpoint = '/metrics/snapshot'
-        else:
-            endpoint = '/stats.json'
-        return self._get_json(url + endpoint, timeout)
+            return '/metrics/snapshot'
+        return '/stats.json'
+
+    def _get_master_stats(self, url, timeout):
+        return self._fetch_json(url + self._get_stats_endpoint(), timeout)
 
     def _get_master_roles(self, url, timeout):
-        return self._get_json(url + '/roles.json', timeout)
+        return self._fetch_json(url + '/roles.json', timeout)
 
     def _check_leadership(self, url, timeout):
         state_metrics = self._get_master_state(url, timeout)
@@ -194,6 +211,12 @@ class MesosMaster(AgentCheck):
 
             tags += instance_tags
 
+            # The roles and stats don't depend on each other, fetch them together
+            calls = {'stats': lambda: self._get_master_stats(url, timeout)}
+            if self.leader:
+                calls['roles'] = lambda: self._get_master_roles(url, timeout)
+            results, errors = self.fetch_concurrently(calls, timeout)
+
             if self.leader:
                 self.GAUGE('mesos.cluster.total_frameworks', len(state_metrics['frameworks']), tags=tags)
 
@@ -204,7 +227,7 @@ class MesosMaster(AgentCheck):
                     for key_name, (metric_name, metric_func) in self.FRAMEWORK_METRICS.iteritems():
                         metric_func(self, metric_name, resources[key_name], tags=framework_tags)
 
-                role_metrics = self._get_master_roles(url, timeout)
+                role_metrics = results.get('roles')
                 if role_metrics is not None:
                     for role in role_metrics['roles']:
                         role_tags = ['mesos_role:' + role['name']] + tags
@@ -213,7 +236,7 @@ class MesosMaster(AgentCheck):
                         for key_name, (metric_name, metric_func) in self.ROLE_RESOURCES_METRICS.iteritems():
                             metric_func(self, metric_name, role['resources'][key_name], tags=role_tags)
 
-            stats_metrics = self._get_master_stats(url, timeout)
+            stats_metrics = results.get('stats')
             if stats_metrics is not None:
                 metrics = [self.SYSTEM_METRICS]
                 if self.leader:
@@ -224,5 +247,17 @@ class MesosMaster(AgentCheck):
                     for key_name, (metric_name, metric_func) in m.iteritems():
                         metric_func(self, metric_name, stats_metrics[key_name], tags=tags)
 
+            urls = {'stats': url + self._get_stats_endpoint(), 'roles': url + '/roles.json'}
+            for key in ('roles', 'stats'):
+                if key not in errors:
+                    continue
+                error = errors[key]
+                if isinstance(error, FetchTimeout):
+                    # The request didn't even time out before the deadline
+                    error = MesosRequestError(urls[key], "%s seconds timeout when hitting %s" % (timeout, urls[key]))
+                elif not isinstance(error, MesosRequestError):
+                    error = MesosRequestError(urls[key], str(error))
+                self._report_request_error(error)
+
 
         self.service_check_needed = True
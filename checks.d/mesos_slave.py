@@ -7,6 +7,7 @@ import requests
 
 # project
 from checks import AgentCheck, CheckException
+from utils.http import session_pool
 
 DEFAULT_MASTER_PORT = 5050
 
@@ -91,7 +92,7 @@ class MesosSlave(AgentCheck):
         msg = None
         status = None
         try:
-            r = requests.get(url, timeout=timeout)
+            r = session_pool.get(url, timeout=timeout)
             if r.status_code != 200:
                 status = AgentCheck.CRITICAL
                 msg = "Got %s when hitting %s" % (r.status_code, url)
@@ -1,4 +1,5 @@
 # stdlib
+import functools
 import re
 import time
 
@@ -10,6 +11,10 @@ from checks import AgentCheck
 from util import get_hostname
 
 DEFAULT_TIMEOUT = 30
+# Databases whose stats are fetched concurrently
+DEFAULT_DBSTATS_THREADS = 8
+# Interval at which the list of databases is refreshed, in seconds
+DEFAULT_DATABASES_REFRESH_INTERVAL = 300
 GAUGE = AgentCheck.gauge
 RATE = AgentCheck.rate
 
@@ -333,10 +338,98 @@ class MongoDb(AgentCheck):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
         self._last_state_by_server = {}
         self.metrics_to_collect_by_instance = {}
+        self.metric_paths_by_instance = {}
+
+        # (server, replica set) -> MongoClient, reused across runs
+        self.clients = {}
+        # server -> (refresh time, database names)
+        self.database_names = {}
 
     def get_library_versions(self):
         return {"pymongo": pymongo.version}
 
+    def stop(self):
+        for key in self.clients.keys():
+            self._close_client(key)
+
+    def _get_client(self, key):
+        """
+        Return the client opened by a previous run for `key` if the server
+        still answers it, None otherwise.
+        """
+        if key not in self.clients:
+            return None
+        cli = self.clients[key]
+        try:
+            self._ping(cli)
+        except Exception:
+            self.log.debug("Mongo: connection lost, reconnecting", exc_info=True)
+            self._close_client(key)
+            return None
+        return cli
+
+    def _ping(self, cli):
+        cli['admin'].command('ping', read_preference=cli.read_preference)
+
+    def _close_client(self, key):
+        cli = self.clients.pop(key)
+        try:
+            cli.close()
+        except Exception:
+            self.log.debug("Mongo: error closing client", exc_info=True)
+
+    def _connect(self, server, db_name, username, password, service_check_tags,
+                 **client_params):
+        """
+        Return a client of the server, authenticated on `db_name` if
+        credentials are given, reused across runs until it fails.
+        """
+        key = (server, client_params.get('replicaset'))
+        cli = self._get_client(key)
+        if cli is not None:
+            return cli
+
+        cli = None
+        try:
+            cli = pymongo.mongo_client.MongoClient(server, **client_params)
+            db = cli[db_name]
+            # The client connects in the background, make sure the server
+            # answers it
+            self._ping(cli)
+        except Exception:
+            if cli is not None:
+                cli.close()
+            self.service_check(
+                self.SERVICE_CHECK_NAME,
+                AgentCheck.CRITICAL,
+                tags=service_check_tags)
+            raise
+
+        if username is not None and password is not None and \
+                not db.authenticate(username, password):
+            cli.close()
+            message = "Mongo: cannot connect with config %s" % server
+            self.service_check(
+                self.SERVICE_CHECK_NAME,
+                AgentCheck.CRITICAL,
+                tags=service_check_tags,
+                message=message)
+            raise Exception(message)
+
+        self.clients[key] = cli
+        return cli
+
+    def _get_database_names(self, server, cli, refresh_interval):
+        """
+        Return the names of the databases of the server, listed again every
+        `refresh_interval` seconds only.
+        """
+        refreshed, names = self.database_names.get(server, (None, None))
+        if names is None or time.time() - refreshed >= refresh_interval:
+            names = cli.database_names()
+            self.database_names[server] = (time.time(), names)
+        return names
+
     def check_last_state(self, state, clean_server_name, agentConfig):
         if self._last_state_by_server.get(clean_server_name, -1) != state:
             self._last_state_by_server[clean_server_name] = state
@@ -423,6 +516,37 @@ class MongoDb(AgentCheck):
                 self._build_metric_list_to_collect(additional_metrics)
         return self.metrics_to_collect_by_instance[instance_key]
 
+    def _get_metric_paths(self, instance_key, metrics_to_collect):
+        """
+        Return and cache the `serverStatus`, `dbstats` and `top` metrics to
+        collect, as lists of `(metric_name, path, submit_method, alias)` tuples
+        where `path` is the list of the keys of the metric in the results.
+        """
+        if instance_key not in self.metric_paths_by_instance:
+            status_metrics = []
+            dbstats_metrics = []
+            top_metrics = []
+
+            for metric_name in metrics_to_collect:
+                # each metric is of the form: x.y.z with z optional
+                # and can be found at status[x][y][z]
+                path = metric_name.split(".")
+                submit_method, metric_name_alias = \
+                    self._resolve_metric(metric_name, metrics_to_collect)
+                if metric_name.startswith('stats.'):
+                    dbstats_metrics.append((metric_name, path[1:2], submit_method, metric_name_alias))
+                elif not metric_name.startswith('stats'):
+                    status_metrics.append((metric_name, path, submit_method, metric_name_alias))
+
+                if metric_name in self.TOP_METRICS:
+                    submit_method, metric_name_alias = \
+                        self._resolve_metric(metric_name, metrics_to_collect, prefix="usage")
+                    top_metrics.append((metric_name, path, submit_method, metric_name_alias))
+
+            self.metric_paths_by_instance[instance_key] = \
+                (status_metrics, dbstats_metrics, top_metrics)
+        return self.metric_paths_by_instance[instance_key]
+
     def _resolve_metric(self, original_metric_name, metrics_to_collect, prefix=""):
         """
         Return the submit method and the metric name to use.
@@ -521,36 +645,22 @@ class MongoDb(AgentCheck):
                 "port:%s" % port
             ]
 
-        do_auth = True
         if username is None or password is None:
             self.log.debug("Mongo: cannot extract username and password from config %s" % server)
-            do_auth = False
 
         timeout = float(instance.get('timeout', DEFAULT_TIMEOUT)) * 1000
-        try:
-            cli = pymongo.mongo_client.MongoClient(
-                server,
-                socketTimeoutMS=timeout,
-                read_preference=pymongo.ReadPreference.PRIMARY_PREFERRED,
-                **ssl_params)
-            # some commands can only go against the admin DB
-            admindb = cli['admin']
-            db = cli[db_name]
-        except Exception:
-            self.service_check(
-                self.SERVICE_CHECK_NAME,
-                AgentCheck.CRITICAL,
-                tags=service_check_tags)
-            raise
-
-        if do_auth and not db.authenticate(username, password):
-            message = "Mongo: cannot connect with config %s" % server
-            self.service_check(
-                self.SERVICE_CHECK_NAME,
-                AgentCheck.CRITICAL,
-                tags=service_check_tags,
-                message=message)
-            raise Exception(message)
+        dbstats_threads = int(instance.get('dbstats_threads', DEFAULT_DBSTATS_THREADS))
+        databases_refresh_interval = float(instance.get('databases_refresh_interval',
+                                                        DEFAULT_DATABASES_REFRESH_INTERVAL))
+
+        cli = self._connect(
+            server, db_name, username, password, service_check_tags,
+            socketTimeoutMS=timeout,
+            read_preference=pymongo.ReadPreference.PRIMARY_PREFERRED,
+            **ssl_params)
+        # some commands can only go against the admin DB
+        admindb = cli['admin']
+        db = cli[db_name]
 
         self.service_check(
             self.SERVICE_CHECK_NAME,
@@ -570,7 +680,6 @@ class MongoDb(AgentCheck):
         # http://www.mongodb.org/display/DOCS/Replica+Set+Commands#ReplicaSetCommands-replSetGetStatus  # noqa
         try:
             data = {}
-            dbnames = []
 
             replSet = admindb.command('replSetGetStatus')
             if replSet:
@@ -579,23 +688,14 @@ class MongoDb(AgentCheck):
 
                 # need a new connection to deal with replica sets
                 setname = replSet.get('set')
-                cli = pymongo.mongo_client.MongoClient(
-                    server,
+                cli = self._connect(
+                    server, db_name, username, password, service_check_tags,
                     socketTimeoutMS=timeout,
                     replicaset=setname,
                     read_preference=pymongo.ReadPreference.NEAREST,
                     **ssl_params)
                 db = cli[db_name]
 
-                if do_auth and not db.authenticate(username, password):
-                    message = ("Mongo: cannot connect with config %s" % server)
-                    self.service_check(
-                        self.SERVICE_CHECK_NAME,
-                        AgentCheck.CRITICAL,
-                        tags=service_check_tags,
-                        message=message)
-                    raise Exception(message)
-
                 # find nodes: master and current node (ourself)
                 for member in replSet.get('members'):
                     if member.get('self'):
@@ -641,25 +741,29 @@ class MongoDb(AgentCheck):
         except KeyError:
             pass
 
-        dbnames = cli.database_names()
-        for db_n in dbnames:
-            db_aux = cli[db_n]
-            dbstats[db_n] = {'stats': db_aux.command('dbstats')}
+        # Fetch the stats of the other databases concurrently
+        dbnames = self._get_database_names(server, cli, databases_refresh_interval)
+        calls = dict(
+            (db_n, functools.partial(cli[db_n].command, 'dbstats'))
+            for db_n in dbnames if db_n != db_name
+        )
+        results, errors = self.fetch_concurrently(calls, timeout / 1000, dbstats_threads)
+        for db_n, db_stats in results.iteritems():
+            dbstats[db_n] = {'stats': db_stats}
+        for db_n, error in errors.iteritems():
+            self.warning("Mongo: failed to get the stats of database %s: %s" % (db_n, error))
+
+        status_metrics, dbstats_metrics, top_metrics = \
+            self._get_metric_paths(server, metrics_to_collect)
 
         # Go through the metrics and save the values
-        for metric_name in metrics_to_collect:
-            # each metric is of the form: x.y.z with z optional
-            # and can be found at status[x][y][z]
+        for metric_name, path, submit_method, metric_name_alias in status_metrics:
             value = status
-
-            if metric_name.startswith('stats'):
+            try:
+                for c in path:
+                    value = value[c]
+            except KeyError:
                 continue
-            else:
-                try:
-                    for c in metric_name.split("."):
-                        value = value[c]
-                except KeyError:
-                    continue
 
             # value is now status[x][y][z]
             if not isinstance(value, (int, long, float)):
@@ -668,16 +772,13 @@ class MongoDb(AgentCheck):
                     .format(metric_name, type(value)))
 
             # Submit the metric
-            submit_method, metric_name_alias = self._resolve_metric(metric_name, metrics_to_collect)
             submit_method(self, metric_name_alias, value, tags=tags)
 
         for st, value in dbstats.iteritems():
-            for metric_name in metrics_to_collect:
-                if not metric_name.startswith('stats.'):
-                    continue
-
+            metrics_tags = tags + ['cluster:db:%s' % st]
+            for metric_name, path, submit_method, metric_name_alias in dbstats_metrics:
                 try:
-                    val = value['stats'][metric_name.split('.')[1]]
+                    val = value['stats'][path[0]]
                 except KeyError:
                     continue
 
@@ -689,9 +790,6 @@ class MongoDb(AgentCheck):
                     )
 
                 # Submit the metric
-                submit_method, metric_name_alias = \
-                    self._resolve_metric(metric_name, metrics_to_collect)
-                metrics_tags = tags + ['cluster:db:%s' % st]
                 submit_method(self, metric_name_alias, val, tags=metrics_tags)
 
         # Report the usage metrics for dbs/collections
@@ -707,12 +805,12 @@ class MongoDb(AgentCheck):
                     ns_tags = tags + ["db:%s" % dbname, "collection:%s" % collname]
 
                     # iterate over DBTOP metrics
-                    for m in self.TOP_METRICS:
+                    for m, path, submit_method, metric_name_alias in top_metrics:
                         # each metric is of the form: x.y.z with z optional
                         # and can be found at ns_metrics[x][y][z]
                         value = ns_metrics
                         try:
-                            for c in m.split("."):
+                            for c in path:
                                 value = value[c]
                         except Exception:
                             continue
@@ -725,8 +823,6 @@ class MongoDb(AgentCheck):
                             )
 
                         # Submit the metric
-                        submit_method, metric_name_alias = \
-                            self._resolve_metric(m, metrics_to_collect, prefix="usage")
                         submit_method(self, metric_name_alias, value, tags=ns_tags)
             except Exception, e:
                 self.log.warning('Failed to record `top` metrics %s' % str(e))
@@ -1,5 +1,6 @@
 # stdlib
 import re
+import time
 import traceback
 from contextlib import closing, contextmanager
 from collections import defaultdict
@@ -21,6 +22,9 @@ RATE = "rate"
 COUNT = "count"
 MONOTONIC = "monotonic_count"
 
+# Connections are kept across runs, and reopened when older than this, in seconds
+DEFAULT_CONNECTION_MAX_AGE = 600
+
 # Vars found in "SHOW STATUS;"
 STATUS_VARS = {
     # Command Metrics
@@ -274,8 +278,12 @@ class MySql(AgentCheck):
 
     def __init__(self, name, init_config, agentConfig, instances=None):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
-        self.mysql_version = {}
         self.qcache_stats = {}
+        # connection parameters -> (connection, time it was opened)
+        self.connections = {}
+        # connection -> results of the version and engine probes made on it,
+        # valid for the lifetime of the connection
+        self.connection_probes = {}
 
     def get_library_versions(self):
         return {"pymysql": pymysql.__version__}
@@ -289,8 +297,11 @@ class MySql(AgentCheck):
         if (not host or not user) and not defaults_file:
             raise Exception("Mysql host and user are needed.")
 
+        max_age = float(instance.get('connection_max_age', self.init_config.get(
+            'connection_max_age', DEFAULT_CONNECTION_MAX_AGE)))
+
         with self._connect(host, port, mysql_sock, user,
-                           password, defaults_file, ssl) as db:
+                           password, defaults_file, ssl, max_age) as db:
             try:
                 # Metadata collection
                 self._collect_metadata(db, host)
@@ -350,55 +361,112 @@ class MySql(AgentCheck):
 
         return None
 
+    def stop(self):
+        for key in self.connections.keys():
+            self._close_connection(key)
+
+    def _get_connection(self, key, max_age):
+        """
+        Return the connection opened by a previous run for `key` if it's
+        still alive and younger than `max_age`, None otherwise.
+        """
+        if key not in self.connections:
+            return None
+        db, opened = self.connections[key]
+        if time.time() - opened >= max_age:
+            self.log.debug("Reopening MySQL connection older than %ss", max_age)
+            self._close_connection(key)
+            return None
+        try:
+            db.ping(False)
+        except Exception:
+            self.log.debug("MySQL connection lost, reconnecting", exc_info=True)
+            self._close_connection(key)
+            return None
+        return db
+
+    def _close_connection(self, key):
+        db, _ = self.connections.pop(key)
+        self.connection_probes.pop(db, None)
+        try:
+            db.close()
+        except Exception:
+            self.log.debug("Error closing MySQL connection", exc_info=True)
+
+    def _open_connection(self, host, port, mysql_sock, user, password, defaults_file, ssl):
+        ssl = dict(ssl) if ssl else None
+
+        if defaults_file != '':
+            return pymysql.connect(read_default_file=defaults_file, ssl=ssl)
+        elif mysql_sock != '':
+            return pymysql.connect(
+                unix_socket=mysql_sock,
+                user=user,
+                passwd=password
+            )
+        elif port:
+            return pymysql.connect(
+                host=host,
+                port=port,
+                user=user,
+                passwd=password,
+                ssl=ssl
+            )
+        else:
+            return pymysql.connect(
+                host=host,
+                user=user,
+                passwd=password,
+                ssl=ssl
+            )
+
     @contextmanager
-    def _connect(self, host, port, mysql_sock, user, password, defaults_file, ssl):
+    def _connect(self, host, port, mysql_sock, user, password, defaults_file, ssl,
+                 max_age=DEFAULT_CONNECTION_MAX_AGE):
+        """
+        Yield a connection to the server, reused across runs until it's
+        `max_age` seconds old or fails. With a `max_age` of 0, the connection
+        is closed at the end of the run.
+        """
         self.service_check_tags = [
             'server:{0}'.format(host),
             'port:{0}'.format(port)
         ]
 
-        db = None
+        key = (host, port, mysql_sock, user, defaults_file)
         try:
-            ssl = dict(ssl) if ssl else None
-
-            if defaults_file != '':
-                db = pymysql.connect(read_default_file=defaults_file, ssl=ssl)
-            elif mysql_sock != '':
-                db = pymysql.connect(
-                    unix_socket=mysql_sock,
-                    user=user,
-                    passwd=password
-                )
+            db = self._get_connection(key, max_age)
+            if db is None:
+                db = self._open_connection(host, port, mysql_sock, user, password, defaults_file, ssl)
+                self.connections[key] = (db, time.time())
+                self.log.debug("Connected to MySQL")
+            if defaults_file == '' and mysql_sock != '':
                 self.service_check_tags = [
                     'server:{0}'.format(mysql_sock),
                     'port:unix_socket'
                 ]
-            elif port:
-                db = pymysql.connect(
-                    host=host,
-                    port=port,
-                    user=user,
-                    passwd=password,
-                    ssl=ssl
-                )
-            else:
-                db = pymysql.connect(
-                    host=host,
-                    user=user,
-                    passwd=password,
-                    ssl=ssl
-                )
-            self.log.debug("Connected to MySQL")
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK,
                                tags=self.service_check_tags)
             yield db
         except Exception:
             self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL,
                                tags=self.service_check_tags)
+            # Don't reuse a connection which may be in a bad state
+            if key in self.connections:
+                self._close_connection(key)
             raise
-        finally:
-            if db:
-                db.close()
+        else:
+            if max_age <= 0:
+                self._close_connection(key)
+
+    def _probe(self, db, name, probe):
+        """
+        Return the result of `probe`, only run once per connection.
+        """
+        probes = self.connection_probes.setdefault(db, {})
+        if name not in probes:
+            probes[name] = probe()
+        return probes[name]
 
     def _collect_metrics(self, host, db, tags, options, queries):
 
@@ -621,11 +689,9 @@ class MySql(AgentCheck):
         return version > compat_version
 
     def _get_version(self, db, host):
-        hostkey = self._get_host_key()
-        if hostkey in self.mysql_version:
-            version = self.mysql_version[hostkey]
-            return version
+        return self._probe(db, 'version', lambda: self._query_version(db))
 
+    def _query_version(self, db):
         # Get MySQL version
         with closing(db.cursor()) as cursor:
             cursor.execute('SELECT VERSION()')
@@ -636,7 +702,6 @@ class MySql(AgentCheck):
             # http://dev.mysql.com/doc/refman/4.1/en/information-functions.html#function_version
             version = result[0].split('-')
             version = version[0].split('.')
-            self.mysql_version[hostkey] = version
             return version
 
     def _collect_all_scalars(self, key, dictionary):
@@ -795,6 +860,9 @@ class MySql(AgentCheck):
             return binary_log_space
 
     def _is_innodb_engine_enabled(self, db):
+        return self._probe(db, 'innodb_enabled', lambda: self._query_innodb_engine_enabled(db))
+
+    def _query_innodb_engine_enabled(self, db):
         # Whether InnoDB engine is available or not can be found out either
         # from the output of SHOW ENGINES or from information_schema.ENGINES
         # table. Later is choosen because that involves no string parsing.
@@ -4,7 +4,7 @@ import re
 
 # project
 from checks import AgentCheck
-from utils.tailfile import TailFile
+from utils.tailfile import get_tail_options, TailFile
 
 # fields order for each event type, as named tuples
 EVENT_FIELDS = {
@@ -64,6 +64,7 @@ class Nagios(AgentCheck):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
         self.nagios_tails = {}
         check_freq = init_config.get("check_freq", 15)
+        tail_options = get_tail_options(agentConfig)
         if instances is not None:
             for instance in instances:
                 tailers = []
@@ -101,6 +102,7 @@ class Nagios(AgentCheck):
                         event_func=self.event,
                         gauge_func=self.gauge,
                         freq=check_freq,
+                        tail_options=tail_options,
                         passive_checks=instance.get('passive_checks_events', False)))
                 if 'host_perfdata_file' in nagios_conf and \
                    'host_perfdata_file_template' in nagios_conf and \
@@ -113,7 +115,8 @@ class Nagios(AgentCheck):
                         hostname=self.hostname,
                         event_func=self.event,
                         gauge_func=self.gauge,
-                        freq=check_freq))
+                        freq=check_freq,
+                        tail_options=tail_options))
                 if 'service_perfdata_file' in nagios_conf and \
                    'service_perfdata_file_template' in nagios_conf and \
                    instance.get('collect_service_performance_data', False):
@@ -125,7 +128,8 @@ class Nagios(AgentCheck):
                         hostname=self.hostname,
                         event_func=self.event,
                         gauge_func=self.gauge,
-                        freq=check_freq))
+                        freq=check_freq,
+                        tail_options=tail_options))
 
                 self.nagios_tails[instance_key] = tailers
 
@@ -175,7 +179,8 @@ class Nagios(AgentCheck):
 
 class NagiosTailer(object):
 
-    def __init__(self, log_path, file_template, logger, hostname, event_func, gauge_func, freq):
+    def __init__(self, log_path, file_template, logger, hostname, event_func, gauge_func, freq,
+                 tail_options=None):
         '''
         :param log_path: string, path to the file to parse
         :param file_template: string, format of the perfdata file
@@ -184,6 +189,7 @@ class NagiosTailer(object):
         :param event_func: function to create event, should accept dict
         :param gauge_func: function to report a gauge
         :param freq: int, size of bucket to aggregate perfdata metrics
+        :param tail_options: dict, options of the TailFile tailing the file
         '''
         self.log_path = log_path
         self.log = logger
@@ -198,7 +204,7 @@ class NagiosTailer(object):
         if file_template is not None:
             self.compile_file_template(file_template)
 
-        self.tail = TailFile(self.log, self.log_path, self._parse_line)
+        self.tail = TailFile(self.log, self.log_path, self._parse_line, **(tail_options or {}))
         self.gen = self.tail.tail(line_by_line=False, move_end=True)
         self.gen.next()
 
@@ -228,7 +234,7 @@ class NagiosTailer(object):
 class NagiosEventLogTailer(NagiosTailer):
 
     def __init__(self, log_path, file_template, logger, hostname, event_func,
-                 gauge_func, freq, passive_checks=False):
+                 gauge_func, freq, tail_options=None, passive_checks=False):
         '''
         :param log_path: string, path to the file to parse
         :param file_template: string, format of the perfdata file
@@ -237,12 +243,14 @@ class NagiosEventLogTailer(NagiosTailer):
         :param event_func: function to create event, should accept dict
         :param gauge_func: function to report a gauge
         :param freq: int, size of bucket to aggregate perfdata metrics
+        :param tail_options: dict, options of the TailFile tailing the file
         :param passive_checks: bool, enable or not passive checks events
         '''
         self.passive_checks = passive_checks
         super(NagiosEventLogTailer, self).__init__(
             log_path, file_template,
-            logger, hostname, event_func, gauge_func, freq
+            logger, hostname, event_func, gauge_func, freq,
+            tail_options=tail_options
         )
 
     def _parse_line(self, line):
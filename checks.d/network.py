@@ -2,6 +2,9 @@
 Collects network metrics.
 """
 # stdlib
+from collections import Counter
+import errno
+import os
 import re
 
 # project
@@ -18,6 +21,16 @@ BSD_TCP_METRICS = [
     (re.compile("^\s*(\d+) packets received\s*$"), 'system.net.tcp.rcv_packs')
 ]
 
+DEFAULT_PROCFS_PATH = '/proc'
+
+# Files of the socket tables in the procfs net directory, by protocol
+PROC_NET_FILES = {
+    'tcp4': 'tcp',
+    'tcp6': 'tcp6',
+    'udp4': 'udp',
+    'udp6': 'udp6',
+}
+
 SOLARIS_TCP_METRICS = [
     (re.compile("\s*tcpRetransSegs\s*=\s*(\d+)\s*"), 'system.net.tcp.retrans_segs'),
     (re.compile("\s*tcpOutDataSegs\s*=\s*(\d+)\s*"), 'system.net.tcp.in_segs'),
@@ -55,6 +68,20 @@ class Network(AgentCheck):
             "LAST_ACK": "closing",
             "LISTEN": "listening",
             "CLOSING": "closing",
+        },
+        # `st` column of /proc/net/tcp{,6}, see include/net/tcp_states.h
+        "proc": {
+            "01": "established",
+            "02": "opening",
+            "03": "opening",
+            "04": "closing",
+            "05": "closing",
+            "06": "time_wait",
+            "07": "closing",
+            "08": "closing",
+            "09": "closing",
+            "0A": "listening",
+            "0B": "closing",
         }
     }
 
@@ -140,47 +167,16 @@ class Network(AgentCheck):
 
     def _check_linux(self, instance):
         if self._collect_cx_state:
+            procfs_path = self.agentConfig.get('procfs_path', DEFAULT_PROCFS_PATH)
             try:
-                self.log.debug("Using `ss` to collect connection state")
-                # Try using `ss` for increased performance over `netstat`
-                for ip_version in ['4', '6']:
-                    # Call `ss` for each IP version because there's no built-in way of distinguishing
-                    # between the IP versions in the output
-                    output, _, _ = get_subprocess_output(["ss", "-n", "-u", "-t", "-a", "-{0}".format(ip_version)], self.log)
-                    lines = output.splitlines()
-                    # Netid  State      Recv-Q Send-Q     Local Address:Port       Peer Address:Port
-                    # udp    UNCONN     0      0              127.0.0.1:8125                  *:*
-                    # udp    ESTAB      0      0              127.0.0.1:37036         127.0.0.1:8125
-                    # udp    UNCONN     0      0        fe80::a00:27ff:fe1c:3c4:123          :::*
-                    # tcp    TIME-WAIT  0      0          90.56.111.177:56867        46.105.75.4:143
-                    # tcp    LISTEN     0      0       ::ffff:127.0.0.1:33217  ::ffff:127.0.0.1:7199
-                    # tcp    ESTAB      0      0       ::ffff:127.0.0.1:58975  ::ffff:127.0.0.1:2181
-
-                    metrics = self._parse_linux_cx_state(lines[1:], self.TCP_STATES['ss'], 1, ip_version=ip_version)
-                    # Only send the metrics which match the loop iteration's ip version
-                    for stat, metric in self.CX_STATE_GAUGE.iteritems():
-                        if stat[0].endswith(ip_version):
-                            self.gauge(metric, metrics.get(metric))
-
-            except OSError:
-                self.log.info("`ss` not found: using `netstat` as a fallback")
-                output, _, _ = get_subprocess_output(["netstat", "-n", "-u", "-t", "-a"], self.log)
-                lines = output.splitlines()
-                # Active Internet connections (w/o servers)
-                # Proto Recv-Q Send-Q Local Address           Foreign Address         State
-                # tcp        0      0 46.105.75.4:80          79.220.227.193:2032     SYN_RECV
-                # tcp        0      0 46.105.75.4:143         90.56.111.177:56867     ESTABLISHED
-                # tcp        0      0 46.105.75.4:50468       107.20.207.175:443      TIME_WAIT
-                # tcp6       0      0 46.105.75.4:80          93.15.237.188:58038     FIN_WAIT2
-                # tcp6       0      0 46.105.75.4:80          79.220.227.193:2029     ESTABLISHED
-                # udp        0      0 0.0.0.0:123             0.0.0.0:*
-                # udp6       0      0 :::41458                :::*
-
-                metrics = self._parse_linux_cx_state(lines[2:], self.TCP_STATES['netstat'], 5)
+                self.log.debug("Using %s/net to collect connection state", procfs_path)
+                metrics = self._parse_proc_net_cx_state(procfs_path)
+            except IOError:
+                self.log.info("Unable to read the socket tables of %s/net: using `ss` as a fallback", procfs_path)
+                self._check_linux_cx_state_subprocess()
+            else:
                 for metric, value in metrics.iteritems():
                     self.gauge(metric, value)
-            except SubprocessOutputEmptyError:
-                self.log.exception("Error collecting connection stats.")
 
         proc = open('/proc/net/dev', 'r')
         try:
@@ -269,6 +265,88 @@ class Network(AgentCheck):
             # On Openshift, /proc/net/snmp is only readable by root
             self.log.debug("Unable to read /proc/net/snmp.")
 
+    def _check_linux_cx_state_subprocess(self):
+        try:
+            self.log.debug("Using `ss` to collect connection state")
+            # Try using `ss` for increased performance over `netstat`
+            for ip_version in ['4', '6']:
+                # Call `ss` for each IP version because there's no built-in way of distinguishing
+                # between the IP versions in the output
+                output, _, _ = get_subprocess_output(["ss", "-n", "-u", "-t", "-a", "-{0}".format(ip_version)], self.log)
+                lines = output.splitlines()
+                # Netid  State      Recv-Q Send-Q     Local Address:Port       Peer Address:Port
+                # udp    UNCONN     0      0              127.0.0.1:8125                  *:*
+                # udp    ESTAB      0      0              127.0.0.1:37036         127.0.0.1:8125
+                # udp    UNCONN     0      0        fe80::a00:27ff:fe1c:3c4:123          :::*
+                # tcp    TIME-WAIT  0      0          90.56.111.177:56867        46.105.75.4:143
+                # tcp    LISTEN     0      0       ::ffff:127.0.0.1:33217  ::ffff:127.0.0.1:7199
+                # tcp    ESTAB      0      0       ::ffff:127.0.0.1:58975  ::ffff:127.0.0.1:2181
+
+                metrics = self._parse_linux_cx_state(lines[1:], self.TCP_STATES['ss'], 1, ip_version=ip_version)
+                # Only send the metrics which match the loop iteration's ip version
+                for stat, metric in self.CX_STATE_GAUGE.iteritems():
+                    if stat[0].endswith(ip_version):
+                        self.gauge(metric, metrics.get(metric))
+
+        except OSError:
+            self.log.info("`ss` not found: using `netstat` as a fallback")
+            output, _, _ = get_subprocess_output(["netstat", "-n", "-u", "-t", "-a"], self.log)
+            lines = output.splitlines()
+            # Active Internet connections (w/o servers)
+            # Proto Recv-Q Send-Q Local Address           Foreign Address         State
+            # tcp        0      0 46.105.75.4:80          79.220.227.193:2032     SYN_RECV
+            # tcp        0      0 46.105.75.4:143         90.56.111.177:56867     ESTABLISHED
+            # tcp        0      0 46.105.75.4:50468       107.20.207.175:443      TIME_WAIT
+            # tcp6       0      0 46.105.75.4:80          93.15.237.188:58038     FIN_WAIT2
+            # tcp6       0      0 46.105.75.4:80          79.220.227.193:2029     ESTABLISHED
+            # udp        0      0 0.0.0.0:123             0.0.0.0:*
+            # udp6       0      0 :::41458                :::*
+
+            metrics = self._parse_linux_cx_state(lines[2:], self.TCP_STATES['netstat'], 5)
+            for metric, value in metrics.iteritems():
+                self.gauge(metric, value)
+        except SubprocessOutputEmptyError:
+            self.log.exception("Error collecting connection stats.")
+
+    def _parse_proc_net_cx_state(self, procfs_path):
+        """
+        Count the connections by state from the socket tables of procfs,
+        without forking `ss` or `netstat`. Returns a dict metric_name -> value.
+        Raises IOError when the tables can't be read.
+        """
+        metrics = dict.fromkeys(self.CX_STATE_GAUGE.values(), 0)
+        tcp_states = self.TCP_STATES['proc']
+        for protocol, file_name in PROC_NET_FILES.iteritems():
+            try:
+                counts = self._count_proc_net_states(os.path.join(procfs_path, 'net', file_name))
+            except IOError as e:
+                if e.errno == errno.ENOENT and protocol.endswith('6'):
+                    # IPv6 is disabled
+                    continue
+                raise
+
+            if protocol.startswith('udp'):
+                metrics[self.CX_STATE_GAUGE[protocol, 'connections']] += sum(counts.itervalues())
+                continue
+            for state, count in counts.iteritems():
+                if state in tcp_states:
+                    metrics[self.CX_STATE_GAUGE[protocol, tcp_states[state]]] += count
+
+        return metrics
+
+    @staticmethod
+    def _count_proc_net_states(path):
+        """
+        Count the sockets of a /proc/net/{tcp,udp}{,6} table by state,
+        streaming the file and only splitting the first columns of each line.
+        """
+        #   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+        #    0: 0100007F:18EB 00000000:0000 0A 00000000:00000000 00:00000000 00000000   108        0 14963 1 ...
+        #    1: 6F5CE159:8D5E 0B41692E:01BB 01 00000000:00000000 02:000A8C1A 00000000  1000        0 81724 2 ...
+        with open(path, 'r') as f:
+            f.readline()
+            return Counter(line.split(None, 4)[3] for line in f)
+
     # Parse the output of the command that retrieves the connection state (either `ss` or `netstat`)
     # Returns a dict metric_name -> value
     def _parse_linux_cx_state(self, lines, tcp_states, state_col, ip_version=None):
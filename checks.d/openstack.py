@@ -1,10 +1,12 @@
 # stdlib
 from datetime import datetime, timedelta
+import functools
 from urlparse import urljoin
 
 # project
-from checks import AgentCheck
+from checks import AgentCheck, FetchTimeout
 from util import get_hostname
+from utils.http import session_pool
 
 # 3p
 import requests
@@ -17,6 +19,9 @@ DEFAULT_NOVA_API_VERSION = 'v2.1'
 DEFAULT_NEUTRON_API_VERSION = 'v2.0'
 
 DEFAULT_API_REQUEST_TIMEOUT = 5 # seconds
+# Time given to the requests made concurrently for all the servers or all the
+# networks, the ones still running past it are skipped for this run
+DEFAULT_API_FETCH_TIMEOUT = 30 # seconds
 
 NOVA_HYPERVISOR_METRICS = [
     'current_workload',
@@ -217,7 +222,7 @@ class OpenStackProjectScope(object):
         auth_url = urljoin(keystone_server_url, "{0}/auth/tokens".format(DEFAULT_KEYSTONE_API_VERSION))
         headers = {'Content-Type': 'application/json'}
 
-        resp = requests.post(auth_url, headers=headers, data=json.dumps(payload), verify=ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT)
+        resp = session_pool.post(auth_url, headers=headers, data=json.dumps(payload), verify=ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT)
         resp.raise_for_status()
 
         return resp
@@ -348,7 +353,7 @@ class OpenStackCheck(AgentCheck):
         Raises specialized Exceptions for commonly encountered error codes
         """
         try:
-            resp = requests.get(url, headers=headers, verify=verify, params=params, timeout=DEFAULT_API_REQUEST_TIMEOUT)
+            resp = session_pool.get(url, headers=headers, verify=verify, params=params, timeout=DEFAULT_API_REQUEST_TIMEOUT)
             resp.raise_for_status()
         except requests.exceptions.HTTPError:
             if resp.status_code == 401:
@@ -375,7 +380,8 @@ class OpenStackCheck(AgentCheck):
         for i_key, scope in self.instance_map.items():
             if scope is scope_to_delete:
                 self.log.debug("Deleting current scope: %s", i_key)
-                del self.instance_map[i_key]
+                # Concurrent requests failing to authenticate may all get here
+                self.instance_map.pop(i_key, None)
 
     def get_scope_for_instance(self, instance):
         i_key = self._instance_key(instance)
@@ -422,8 +428,17 @@ class OpenStackCheck(AgentCheck):
             self.warning("Your check is not configured to monitor any networks.\n" +
                          "Please list `network_ids` under your init_config")
 
+        networks, errors = self.fetch_concurrently(
+            dict((nid, functools.partial(self.get_network_details, nid)) for nid in network_ids),
+            DEFAULT_API_FETCH_TIMEOUT
+        )
+        for nid in network_ids:
+            if nid in networks:
+                self._submit_network_service_check(nid, networks[nid])
+
         for nid in network_ids:
-            self.get_stats_for_single_network(nid)
+            if nid in errors:
+                raise errors[nid]
 
     def get_all_network_ids(self):
         url = '{0}/{1}/networks'.format(self.get_neutron_endpoint(), DEFAULT_NEUTRON_API_VERSION)
@@ -438,11 +453,16 @@ class OpenStackCheck(AgentCheck):
             self.warning('Unable to get the list of all network ids: {0}'.format(str(e)))
         return network_ids
 
-    def get_stats_for_single_network(self, network_id):
+    def get_network_details(self, network_id):
         url = '{0}/{1}/networks/{2}'.format(self.get_neutron_endpoint(), DEFAULT_NEUTRON_API_VERSION, network_id)
         headers = {'X-Auth-Token': self.get_auth_token()}
-        net_details = self._make_request_with_auth_fallback(url, headers, verify=self._ssl_verify)
+        return self._make_request_with_auth_fallback(url, headers, verify=self._ssl_verify)
 
+    def get_stats_for_single_network(self, network_id):
+        net_details = self.get_network_details(network_id)
+        self._submit_network_service_check(network_id, net_details)
+
+    def _submit_network_service_check(self, network_id, net_details):
         service_check_tags = ['network:{0}'.format(network_id)]
 
         network_name = net_details.get('network', {}).get('name')
@@ -602,20 +622,34 @@ class OpenStackCheck(AgentCheck):
 
         return server_ids
 
-    def get_stats_for_single_server(self, server_id, tags=None):
-        def _is_valid_metric(label):
-            return label in NOVA_SERVER_METRICS or any(seg in label for seg in NOVA_SERVER_INTERFACE_SEGMENTS)
-
+    def get_server_diagnostics(self, server_id):
         url = '{0}/servers/{1}/diagnostics'.format(self.get_nova_endpoint(), server_id)
         headers = {'X-Auth-Token': self.get_auth_token()}
-        server_stats = {}
+        return self._make_request_with_auth_fallback(url, headers, verify=self._ssl_verify)
 
-        try:
-            server_stats = self._make_request_with_auth_fallback(url, headers, verify=self._ssl_verify)
-        except InstancePowerOffFailure:
-            self.warning("Server %s is powered off and cannot be monitored" % server_id)
-        except Exception as e:
-            self.warning("Unknown error when monitoring %s : %s" % (server_id, e))
+    def get_stats_for_single_server(self, server_id, tags=None):
+        self.get_stats_for_servers([server_id], tags=tags)
+
+    def get_stats_for_servers(self, server_ids, tags=None):
+        """
+        Collect the stats of the servers, their diagnostics are requested concurrently
+        """
+        servers_stats, errors = self.fetch_concurrently(
+            dict((sid, functools.partial(self.get_server_diagnostics, sid)) for sid in server_ids),
+            DEFAULT_API_FETCH_TIMEOUT
+        )
+        for server_id in server_ids:
+            error = errors.get(server_id)
+            if isinstance(error, InstancePowerOffFailure):
+                self.warning("Server %s is powered off and cannot be monitored" % server_id)
+            elif error is not None:
+                self.warning("Unknown error when monitoring %s : %s" % (server_id, error))
+
+            self._submit_server_stats(server_id, servers_stats.get(server_id), tags=tags)
+
+    def _submit_server_stats(self, server_id, server_stats, tags=None):
+        def _is_valid_metric(label):
+            return label in NOVA_SERVER_METRICS or any(seg in label for seg in NOVA_SERVER_INTERFACE_SEGMENTS)
 
         if server_stats:
             tags = tags or []
@@ -659,21 +693,29 @@ class OpenStackCheck(AgentCheck):
     ###
 
     def _send_api_service_checks(self, instance_scope):
-        # Nova
         headers = {"X-Auth-Token": instance_scope.auth_token}
 
-        try:
-            requests.get(instance_scope.service_catalog.nova_endpoint, headers=headers, verify=self._ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT)
-            self.service_check(self.COMPUTE_API_SC, AgentCheck.OK, tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
-        except (requests.exceptions.HTTPError, requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-            self.service_check(self.COMPUTE_API_SC, AgentCheck.CRITICAL, tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
-
-        # Neutron
-        try:
-            requests.get(instance_scope.service_catalog.neutron_endpoint, headers=headers, verify=self._ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT)
-            self.service_check(self.NETWORK_API_SC, AgentCheck.OK, tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
-        except (requests.exceptions.HTTPError, requests.exceptions.Timeout, requests.exceptions.ConnectionError):
-            self.service_check(self.NETWORK_API_SC, AgentCheck.CRITICAL, tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
+        # Ping Nova and Neutron at once
+        endpoints = {
+            self.COMPUTE_API_SC: instance_scope.service_catalog.nova_endpoint,
+            self.NETWORK_API_SC: instance_scope.service_catalog.neutron_endpoint,
+        }
+        calls = dict(
+            (sc_name, functools.partial(session_pool.get, endpoint, headers=headers,
+                                        verify=self._ssl_verify, timeout=DEFAULT_API_REQUEST_TIMEOUT))
+            for sc_name, endpoint in endpoints.iteritems()
+        )
+        _, errors = self.fetch_concurrently(calls, DEFAULT_API_REQUEST_TIMEOUT)
+
+        for sc_name in (self.COMPUTE_API_SC, self.NETWORK_API_SC):
+            error = errors.get(sc_name)
+            if error is None:
+                self.service_check(sc_name, AgentCheck.OK, tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
+            elif isinstance(error, (requests.exceptions.HTTPError, requests.exceptions.Timeout,
+                                    requests.exceptions.ConnectionError, FetchTimeout)):
+                self.service_check(sc_name, AgentCheck.CRITICAL, tags=["keystone_server:%s" % self.init_config.get("keystone_server_url")])
+            else:
+                raise error
 
     def ensure_auth_scope(self, instance):
         """
@@ -744,13 +786,13 @@ class OpenStackCheck(AgentCheck):
 
             host_tags = self._get_tags_for_host()
 
-            for sid in servers:
-                server_tags = ["nova_managed_server"]
-                if instance_scope.tenant_id:
-                    server_tags.append("tenant_id:%s" % instance_scope.tenant_id)
+            server_tags = ["nova_managed_server"]
+            if instance_scope.tenant_id:
+                server_tags.append("tenant_id:%s" % instance_scope.tenant_id)
 
+            for sid in servers:
                 self.external_host_tags[sid] = host_tags
-                self.get_stats_for_single_server(sid, tags=server_tags)
+            self.get_stats_for_servers(servers, tags=server_tags)
 
             if hyp:
                 self.get_stats_for_single_hypervisor(hyp, host_tags=host_tags)
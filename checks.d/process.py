@@ -1,5 +1,7 @@
 # stdlib
 from collections import defaultdict
+from contextlib import contextmanager
+import re
 import time
 
 # 3p
@@ -31,17 +33,78 @@ ATTR_TO_METRIC = {
 }
 
 
+@contextmanager
+def _no_cache():
+    yield
+
+
+def oneshot(process):
+    """
+    Context in which psutil (>= 5.0) reads the files of `process` once for
+    all the information we collect
+    """
+    try:
+        return process.oneshot()
+    except AttributeError:
+        return _no_cache()
+
+
+class ProcessMatcher(object):
+    """
+    Match processes against the search strings of several instances at once.
+    """
+    def __init__(self):
+        # process name -> names of the instances searching for it
+        self.exact_names = defaultdict(set)
+        # cmdline substring -> names of the instances searching for it
+        self.substrings = defaultdict(set)
+        # FIXME 6.x: remove with the 'All' search string
+        self.match_all = set()
+        self._substring_re = None
+
+    def add(self, name, search_string, exact_match):
+        for string in search_string:
+            if string == 'All':
+                self.match_all.add(name)
+            elif exact_match:
+                self.exact_names[string].add(name)
+            else:
+                self.substrings[string].add(name)
+        self._substring_re = None
+
+    def match(self, process_name, cmdline):
+        """
+        Return the names of the instances matching a process, its name and
+        cmdline are None if they couldn't be read.
+        """
+        matches = set(self.match_all)
+        if process_name is not None and process_name in self.exact_names:
+            matches.update(self.exact_names[process_name])
+
+        if cmdline is None or not self.substrings:
+            return matches
+        if self._substring_re is None:
+            # Cheap test of whether a cmdline has any of the substrings
+            self._substring_re = re.compile('|'.join(re.escape(s) for s in self.substrings))
+        if self._substring_re.search(cmdline):
+            for substring, names in self.substrings.iteritems():
+                if substring in cmdline:
+                    matches.update(names)
+        return matches
+
+
 class ProcessCheck(AgentCheck):
     def __init__(self, name, init_config, agentConfig, instances=None):
         AgentCheck.__init__(self, name, init_config, agentConfig, instances)
 
         # ad stands for access denied
-        # We cache the PIDs getting this error and don't iterate on them
+        # We cache the PIDs getting this error, with the fields ('name' or
+        # 'cmdline') they were denied for, and don't read these fields
         # more often than `access_denied_cache_duration`
         # This cache is for all PIDs so it's global, but it should
         # be refreshed by instance
         self.last_ad_cache_ts = {}
-        self.ad_cache = set()
+        self.ad_cache = {}
         self.access_denied_cache_duration = int(
             init_config.get(
                 'access_denied_cache_duration',
@@ -77,61 +140,125 @@ class ProcessCheck(AgentCheck):
         now = time.time()
         return now - self.last_pid_cache_ts.get(name, 0) > self.pid_cache_duration
 
+    @staticmethod
+    def _get_instance_search(instance):
+        """
+        Return the name, search strings, exact_match and ignore_denied_access
+        settings of an instance, None if it's invalid.
+        """
+        name = instance.get('name')
+        search_string = instance.get('search_string')
+        if name is None or not isinstance(search_string, list):
+            return None
+        return (name, search_string, _is_affirmative(instance.get('exact_match', True)),
+                _is_affirmative(instance.get('ignore_denied_access', True)))
+
     def find_pids(self, name, search_string, exact_match, ignore_ad=True):
         """
         Create a set of pids of selected processes.
         Search for search_string
+
+        The pids of all the instances whose pid cache expired are searched
+        for too, in the same pass over the processes.
         """
         if not self.should_refresh_pid_cache(name):
             return self.pid_cache[name]
 
-        ad_error_logger = self.log.debug
-        if not ignore_ad:
-            ad_error_logger = self.log.error
+        searches = {name: (search_string, exact_match, ignore_ad)}
+        for instance in self.instances:
+            instance_search = self._get_instance_search(instance)
+            if instance_search is None:
+                continue
+            instance_name = instance_search[0]
+            if instance_name not in searches and self.should_refresh_pid_cache(instance_name):
+                searches[instance_name] = instance_search[1:]
+
+        matching_pids, access_denied = self._search_processes(searches)
+
+        now = time.time()
+        refresh_ad_cache = any(self.should_refresh_ad_cache(n) for n in searches)
+        for instance_name, (_, _, instance_ignore_ad) in searches.iteritems():
+            # Instances which don't ignore denied accesses fail on their own run
+            if instance_name in access_denied and not instance_ignore_ad:
+                continue
+            self.pid_cache[instance_name] = matching_pids[instance_name]
+            self.last_pid_cache_ts[instance_name] = now
+            if refresh_ad_cache:
+                self.last_ad_cache_ts[instance_name] = now
 
-        refresh_ad_cache = self.should_refresh_ad_cache(name)
+        if name in access_denied and not ignore_ad:
+            raise access_denied[name]
+        return matching_pids[name]
 
-        matching_pids = set()
+    def _search_processes(self, searches):
+        """
+        Find the pids matching the search strings of several instances, as
+        a dict instance name -> set of pids, reading the name and cmdline of
+        each process only once.
+        Also return the last AccessDenied error met by each instance, as a
+        dict instance name -> error.
+        """
+        matcher = ProcessMatcher()
+        for name, (search_string, exact_match, _) in searches.iteritems():
+            matcher.add(name, search_string, exact_match)
+
+        # Instances which need each field, only they are denied access to it
+        name_searches = set().union(*matcher.exact_names.itervalues())
+        cmdline_searches = set().union(*matcher.substrings.itervalues())
+
+        refresh_ad_cache = any(self.should_refresh_ad_cache(name) for name in searches)
+
+        matching_pids = dict((name, set()) for name in searches)
+        access_denied = {}
 
         for proc in psutil.process_iter():
-            # Skip access denied processes
-            if not refresh_ad_cache and proc.pid in self.ad_cache:
+            # Skip the fields of the process we were denied access to
+            denied_fields = () if refresh_ad_cache else self.ad_cache.get(proc.pid, ())
+
+            process_name = None
+            cmdline = None
+            try:
+                if name_searches and 'name' not in denied_fields:
+                    process_name = self._read_process_field(
+                        proc, 'name', searches, name_searches, access_denied, refresh_ad_cache)
+                if cmdline_searches and 'cmdline' not in denied_fields:
+                    cmdline = self._read_process_field(
+                        proc, 'cmdline', searches, cmdline_searches, access_denied, refresh_ad_cache)
+            except psutil.NoSuchProcess:
+                self.log.warning('Process disappeared while scanning')
                 continue
 
-            found = False
-            for string in search_string:
-                try:
-                    # FIXME 6.x: All has been deprecated from the doc, should be removed
-                    if string == 'All':
-                        found = True
-                    if exact_match:
-                        if proc.name() == string:
-                            found = True
-                    else:
-                        cmdline = proc.cmdline()
-                        if string in ' '.join(cmdline):
-                            found = True
-                except psutil.NoSuchProcess:
-                    self.log.warning('Process disappeared while scanning')
-                except psutil.AccessDenied, e:
-                    ad_error_logger('Access denied to process with PID %s', proc.pid)
-                    ad_error_logger('Error: %s', e)
-                    if refresh_ad_cache:
-                        self.ad_cache.add(proc.pid)
-                    if not ignore_ad:
-                        raise
-                else:
-                    if refresh_ad_cache:
-                        self.ad_cache.discard(proc.pid)
-                    if found:
-                        matching_pids.add(proc.pid)
-                        break
-
-        self.pid_cache[name] = matching_pids
-        self.last_pid_cache_ts[name] = time.time()
-        if refresh_ad_cache:
-            self.last_ad_cache_ts[name] = time.time()
-        return matching_pids
+            if cmdline is not None:
+                cmdline = ' '.join(cmdline)
+            for name in matcher.match(process_name, cmdline):
+                matching_pids[name].add(proc.pid)
+
+        return matching_pids, access_denied
+
+    def _read_process_field(self, proc, field, searches, field_searches, access_denied, refresh_ad_cache):
+        """
+        Return the `field` of a process, or None if access to it is denied,
+        in which case the error is recorded for the `field_searches`.
+        """
+        try:
+            value = getattr(proc, field)()
+        except psutil.AccessDenied, e:
+            ad_error_logger = self.log.debug
+            if not all(searches[name][2] for name in field_searches):
+                ad_error_logger = self.log.error
+            ad_error_logger('Access denied to the %s of process with PID %s', field, proc.pid)
+            ad_error_logger('Error: %s', e)
+            if refresh_ad_cache:
+                self.ad_cache.setdefault(proc.pid, set()).add(field)
+            for name in field_searches:
+                access_denied[name] = e
+            return None
+
+        if refresh_ad_cache and proc.pid in self.ad_cache:
+            self.ad_cache[proc.pid].discard(field)
+            if not self.ad_cache[proc.pid]:
+                del self.ad_cache[proc.pid]
+        return value
 
     def psutil_wrapper(self, process, method, accessors, *args, **kwargs):
         """
@@ -200,39 +327,45 @@ class ProcessCheck(AgentCheck):
                     continue
 
             p = self.process_cache[name][pid]
+            with oneshot(p):
+                self._get_process_stats(p, new_process, st)
 
-            meminfo = self.psutil_wrapper(p, 'memory_info', ['rss', 'vms'])
-            st['rss'].append(meminfo.get('rss'))
-            st['vms'].append(meminfo.get('vms'))
+        return st
 
-            # will fail on win32 and solaris
-            shared_mem = self.psutil_wrapper(p, 'memory_info_ex', ['shared']).get('shared')
-            if shared_mem is not None and meminfo.get('rss') is not None:
-                st['real'].append(meminfo['rss'] - shared_mem)
-            else:
-                st['real'].append(None)
+    def _get_process_stats(self, p, new_process, st):
+        # psutil >= 4.0 has the shared memory in memory_info on linux
+        meminfo = self.psutil_wrapper(p, 'memory_info', ['rss', 'vms', 'shared'])
+        st['rss'].append(meminfo.get('rss'))
+        st['vms'].append(meminfo.get('vms'))
 
-            ctxinfo = self.psutil_wrapper(p, 'num_ctx_switches', ['voluntary', 'involuntary'])
-            st['ctx_swtch_vol'].append(ctxinfo.get('voluntary'))
-            st['ctx_swtch_invol'].append(ctxinfo.get('involuntary'))
+        # will fail on win32 and solaris
+        shared_mem = meminfo.get('shared')
+        if shared_mem is None:
+            shared_mem = self.psutil_wrapper(p, 'memory_info_ex', ['shared']).get('shared')
+        if shared_mem is not None and meminfo.get('rss') is not None:
+            st['real'].append(meminfo['rss'] - shared_mem)
+        else:
+            st['real'].append(None)
 
-            st['thr'].append(self.psutil_wrapper(p, 'num_threads', None))
+        ctxinfo = self.psutil_wrapper(p, 'num_ctx_switches', ['voluntary', 'involuntary'])
+        st['ctx_swtch_vol'].append(ctxinfo.get('voluntary'))
+        st['ctx_swtch_invol'].append(ctxinfo.get('involuntary'))
 
-            cpu_percent = self.psutil_wrapper(p, 'cpu_percent', None)
-            if not new_process:
-                # psutil returns `0.` for `cpu_percent` the first time it's sampled on a process,
-                # so save the value only on non-new processes
-                st['cpu'].append(cpu_percent)
+        st['thr'].append(self.psutil_wrapper(p, 'num_threads', None))
 
-            st['open_fd'].append(self.psutil_wrapper(p, 'num_fds', None))
+        cpu_percent = self.psutil_wrapper(p, 'cpu_percent', None)
+        if not new_process:
+            # psutil returns `0.` for `cpu_percent` the first time it's sampled on a process,
+            # so save the value only on non-new processes
+            st['cpu'].append(cpu_percent)
 
-            ioinfo = self.psutil_wrapper(p, 'io_counters', ['read_count', 'write_count', 'read_bytes', 'write_bytes'])
-            st['r_count'].append(ioinfo.get('read_count'))
-            st['w_count'].append(ioinfo.get('write_count'))
-            st['r_bytes'].append(ioinfo.get('read_bytes'))
-            st['w_bytes'].append(ioinfo.get('write_bytes'))
+        st['open_fd'].append(self.psutil_wrapper(p, 'num_fds', None))
 
-        return st
+        ioinfo = self.psutil_wrapper(p, 'io_counters', ['read_count', 'write_count', 'read_bytes', 'write_bytes'])
+        st['r_count'].append(ioinfo.get('read_count'))
+        st['w_count'].append(ioinfo.get('write_count'))
+        st['r_bytes'].append(ioinfo.get('read_bytes'))
+        st['w_bytes'].append(ioinfo.get('write_bytes'))
 
     def check(self, instance):
         name = instance.get('name', None)
@@ -9,6 +9,7 @@ import requests
 
 # project
 from checks import AgentCheck
+from utils.http import session_pool
 
 EVENT_TYPE = SOURCE_TYPE_NAME = 'rabbitmq'
 QUEUE_TYPE = 'queues'
@@ -147,7 +148,7 @@ class RabbitMQ(AgentCheck):
 
     def _get_data(self, url, auth=None):
         try:
-            r = requests.get(url, auth=auth)
+            r = session_pool.get(url, auth=auth)
             r.raise_for_status()
             data = r.json()
         except requests.exceptions.HTTPError as e:
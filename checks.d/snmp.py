@@ -1,12 +1,14 @@
 # std
 from collections import defaultdict
 from functools import wraps
+import threading
 
 # 3rd party
+from pyasn1.type import univ
 from pysnmp.entity.rfc3413.oneliner import cmdgen
 import pysnmp.proto.rfc1902 as snmp_type
 from pysnmp.smi import builder
-from pysnmp.smi.exval import noSuchInstance, noSuchObject
+from pysnmp.smi.exval import endOfMibView, noSuchInstance, noSuchObject
 
 # project
 from checks.network_checks import NetworkCheck, Status
@@ -35,12 +37,70 @@ SNMP_GAUGES = frozenset([
 
 DEFAULT_OID_BATCH_SIZE = 10
 
+# Rows fetched by each GETBULK request when walking tables
+DEFAULT_MAX_REPETITIONS = 10
+
 
 def reply_invalid(oid):
     return noSuchInstance.isSameTypeWith(oid) or \
         noSuchObject.isSameTypeWith(oid)
 
 
+class OIDResolver(object):
+    '''
+    Cache of the MIB resolution of the OIDs of a device. The same symbols are
+    queried and the same table rows returned on every run, so they are only
+    resolved with the MIBs the first time they're seen.
+
+    Rows gone from the device's tables are dropped from the cache by `expire`.
+    '''
+
+    def __init__(self):
+        # (MIB, symbol) -> OID
+        self._symbols = {}
+        # OID -> (symbol, row indexes, value syntax)
+        self._oids = {}
+        # The OIDs resolved since the last call to `expire`
+        self._seen = {}
+
+    def resolve_symbol(self, mib_view, mib, symbol):
+        '''
+        Return the OID of the `symbol` of the `mib`
+        '''
+        key = (mib, symbol)
+        if key not in self._symbols:
+            mib_variable = cmdgen.MibVariable(mib, symbol)
+            mib_variable.resolveWithMib(mib_view, oidOnly=True)
+            self._symbols[key] = mib_variable.getOid()
+        return self._symbols[key]
+
+    def resolve(self, mib_view, oid, value):
+        '''
+        Return the symbol and row indexes of `oid`, and `value` converted to
+        the syntax given to the symbol by its MIB.
+        '''
+        key = oid.asTuple()
+        resolution = self._oids.get(key)
+        if resolution is None:
+            mib_variable = cmdgen.MibVariable(oid).resolveWithMib(mib_view)
+            _, symbol, indexes = mib_variable.getMibSymbol()
+            syntax = None
+            if mib_variable.isFullyResolved():
+                syntax = mib_variable.getMibNode().getSyntax()
+            resolution = (symbol, indexes, syntax)
+            self._oids[key] = resolution
+        self._seen[key] = resolution
+
+        symbol, indexes, syntax = resolution
+        if syntax is not None and not reply_invalid(value):
+            value = syntax.clone(value)
+        return symbol, indexes, value
+
+    def expire(self):
+        self._oids = self._seen
+        self._seen = {}
+
+
 class SnmpCheck(NetworkCheck):
 
     SOURCE_TYPE_NAME = 'system'
@@ -59,6 +119,9 @@ class SnmpCheck(NetworkCheck):
         # Set OID batch size
         self.oid_batch_size = int(init_config.get("oid_batch_size", DEFAULT_OID_BATCH_SIZE))
 
+        # Set the number of rows fetched by each GETBULK request
+        self.max_repetitions = int(init_config.get("max_repetitions", DEFAULT_MAX_REPETITIONS))
+
         # Load Custom MIB directory
         self.mibs_path = None
         self.ignore_nonincreasing_oid = False
@@ -67,8 +130,15 @@ class SnmpCheck(NetworkCheck):
             self.ignore_nonincreasing_oid = _is_affirmative(
                 init_config.get("ignore_nonincreasing_oid", False))
 
-        # Create SNMP command generator and aliases
-        self.create_command_generator(self.mibs_path, self.ignore_nonincreasing_oid)
+        # Create SNMP command generator. The devices are polled concurrently
+        # on the pool of threads, each of them gets its own, cf.
+        # `get_commands`
+        self.cmd_generator = self.create_command_generator(self.mibs_path,
+                                                           self.ignore_nonincreasing_oid)
+        self._commands = threading.local()
+
+        # Cache of the OIDs resolution of each device
+        self._resolvers = defaultdict(OIDResolver)
 
         NetworkCheck.__init__(self, name, init_config, agentConfig, instances)
 
@@ -101,18 +171,32 @@ class SnmpCheck(NetworkCheck):
         If mibs_path is not None, load the mibs present in the custom mibs
         folder. (Need to be in pysnmp format)
         '''
-        self.cmd_generator = cmdgen.CommandGenerator()
-        self.cmd_generator.ignoreNonIncreasingOid = ignore_nonincreasing_oid
+        cmd_generator = cmdgen.CommandGenerator()
+        cmd_generator.ignoreNonIncreasingOid = ignore_nonincreasing_oid
         if mibs_path is not None:
-            mib_builder = self.cmd_generator.snmpEngine.msgAndPduDsp.\
+            mib_builder = cmd_generator.snmpEngine.msgAndPduDsp.\
                 mibInstrumController.mibBuilder
             mib_sources = mib_builder.getMibSources() + \
                 (builder.DirMibSource(mibs_path), )
             mib_builder.setMibSources(*mib_sources)
+        return cmd_generator
 
-        # Set aliases for snmpget and snmpgetnext with logging
-        self.snmpget = self.snmp_logger(self.cmd_generator.getCmd)
-        self.snmpgetnext = self.snmp_logger(self.cmd_generator.nextCmd)
+    def get_commands(self):
+        '''
+        Return the SNMP commands of the current thread.
+        pysnmp's command generator runs its own dispatcher for each command, it
+        can't be shared by the threads polling devices concurrently.
+        '''
+        commands = self._commands
+        if getattr(commands, 'cmd_generator', None) is None:
+            commands.cmd_generator = self.create_command_generator(
+                self.mibs_path, self.ignore_nonincreasing_oid)
+
+            # Set aliases for snmpget, snmpgetnext and snmpbulk with logging
+            commands.snmpget = self.snmp_logger(commands.cmd_generator.getCmd)
+            commands.snmpgetnext = self.snmp_logger(commands.cmd_generator.nextCmd)
+            commands.snmpbulk = self.snmp_logger(commands.cmd_generator.bulkCmd)
+        return commands
 
     @classmethod
     def get_auth_data(cls, instance):
@@ -174,12 +258,13 @@ class SnmpCheck(NetworkCheck):
             instance["service_check_error"] = message
             raise Exception(message)
 
-    def check_table(self, instance, oids, lookup_names, timeout, retries):
+    def check_table(self, instance, oids, lookup_names, timeout, retries,
+                    table_oids=None):
         '''
-        Perform a snmpwalk on the domain specified by the oids, on the device
-        configured in instance.
+        Perform a snmpget on the oids, and a snmpwalk on the domain specified
+        by the table_oids, on the device configured in instance.
         lookup_names is a boolean to specify whether or not to use the mibs to
-        resolve the name and values.
+        resolve the name and values, the oids are then (MIB, symbol) tuples.
 
         Returns a dictionary:
         dict[oid/metric_name][row index] = value
@@ -190,75 +275,120 @@ class SnmpCheck(NetworkCheck):
         # For example:
         # snmpgetnext -v2c -c public localhost:11111 1.36.1.2.1.25.4.2.1.7.222
         # iso.3.6.1.2.1.25.4.2.1.7.224 = INTEGER: 2
-        # SOLUTION: perform a snmget command and fallback with snmpgetnext if not found
+        # SOLUTION: perform a snmget command and fallback with snmpwalk if not found
         transport_target = self.get_transport_target(instance, timeout, retries)
         auth_data = self.get_auth_data(instance)
+        commands = self.get_commands()
+        table_oids = table_oids or []
+
+        # Names and values are resolved with the mibs here rather than by
+        # pysnmp, to reuse the resolutions of the previous runs
+        if lookup_names:
+            mib_view = commands.cmd_generator.mibViewController
+            resolver = self._resolvers[instance['name']]
+            oids = [resolver.resolve_symbol(mib_view, mib, symbol)
+                    for mib, symbol in oids]
+            table_oids = [resolver.resolve_symbol(mib_view, mib, symbol)
+                          for mib, symbol in table_oids]
 
         first_oid = 0
         all_binds = []
         results = defaultdict(dict)
+        missing_results = []
 
         while first_oid < len(oids):
 
             # Start with snmpget command
-            error_indication, error_status, error_index, var_binds = self.snmpget(
+            error_indication, error_status, error_index, var_binds = commands.snmpget(
                 auth_data,
                 transport_target,
-                *(oids[first_oid:first_oid + self.oid_batch_size]),
-                lookupValues=lookup_names,
-                lookupNames=lookup_names)
+                *(oids[first_oid:first_oid + self.oid_batch_size]))
 
             first_oid = first_oid + self.oid_batch_size
 
             # Raise on error_indication
             self.raise_on_error_indication(error_indication, instance)
 
-            missing_results = []
-            complete_results = []
-
             for var in var_binds:
                 result_oid, value = var
-                if reply_invalid(value):
-                    oid_tuple = result_oid.asTuple()
-                    oid = ".".join([str(i) for i in oid_tuple])
-                    missing_results.append(oid)
+                # The values are Null when the request failed, with SNMP v1
+                # for instance
+                if reply_invalid(value) or isinstance(value, univ.Null):
+                    missing_results.append(result_oid)
                 else:
-                    complete_results.append(var)
-
-            if missing_results:
-                # If we didn't catch the metric using snmpget, try snmpnext
-                error_indication, error_status, error_index, var_binds_table = self.snmpgetnext(
-                    auth_data,
-                    transport_target,
-                    *missing_results,
-                    lookupValues=lookup_names,
-                    lookupNames=lookup_names)
-
-                # Raise on error_indication
-                self.raise_on_error_indication(error_indication, instance)
-
-                if error_status:
-                    message = "{0} for instance {1}".format(error_status.prettyPrint(),
-                                                            instance["ip_address"])
-                    instance["service_check_error"] = message
-                    self.warning(message)
+                    all_binds.append(var)
 
-                for table_row in var_binds_table:
-                    complete_results.extend(table_row)
-
-            all_binds.extend(complete_results)
+        # If we didn't catch the metric using snmpget, try snmpwalk
+        all_binds.extend(self.walk(instance, commands, auth_data, transport_target,
+                                   table_oids + missing_results))
 
         for result_oid, value in all_binds:
             if lookup_names:
-                _, metric, indexes = result_oid.getMibSymbol()
+                metric, indexes, value = resolver.resolve(mib_view, result_oid, value)
                 results[metric][indexes] = value
             else:
                 oid = result_oid.asTuple()
                 matching = ".".join([str(i) for i in oid])
                 results[matching] = value
+
+        if lookup_names:
+            resolver.expire()
+
         self.log.debug("Raw results: {0}".format(results))
         return results
 
+    def walk(self, instance, commands, auth_data, transport_target, oids):
+        '''
+        Walk the subtrees of the oids, `oid_batch_size` of them at a time.
+        With SNMP v2c and v3, use GETBULK requests fetching `max_repetitions`
+        rows of the tables at once instead of one per request.
+
+        Returns the list of (oid, value) found in the subtrees.
+        '''
+        max_repetitions = int(instance.get('max_repetitions', self.max_repetitions))
+        # GETBULK isn't part of SNMP v1
+        use_bulk = "user" in instance or int(instance.get("snmp_version", 2)) != 1
+
+        first_oid = 0
+        all_binds = []
+
+        while first_oid < len(oids):
+            batch = oids[first_oid:first_oid + self.oid_batch_size]
+            first_oid = first_oid + self.oid_batch_size
+
+            if use_bulk:
+                error_indication, error_status, error_index, var_binds_table = commands.snmpbulk(
+                    auth_data,
+                    transport_target,
+                    0, max_repetitions,
+                    *batch)
+            else:
+                error_indication, error_status, error_index, var_binds_table = commands.snmpgetnext(
+                    auth_data,
+                    transport_target,
+                    *batch)
+
+            # Raise on error_indication
+            self.raise_on_error_indication(error_indication, instance)
+
+            if error_status:
+                message = "{0} for instance {1}".format(error_status.prettyPrint(),
+                                                        instance["ip_address"])
+                instance["service_check_error"] = message
+                self.warning(message)
+
+            # The last rows run past the end of the subtrees, the columns of
+            # the rows are the successors of the oids of the batch
+            subtrees = [snmp_type.ObjectName(oid) for oid in batch]
+            for table_row in var_binds_table:
+                for subtree, (result_oid, value) in zip(subtrees, table_row):
+                    if subtree.isPrefixOf(result_oid) and \
+                            not endOfMibView.isSameTypeWith(value) and \
+                            not isinstance(value, univ.Null):
+                        all_binds.append((result_oid, value))
+
+        return all_binds
+
     def _check(self, instance):
         '''
         Perform two series of SNMP requests, one for all that have MIB asociated
@@ -270,26 +400,29 @@ class SnmpCheck(NetworkCheck):
         tags += ['snmp_device:{0}'.format(ip_address)]
 
         table_oids = []
+        symbol_oids = []
         raw_oids = []
 
         # Check the metrics completely defined
         for metric in metrics:
             if 'MIB' in metric:
-                try:
-                    assert "table" in metric or "symbol" in metric
-                    to_query = metric.get("table", metric.get("symbol"))
-                    table_oids.append(cmdgen.MibVariable(metric["MIB"], to_query))
-                except Exception as e:
+                if "table" in metric:
+                    table_oids.append((metric["MIB"], metric["table"]))
+                elif "symbol" in metric:
+                    symbol_oids.append((metric["MIB"], metric["symbol"]))
+                else:
                     self.log.warning("Can't generate MIB object for variable : %s\n"
-                                     "Exception: %s", metric, e)
+                                     "A table or a symbol needs to be specified", metric)
             elif 'OID' in metric:
                 raw_oids.append(metric['OID'])
             else:
                 raise Exception('Unsupported metric in config file: %s' % metric)
         try:
-            if table_oids:
-                self.log.debug("Querying device %s for %s oids", ip_address, len(table_oids))
-                table_results = self.check_table(instance, table_oids, True, timeout, retries)
+            if table_oids or symbol_oids:
+                self.log.debug("Querying device %s for %s oids", ip_address,
+                               len(table_oids) + len(symbol_oids))
+                table_results = self.check_table(instance, symbol_oids, True, timeout,
+                                                 retries, table_oids=table_oids)
                 self.report_table_metrics(metrics, table_results, tags)
 
             if raw_oids:
@@ -55,6 +55,7 @@ import requests
 
 # Project
 from checks import AgentCheck
+from utils.http import session_pool
 
 # Default settings
 DEFAULT_RM_URI = 'http://localhost:8088'
@@ -247,7 +248,7 @@ class YarnCheck(AgentCheck):
         url = urljoin(address, object_path)
 
         try:
-            response = requests.get(url)
+            response = session_pool.get(url)
             response.raise_for_status()
             response_json = response.json()
 
@@ -6,10 +6,13 @@ The Check class is being deprecated so don't write new checks with it.
 # stdlib
 from collections import defaultdict
 import copy
+import functools
 import logging
 import numbers
 import os
+import Queue
 import re
+import threading
 import time
 import timeit
 import traceback
@@ -24,7 +27,10 @@ import yaml
 
 # project
 from checks import check_status
+from checks.libs.thread_pool import Pool
 from util import get_hostname, get_next_id, LaconicFilter, yLoader
+from utils.cache import LRUCache
+from utils.http import retrieve_json
 from utils.platform import Platform
 from utils.profile import pretty_statistics
 if Platform.is_windows():
@@ -37,6 +43,15 @@ DEFAULT_PSUTIL_METHODS = ['memory_info', 'io_counters']
 
 AGENT_METRICS_CHECK_NAME = 'agent_metrics'
 
+# Number of metric names whose normalized form is cached, shared by all the
+# checks. Checks normalize mostly the same names from one run to the next.
+NORMALIZED_NAMES_CACHE_SIZE = 16384
+
+# Maximum number of threads running the calls of `AgentCheck.fetch_concurrently`
+DEFAULT_FETCH_THREADS = 8
+# Number of threads of the pool running these calls, shared by all the checks
+FETCH_POOL_SIZE = 32
+
 
 # Konstants
 class CheckException(Exception):
@@ -55,6 +70,10 @@ class UnknownValue(CheckException):
     pass
 
 
+class FetchTimeout(CheckException):
+    pass
+
+
 
 #==============================================================================
 # DEPRECATED
@@ -298,10 +317,29 @@ class AgentCheck(object):
 
     _enabled_checks = []
 
+    # Caches of AgentCheck.normalize and convert_to_underscore_separated,
+    # shared by the checks, which may run in several threads
+    _normalized_names = LRUCache(NORMALIZED_NAMES_CACHE_SIZE)
+    _underscore_separated_names = LRUCache(NORMALIZED_NAMES_CACHE_SIZE)
+    _names_cache_lock = threading.Lock()
+
+    # Pool of threads running the calls of fetch_concurrently, started on
+    # first use. Calls given up on keep their thread until they return.
+    _fetch_pool = None
+    _fetch_pool_lock = threading.Lock()
+
     @classmethod
     def is_check_enabled(cls, name):
         return name in cls._enabled_checks
 
+    @classmethod
+    def _get_fetch_pool(cls):
+        with cls._fetch_pool_lock:
+            if AgentCheck._fetch_pool is None:
+                # Don't hold the agent back on exit for a call that is hanging
+                AgentCheck._fetch_pool = Pool(FETCH_POOL_SIZE, name="Fetch", daemon=True)
+            return AgentCheck._fetch_pool
+
     def __init__(self, name, init_config, agentConfig, instances=None):
         """
         Initialize a new check.
@@ -329,7 +367,8 @@ class AgentCheck(object):
             formatter=agent_formatter,
             recent_point_threshold=agentConfig.get('recent_point_threshold', None),
             histogram_aggregates=agentConfig.get('histogram_aggregates'),
-            histogram_percentiles=agentConfig.get('histogram_percentiles')
+            histogram_percentiles=agentConfig.get('histogram_percentiles'),
+            histogram_sketch_accuracy=agentConfig.get('histogram_sketch_accuracy')
         )
 
         self.events = []
@@ -712,8 +751,10 @@ class AgentCheck(object):
         self._internal_profiling_stats = None
         return stats
 
-    def run(self):
-        """ Run all instances. """
+    def run(self, instance_indexes=None):
+        """
+        Run all instances, or only the ones of index in `instance_indexes`.
+        """
 
         # Store run statistics if needed
         before, after = None, None
@@ -725,6 +766,8 @@ class AgentCheck(object):
 
         instance_statuses = []
         for i, instance in enumerate(self.instances):
+            if instance_indexes is not None and i not in instance_indexes:
+                continue
             try:
                 min_collection_interval = instance.get(
                     'min_collection_interval', self.init_config.get(
@@ -827,6 +870,38 @@ class AgentCheck(object):
         :param fix_case A boolean, indicating whether to make sure that
                         the metric name returned is in underscore_case
         """
+        key = (metric, prefix, fix_case)
+        with self._names_cache_lock:
+            name = self._normalized_names.get(key)
+        if name is None:
+            name = self._normalize(metric, prefix, fix_case)
+            with self._names_cache_lock:
+                self._normalized_names[key] = name
+        return name
+
+    def normalize_names(self, metrics, prefix=None, fix_case=False):
+        """
+        Normalize a list of metric names at once, same as calling `normalize`
+        on each of them but locking the shared cache only twice.
+        """
+        keys = [(metric, prefix, fix_case) for metric in metrics]
+        with self._names_cache_lock:
+            names = [self._normalized_names.get(key) for key in keys]
+
+        missing = {}
+        for i, name in enumerate(names):
+            if name is None:
+                key = keys[i]
+                if key not in missing:
+                    missing[key] = self._normalize(key[0], prefix, fix_case)
+                names[i] = missing[key]
+        if missing:
+            with self._names_cache_lock:
+                for key, name in missing.iteritems():
+                    self._normalized_names[key] = name
+        return names
+
+    def _normalize(self, metric, prefix=None, fix_case=False):
         if fix_case:
             name = self.convert_to_underscore_separated(metric)
             if prefix is not None:
@@ -857,11 +932,86 @@ class AgentCheck(object):
         Convert from CamelCase to camel_case
         And substitute illegal metric characters
         """
+        with self._names_cache_lock:
+            metric_name = self._underscore_separated_names.get(name)
+        if metric_name is None:
+            metric_name = self._convert_to_underscore_separated(name)
+            with self._names_cache_lock:
+                self._underscore_separated_names[name] = metric_name
+        return metric_name
+
+    def _convert_to_underscore_separated(self, name):
         metric_name = self.FIRST_CAP_RE.sub(r'\1_\2', name)
         metric_name = self.ALL_CAP_RE.sub(r'\1_\2', metric_name).lower()
         metric_name = self.METRIC_REPLACEMENT.sub('_', metric_name)
         return self.DOT_UNDERSCORE_CLEANUP.sub('.', metric_name).strip('_')
 
+    def fetch_concurrently(self, calls, timeout=None, max_threads=DEFAULT_FETCH_THREADS):
+        """
+        Run `calls`, a dict of callables taking no argument or of URLs (whose
+        JSON body is retrieved), in parallel on up to `max_threads` threads
+        of the pool shared by the checks, and wait at most `timeout` seconds
+        (None to wait for all of them).
+
+        Return a `(results, errors)` tuple of dicts keyed like `calls`, with
+        the values returned by the calls that completed and the exceptions
+        raised by the others. The calls still running when the deadline
+        passes are given up on with a `FetchTimeout` error, the ones not
+        started yet are skipped.
+        """
+        if not calls:
+            return {}, {}
+
+        pending = Queue.Queue()
+        for key, call in calls.iteritems():
+            if isinstance(call, basestring):
+                call = functools.partial(retrieve_json, call, timeout=timeout)
+            pending.put((key, call))
+        done = Queue.Queue()
+        cancelled = threading.Event()
+
+        def run_calls():
+            while not cancelled.is_set():
+                try:
+                    key, call = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    done.put((key, call(), None))
+                except Exception as e:
+                    done.put((key, None, e))
+
+        fetch_pool = self._get_fetch_pool()
+        for _ in xrange(min(max_threads, len(calls))):
+            fetch_pool.apply_async(run_calls)
+
+        deadline = time.time() + timeout if timeout is not None else None
+        results = {}
+        errors = {}
+        for _ in xrange(len(calls)):
+            try:
+                if deadline is None:
+                    key, result, error = done.get()
+                else:
+                    key, result, error = done.get(timeout=max(deadline - time.time(), 0))
+            except Queue.Empty:
+                break
+            if error is None:
+                results[key] = result
+            else:
+                self.log.debug("Call %s of check %s failed: %s", key, self.name, error)
+                errors[key] = error
+        cancelled.set()
+
+        timed_out = [key for key in calls if key not in results and key not in errors]
+        if timed_out:
+            self.log.warning("Calls %s of check %s didn't complete in %ss, giving up on them",
+                             ", ".join(map(str, timed_out)), self.name, timeout)
+            for key in timed_out:
+                errors[key] = FetchTimeout("Call %s didn't complete in %ss" % (key, timeout))
+
+        return results, errors
+
     @staticmethod
     def read_config(instance, key, message=None, cast=None):
         val = instance.get(key)
@@ -1,7 +1,9 @@
 # stdlib
 import collections
+import itertools
 import logging
 import pprint
+import Queue
 import socket
 import sys
 import time
@@ -12,11 +14,15 @@ from checks.check_status import (
     CheckStatus,
     CollectorStatus,
     EmitterStatus,
+    InstanceStatus,
     STATUS_ERROR,
     STATUS_OK,
+    STATUS_WARNING,
 )
 from checks.datadog import DdForwarder, Dogstreams
 from checks.ganglia import Ganglia
+from checks.libs.thread_pool import Pool
+from checks.scheduler import CheckScheduler, DEFAULT_JITTER
 from config import get_system_stats, get_version
 from resources.processes import Processes as ResProcesses
 import checks.system.unix as u
@@ -30,6 +36,7 @@ from util import (
     get_uuid,
     Timer,
 )
+from utils.http import session_pool
 from utils.logger import log_exceptions
 from utils.jmx import JMXFiles
 from utils.platform import Platform
@@ -42,6 +49,26 @@ FLUSH_LOGGING_PERIOD = 10
 FLUSH_LOGGING_INITIAL = 5
 DD_CHECK_TAG = 'dd_check:{0}'
 
+# Number of threads running the checks.d checks, 1 runs them one after
+# another on the collector thread
+DEFAULT_CHECK_RUNNERS = 1
+
+# A checks.d check run is the result of a check and what it submitted
+CheckRun = collections.namedtuple(
+    'CheckRun', ['check', 'status', 'metrics', 'events', 'service_checks', 'run_time'])
+
+
+class CheckJob(object):
+    """
+    A run of a checks.d check submitted to the check runners
+    """
+    def __init__(self, check, instance_indexes=None):
+        self.check = check
+        self.instance_indexes = instance_indexes
+        # Set by the check runner when the check starts running
+        self.start_time = None
+        self.check_run = None
+
 
 class AgentPayload(collections.MutableMapping):
     """
@@ -161,6 +188,23 @@ class Collector(object):
         self.plugins = None
         self.emitters = emitters
         self.check_timings = agentConfig.get('check_timings')
+        self.check_runners = int(agentConfig.get('check_runners') or DEFAULT_CHECK_RUNNERS)
+        # A check still running after `check_timeout` seconds is reported late,
+        # its results are submitted with the collection run it completes in
+        self.check_timeout = float(agentConfig.get('check_timeout') or agentConfig.get('check_freq', 15))
+        # Pool size and default timeout of the HTTP sessions shared by the checks
+        session_pool.configure(agentConfig)
+        self._check_pool = None
+        # checks.d check -> CheckJob, for the checks running on the check runners
+        self._check_jobs = {}
+        self._finished_check_jobs = Queue.Queue()
+        # Check instances with their own `collection_interval`
+        self._check_scheduler = CheckScheduler(
+            jitter=float(agentConfig.get('check_schedule_jitter') or DEFAULT_JITTER))
+        # Runs of scheduled check instances since the last collection run
+        self._pending_check_runs = []
+        # checks.d check -> its last CheckStatus
+        self._last_check_statuses = {}
         self.push_times = {
             'host_metadata': {
                 'start': time.time(),
@@ -181,6 +225,8 @@ class Collector(object):
         self.hostname_metadata_cache = None
         self.initialized_checks_d = []
         self.init_failed_checks_d = {}
+        # checks.d checks replaced by a configuration reload, to stop
+        self._checks_to_stop = []
 
         # Unix System Checks
         self._unix_system_checks = {
@@ -239,8 +285,31 @@ class Collector(object):
         # in which case we'll get a misleading error in the logs.
         # Best to not even try.
         self.continue_running = False
-        for check in self.initialized_checks_d:
+        for check in self.initialized_checks_d + self._checks_to_stop:
             check.stop()
+        if self._check_pool is not None:
+            self._check_pool.terminate()
+        self._dogstream.stop()
+
+    def stop_checks(self, checks):
+        """
+        Stop `checks`, replaced by a configuration reload. The reload may
+        interrupt a collection run, so they're stopped by the next one, once
+        they aren't running anymore.
+        """
+        self._checks_to_stop.extend(checks)
+
+    def _stop_replaced_checks(self):
+        still_running = []
+        for check in self._checks_to_stop:
+            if check in self._check_jobs:
+                still_running.append(check)
+                continue
+            try:
+                check.stop()
+            except Exception:
+                log.exception("Error stopping check %s" % check.name)
+        self._checks_to_stop = still_running
 
     @staticmethod
     def _stats_for_display(raw_stats):
@@ -261,6 +330,7 @@ class Collector(object):
         if checksd:
             self.initialized_checks_d = checksd['initialized_checks']  # is a list of AgentCheck instances
             self.init_failed_checks_d = checksd['init_failed_checks']  # is of type {check_name: {error, traceback}}
+        self._stop_replaced_checks()
 
         payload = AgentPayload()
 
@@ -273,6 +343,8 @@ class Collector(object):
                     self.initialized_checks_d.remove(check)
                     break
 
+        self._check_scheduler.update(self.initialized_checks_d)
+
         # Initialize payload
         self._build_payload(payload)
 
@@ -390,80 +462,45 @@ class Collector(object):
             if res:
                 metrics.extend(res)
 
-        # checks.d checks
-        check_statuses = []
-        for check in self.initialized_checks_d:
-            if not self.continue_running:
-                return
-            log.info("Running check %s" % check.name)
-            instance_statuses = []
-            metric_count = 0
-            event_count = 0
-            service_check_count = 0
-            check_start_time = time.time()
-            check_stats = None
-
-            try:
-                # Run the check.
-                instance_statuses = check.run()
-
-                # Collect the metrics and events.
-                current_check_metrics = check.get_metrics()
-                current_check_events = check.get_events()
-                check_stats = check._get_internal_profiling_stats()
-
-                # Collect metadata
-                current_check_metadata = check.get_service_metadata()
-
-                # Save metrics & events for the payload.
-                metrics.extend(current_check_metrics)
-                if current_check_events:
-                    if check.name not in events:
-                        events[check.name] = current_check_events
-                    else:
-                        events[check.name] += current_check_events
-
-                # Save the status of the check.
-                metric_count = len(current_check_metrics)
-                event_count = len(current_check_events)
-
-            except Exception:
-                log.exception("Error running check %s" % check.name)
-
-            check_status = CheckStatus(
-                check.name, instance_statuses, metric_count,
-                event_count, service_check_count, service_metadata=current_check_metadata,
-                library_versions=check.get_library_info(),
-                source_type_name=check.SOURCE_TYPE_NAME or check.name,
-                check_stats=check_stats
-            )
-
-            # Service check for Agent checks failures
-            service_check_tags = ["check:%s" % check.name]
-            if check_status.status == STATUS_OK:
-                status = AgentCheck.OK
-            elif check_status.status == STATUS_ERROR:
-                status = AgentCheck.CRITICAL
-            check.service_check('datadog.agent.check_status', status, tags=service_check_tags)
-
-            # Collect the service checks and save them in the payload
-            current_check_service_checks = check.get_service_checks()
-            if current_check_service_checks:
-                service_checks.extend(current_check_service_checks)
-            service_check_count = len(current_check_service_checks)
-
-            # Update the check status with the correct service_check_count
-            check_status.service_check_count = service_check_count
-            check_statuses.append(check_status)
-
-            check_run_time = time.time() - check_start_time
-            log.debug("Check %s ran in %.2f s" % (check.name, check_run_time))
+        # checks.d checks, and the scheduled instances which ran since the
+        # last collection run
+        checks, instances_by_check = self._get_due_checks()
+        check_runs = itertools.chain(self._pending_check_runs,
+                                     self._run_checks(checks, instances_by_check))
+        self._pending_check_runs = []
+        statuses_by_check = {}
+
+        for check_run in check_runs:
+            metrics.extend(check_run.metrics)
+            if check_run.events:
+                if check_run.check.name not in events:
+                    events[check_run.check.name] = check_run.events
+                else:
+                    events[check_run.check.name] += check_run.events
+            service_checks.extend(check_run.service_checks)
+            if check_run.check in statuses_by_check:
+                self._merge_check_status(statuses_by_check[check_run.check], check_run.status)
+            else:
+                statuses_by_check[check_run.check] = check_run.status
 
             # Intrument check run timings if enabled.
-            if self.check_timings:
+            if self.check_timings and check_run.run_time is not None:
                 metric = 'datadog.agent.check_run_time'
-                meta = {'tags': ["check:%s" % check.name]}
-                metrics.append((metric, time.time(), check_run_time, meta))
+                meta = {'tags': ["check:%s" % check_run.check.name]}
+                metrics.append((metric, time.time(), check_run.run_time, meta))
+
+        if not self.continue_running:
+            return
+
+        # Checks which didn't run keep their last status
+        check_statuses = []
+        last_check_statuses = {}
+        for check in self.initialized_checks_d:
+            check_status = statuses_by_check.get(check) or self._last_check_statuses.get(check)
+            if check_status is not None:
+                check_statuses.append(check_status)
+                last_check_statuses[check] = check_status
+        self._last_check_statuses = last_check_statuses
 
         for check_name, info in self.init_failed_checks_d.iteritems():
             if not self.continue_running:
@@ -528,6 +565,237 @@ class Collector(object):
 
         return payload
 
+    def run_scheduled_checks(self):
+        """
+        Run the check instances with a `collection_interval` which are due,
+        their results are submitted with the next collection run.
+        """
+        due = self._check_scheduler.pop_due()
+        checks = [check for check in self.initialized_checks_d if check in due]
+        for check_run in self._run_checks(checks, due):
+            if not self.continue_running:
+                return
+            self._pending_check_runs.append(check_run)
+
+    def next_scheduled_run_time(self):
+        """
+        Return when the next check instance with a `collection_interval` is
+        due, None if there is none.
+        """
+        return self._check_scheduler.next_run_time()
+
+    def _get_due_checks(self):
+        """
+        Return the checks.d checks to run with this collection run, and a
+        dict check -> indexes of the instances to run for the checks with
+        scheduled instances: their other instances and the scheduled ones due.
+        """
+        due = self._check_scheduler.pop_due()
+        checks = []
+        instances_by_check = {}
+        for check in self.initialized_checks_d:
+            scheduled = self._check_scheduler.scheduled_instances(check)
+            if scheduled:
+                instance_indexes = [i for i in xrange(len(check.instances)) if i not in scheduled]
+                instance_indexes.extend(due.get(check, []))
+                if not instance_indexes:
+                    continue
+                instances_by_check[check] = sorted(instance_indexes)
+            checks.append(check)
+        return checks, instances_by_check
+
+    @staticmethod
+    def _merge_check_status(check_status, other):
+        """
+        Merge the status `other` of a later run of the same check into
+        `check_status`.
+        """
+        instance_ids = set(s.instance_id for s in other.instance_statuses or [])
+        check_status.instance_statuses = [
+            s for s in check_status.instance_statuses or [] if s.instance_id not in instance_ids
+        ] + list(other.instance_statuses or [])
+        check_status.metric_count += other.metric_count
+        check_status.event_count += other.event_count
+        check_status.service_check_count += other.service_check_count
+        check_status.service_metadata = other.service_metadata or check_status.service_metadata
+        check_status.library_versions = other.library_versions or check_status.library_versions
+        check_status.check_stats = other.check_stats or check_status.check_stats
+
+    def _run_checks(self, checks, instances_by_check=None):
+        if self.check_runners > 1:
+            return self._run_checks_concurrently(checks, instances_by_check)
+        return self._run_checks_sequentially(checks, instances_by_check)
+
+    def _run_check(self, check, instance_indexes=None):
+        """
+        Run a checks.d check, or only the instances of index in
+        `instance_indexes`, and collect what it submitted.
+        """
+        log.info("Running check %s" % check.name)
+        instance_statuses = []
+        current_check_metrics = []
+        current_check_events = []
+        current_check_metadata = []
+        check_start_time = time.time()
+        check_stats = None
+
+        try:
+            # Run the check.
+            instance_statuses = check.run(instance_indexes)
+
+            # Collect the metrics and events.
+            current_check_metrics = check.get_metrics()
+            current_check_events = check.get_events()
+            check_stats = check._get_internal_profiling_stats()
+
+            # Collect metadata
+            current_check_metadata = check.get_service_metadata()
+        except Exception:
+            log.exception("Error running check %s" % check.name)
+
+        check_status = CheckStatus(
+            check.name, instance_statuses, len(current_check_metrics),
+            len(current_check_events), service_metadata=current_check_metadata,
+            library_versions=check.get_library_info(),
+            source_type_name=check.SOURCE_TYPE_NAME or check.name,
+            check_stats=check_stats
+        )
+
+        # Service check for Agent checks failures
+        service_check_tags = ["check:%s" % check.name]
+        if check_status.status == STATUS_OK:
+            status = AgentCheck.OK
+        elif check_status.status == STATUS_ERROR:
+            status = AgentCheck.CRITICAL
+        check.service_check('datadog.agent.check_status', status, tags=service_check_tags)
+
+        # Collect the service checks, the check status counts them too
+        current_check_service_checks = check.get_service_checks()
+        check_status.service_check_count = len(current_check_service_checks)
+
+        check_run_time = time.time() - check_start_time
+        log.debug("Check %s ran in %.2f s" % (check.name, check_run_time))
+
+        return CheckRun(check, check_status, current_check_metrics, current_check_events,
+                        current_check_service_checks, check_run_time)
+
+    def _run_checks_sequentially(self, checks, instances_by_check=None):
+        """
+        Run `checks` one after another on the collector thread.
+        """
+        instances_by_check = instances_by_check or {}
+        for check in checks:
+            if not self.continue_running:
+                return
+            yield self._run_check(check, instances_by_check.get(check))
+
+    def _run_check_job(self, job):
+        """
+        Run the check of `job` on a check runner thread.
+        """
+        job.start_time = time.time()
+        try:
+            job.check_run = self._run_check(job.check, job.instance_indexes)
+        except Exception:
+            log.exception("Error running check %s" % job.check.name)
+        finally:
+            self._finished_check_jobs.put(job)
+
+    def _late_check_run(self, job, now):
+        """
+        Status of a check still running or waiting for a check runner: a
+        warning, the check itself can't be used until it completes.
+        """
+        check = job.check
+        if job.start_time is None:
+            message = "Check is waiting for a check runner, all of them are busy"
+        else:
+            message = "Check has been running for %.2fs, longer than the %ss timeout. " \
+                "Its results will be submitted once it completes" % (now - job.start_time, self.check_timeout)
+        log.warning("Check %s is late: %s" % (check.name, message))
+
+        check_status = CheckStatus(
+            check.name, [InstanceStatus(0, STATUS_WARNING, warnings=[message])],
+            service_check_count=1,
+            library_versions=check.get_library_info(),
+            source_type_name=check.SOURCE_TYPE_NAME or check.name
+        )
+        service_check = create_service_check(
+            'datadog.agent.check_status', AgentCheck.WARNING, tags=["check:%s" % check.name],
+            hostname=self.hostname, message=message)
+
+        return CheckRun(check, check_status, [], [], [service_check], None)
+
+    def _run_checks_concurrently(self, checks, instances_by_check=None):
+        """
+        Run `checks` on the check runner threads and yield their results as
+        they complete, until every check completed or missed its deadline:
+        `check_timeout` seconds after it started running.
+
+        A check is not run again while its previous run is in flight: the
+        results of a late run are yielded by the collection run it completes
+        in, the collection runs it misses yield a warning status instead.
+        """
+        instances_by_check = instances_by_check or {}
+        if self._check_pool is None:
+            self._check_pool = Pool(self.check_runners, name="CheckRunner")
+
+        # Checks whose results were submitted in this collection run
+        reported = set()
+
+        # Late runs which completed since the last collection run
+        while True:
+            try:
+                job = self._finished_check_jobs.get_nowait()
+            except Queue.Empty:
+                break
+            del self._check_jobs[job.check]
+            if job.check_run is not None:
+                reported.add(job.check)
+                yield job.check_run
+
+        for check in checks:
+            if check not in self._check_jobs:
+                job = CheckJob(check, instances_by_check.get(check))
+                self._check_jobs[check] = job
+                self._check_pool.apply_async(self._run_check_job, (job,))
+
+        while self._check_jobs and self.continue_running:
+            now = time.time()
+            deadlines = []
+            late_count = 0
+            waiting_count = 0
+            for job in self._check_jobs.itervalues():
+                if job.start_time is None:
+                    waiting_count += 1
+                elif job.start_time + self.check_timeout <= now:
+                    late_count += 1
+                else:
+                    deadlines.append(job.start_time + self.check_timeout)
+
+            if not deadlines and (not waiting_count or late_count >= self.check_runners):
+                # The waiting checks can't start before a late check completes
+                break
+
+            # Wait until the next deadline, or for a waiting check to start
+            # and get its own deadline
+            timeout = min(deadlines) - now if deadlines else self.check_timeout
+            try:
+                job = self._finished_check_jobs.get(timeout=timeout)
+            except Queue.Empty:
+                continue
+
+            del self._check_jobs[job.check]
+            if job.check_run is not None:
+                reported.add(job.check)
+                yield job.check_run
+
+        now = time.time()
+        for check in checks:
+            job = self._check_jobs.get(check)
+            if job is not None and check not in reported:
+                yield self._late_check_run(job, now)
+
     @staticmethod
     def run_single_check(check, verbose=True):
         log.info("Running check %s" % check.name)
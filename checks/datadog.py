@@ -1,7 +1,9 @@
 # stdlib
 from datetime import datetime
 import glob
-from itertools import groupby
+import inspect
+import logging
+import multiprocessing
 import os
 import re
 import sys
@@ -12,7 +14,16 @@ import traceback
 from checks import LaconicFilter
 import modules
 from util import windows_friendly_colon_split
-from utils.tailfile import TailFile
+from utils.platform import Platform
+from utils.tailfile import get_tail_options, TailFile
+
+# Number of lines parsed at once by a process of the dogstream parsing pool
+PARSE_CHUNK_SIZE = 1000
+# Seconds to wait for a chunk of lines parsed by the pool, before giving up on
+# it and on the pool
+PARSE_CHUNK_TIMEOUT = 30
+
+pool_log = logging.getLogger('dogstream')
 
 if hasattr('some string', 'partition'):
     def partition(s, sep):
@@ -26,9 +37,39 @@ else:
             return s[0:pos], sep, s[pos + len(sep):]
 
 
-def point_sorter(p):
-    # Sort and group by timestamp, metric name, host_name, device_name
-    return (p[1], p[0], p[3].get('host_name', None), p[3].get('device_name', None))
+def parse_lines(parse_func, lines):
+    """
+    Parse `lines` with a stateless `parse_func`, in a process of the dogstream
+    parsing pool. Return the result of each line, or the traceback of its
+    parsing error.
+    """
+    results = []
+    for line in lines:
+        try:
+            results.append((parse_func(pool_log, line), None))
+        except Exception:
+            results.append((None, traceback.format_exc()))
+    return results
+
+
+class ParsePool(object):
+    """
+    Pool of processes the dogstreams parse their lines on, restarted when a
+    process gets stuck
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        self._pool = multiprocessing.Pool(processes)
+
+    def apply_async(self, func, args):
+        return self._pool.apply_async(func, args)
+
+    def restart(self):
+        self._pool.terminate()
+        self._pool = multiprocessing.Pool(self.processes)
+
+    def terminate(self):
+        self._pool.terminate()
 
 
 class EventDefaults(object):
@@ -47,11 +88,21 @@ class Dogstreams(object):
 
         logger.info("Dogstream parsers: %s" % repr(dogstreams))
 
-        return cls(logger, dogstreams)
+        parse_pool = None
+        processes = int(config.get('dogstream_processes', 0) or 0)
+        if processes > 0:
+            parse_pool = cls._start_parse_pool(logger, dogstreams, processes)
 
-    def __init__(self, logger, dogstreams):
+        return cls(logger, dogstreams, parse_pool)
+
+    def __init__(self, logger, dogstreams, parse_pool=None):
         self.logger = logger
         self.dogstreams = dogstreams
+        self.parse_pool = parse_pool
+
+    def stop(self):
+        if self.parse_pool is not None:
+            self.parse_pool.terminate()
 
     @classmethod
     def _instantiate_dogstreams(cls, logger, config, dogstreams_config):
@@ -90,6 +141,28 @@ class Dogstreams(object):
 
         return dogstreams
 
+    @classmethod
+    def _start_parse_pool(cls, logger, dogstreams, processes):
+        """
+        Parse the lines of the dogstreams with stateless parsers on a pool of
+        `processes` processes. It's started once the parsers are loaded, for
+        the processes to inherit them. Return the pool, if any.
+        """
+        pooled = [d for d in dogstreams if d.is_stateless()]
+        if not pooled:
+            logger.info("No stateless dogstream parser to run on a pool of processes")
+            return None
+        if Platform.is_win32():
+            logger.warning("Dogstream parsers can't run on a pool of processes on Windows")
+            return None
+
+        logger.info("Parsing %s on a pool of %s processes" %
+                    (', '.join(d.log_path for d in pooled), processes))
+        pool = ParsePool(processes)
+        for dogstream in pooled:
+            dogstream.parse_pool = pool
+        return pool
+
     @classmethod
     def _get_dogstream_log_paths(cls, path):
         """
@@ -165,33 +238,56 @@ class Dogstream(object):
         self.parse_func = parse_func or self._default_line_parser
         self.parse_args = parse_args
 
+        # Pool of processes to parse the lines on, when the parser is stateless
+        self.parse_pool = None
+
         self._gen = None
-        self._values = None
+        # (timestamp, metric, host_name, device_name) -> [last value, sum of values, attributes]
+        self._points = None
+        self._point_count = 0
         self._freq = 15 # Will get updated on each check()
         self._error_count = 0L
         self._line_count = 0L
         self.parser_state = {}
+        # Lines not sent to the pool yet, and chunks being parsed with their results
+        self._line_chunk = []
+        self._parsed_chunks = []
+
+    def is_stateless(self):
+        """
+        Whether the parser only takes the logger and the line, and can parse
+        lines in any process
+        """
+        if self.class_based or self.parse_args or not inspect.isfunction(self.parse_func):
+            return False
+        return len(inspect.getargspec(self.parse_func).args) == 2
 
     def check(self, agentConfig, move_end=True):
         if self.log_path:
             self._freq = int(agentConfig.get('check_freq', 15))
-            self._values = []
+            self._points = {}
+            self._point_count = 0
             self._events = []
 
             # Build our tail -f
             if self._gen is None:
-                self._gen = TailFile(self.logger, self.log_path, self._line_parser).tail(line_by_line=False, move_end=move_end)
+                line_parser = self._queue_line if self.parse_pool is not None else self._line_parser
+                self._gen = TailFile(self.logger, self.log_path, line_parser,
+                                     **get_tail_options(agentConfig)).tail(line_by_line=False, move_end=move_end)
 
             # read until the end of file
             try:
                 self._gen.next()
                 self.logger.debug("Done dogstream check for file {0}".format(self.log_path))
-                self.logger.debug("Found {0} metric points".format(len(self._values)))
             except StopIteration, e:
                 self.logger.exception(e)
                 self.logger.warn("Can't tail %s file" % self.log_path)
 
-            check_output = self._aggregate(self._values)
+            if self.parse_pool is not None:
+                self._collect_parsed_lines()
+            self.logger.debug("Found {0} metric points".format(self._point_count))
+
+            check_output = self._aggregate(self._points)
             if self._events:
                 check_output.update({"dogstreamEvents": self._events})
                 self.logger.debug("Found {0} events".format(len(self._events)))
@@ -199,6 +295,67 @@ class Dogstream(object):
         else:
             return {}
 
+    def _queue_line(self, line):
+        self._line_chunk.append(line)
+        if len(self._line_chunk) >= PARSE_CHUNK_SIZE:
+            self._submit_line_chunk()
+
+    def _submit_line_chunk(self):
+        if self._line_chunk:
+            result = self.parse_pool.apply_async(parse_lines, (self.parse_func, self._line_chunk))
+            self._parsed_chunks.append((self._line_chunk, result))
+            self._line_chunk = []
+
+    def _collect_parsed_lines(self):
+        """
+        Process the results of the lines parsed by the pool, in the order of
+        the lines in the file. A chunk not parsed in time counts as parser
+        errors, and the pool is restarted as one of its processes is stuck.
+        """
+        self._submit_line_chunk()
+        parsed_chunks, self._parsed_chunks = self._parsed_chunks, []
+        pool_stuck = False
+        for lines, result in parsed_chunks:
+            try:
+                # Once the pool is stuck, only take the chunks already parsed
+                if pool_stuck and not result.ready():
+                    raise multiprocessing.TimeoutError()
+                parsed_lines = result.get(timeout=PARSE_CHUNK_TIMEOUT)
+            except multiprocessing.TimeoutError:
+                pool_stuck = True
+                self._count_chunk_errors(lines, "Timed out parsing")
+                continue
+            except Exception:
+                self.logger.exception("Unable to parse %s lines of %s" % (len(lines), self.log_path))
+                self._count_chunk_errors(lines, "Unable to parse")
+                continue
+
+            for line, (parsed, error) in zip(lines, parsed_lines):
+                self._line_count += 1
+                if error is not None:
+                    self.logger.debug("Error while parsing line %s\n%s" % (line, error))
+                    self._count_parser_error()
+                    continue
+                try:
+                    self._process_parsed(parsed, line)
+                except Exception:
+                    self.logger.debug("Error while parsing line %s" % line, exc_info=True)
+                    self._count_parser_error()
+
+        if pool_stuck:
+            self.logger.warning("Restarting the dogstream parsing pool")
+            self.parse_pool.restart()
+
+    def _count_chunk_errors(self, lines, reason):
+        self._line_count += len(lines)
+        self._error_count += len(lines)
+        self.logger.error("%s %s lines of %s, parser errors: %s out of %s" %
+                          (reason, len(lines), self.log_path, self._error_count, self._line_count))
+
+    def _count_parser_error(self):
+        self._error_count += 1
+        self.logger.error("Parser error: %s out of %s" % (self._error_count, self._line_count))
+
     def _line_parser(self, line):
         try:
             # alq - Allow parser state to be kept between invocations
@@ -217,67 +374,83 @@ class Dogstream(object):
                     parsed = self.parse_func(self.logger, line)
 
             self._line_count += 1
+            self._process_parsed(parsed, line)
+        except Exception:
+            self.logger.debug("Error while parsing line %s" % line, exc_info=True)
+            self._count_parser_error()
 
-            if parsed is None:
-                return
-
-            if isinstance(parsed, (tuple, dict)):
-                parsed = [parsed]
-
-            for datum in parsed:
-                # Check if it's an event
-                if isinstance(datum, dict):
-                    # An event requires at least a title or a body
-                    if 'msg_title' not in datum and 'msg_text' not in datum:
-                        continue
-
-                    # Populate the default fields
-                    if 'event_type' not in datum:
-                        datum['event_type'] = EventDefaults.EVENT_TYPE
-                    if 'timestamp' not in datum:
-                        datum['timestamp'] = time.time()
-                    # Make sure event_object and aggregation_key (synonyms) are set
-                    # FIXME when the backend treats those as true synonyms, we can
-                    # deprecate event_object.
-                    if 'event_object' in datum or 'aggregation_key' in datum:
-                        datum['aggregation_key'] = datum.get('event_object', datum.get('aggregation_key'))
-                    else:
-                        datum['aggregation_key'] = EventDefaults.EVENT_OBJECT
-                    datum['event_object'] = datum['aggregation_key']
+    def _process_parsed(self, parsed, line):
+        if parsed is None:
+            return
 
-                    self._events.append(datum)
-                    continue
+        if isinstance(parsed, (tuple, dict)):
+            parsed = [parsed]
 
-                # Otherwise, assume it's a metric
-                try:
-                    metric, ts, value, attrs = datum
-                except Exception:
+        for datum in parsed:
+            # Check if it's an event
+            if isinstance(datum, dict):
+                # An event requires at least a title or a body
+                if 'msg_title' not in datum and 'msg_text' not in datum:
                     continue
 
-                # Validation
-                invalid_reasons = []
-                try:
-                    # Bucket points into 15 second buckets
-                    ts = (int(float(ts)) / self._freq) * self._freq
-                    date = datetime.fromtimestamp(ts)
-                    assert date.year > 1990
-                except Exception:
-                    invalid_reasons.append('invalid timestamp')
+                # Populate the default fields
+                if 'event_type' not in datum:
+                    datum['event_type'] = EventDefaults.EVENT_TYPE
+                if 'timestamp' not in datum:
+                    datum['timestamp'] = time.time()
+                # Make sure event_object and aggregation_key (synonyms) are set
+                # FIXME when the backend treats those as true synonyms, we can
+                # deprecate event_object.
+                if 'event_object' in datum or 'aggregation_key' in datum:
+                    datum['aggregation_key'] = datum.get('event_object', datum.get('aggregation_key'))
+                else:
+                    datum['aggregation_key'] = EventDefaults.EVENT_OBJECT
+                datum['event_object'] = datum['aggregation_key']
 
-                try:
-                    value = float(value)
-                except Exception:
-                    invalid_reasons.append('invalid metric value')
+                self._events.append(datum)
+                continue
 
-                if invalid_reasons:
-                    self.logger.debug('Invalid parsed values %s (%s): "%s"',
-                        repr(datum), ', '.join(invalid_reasons), line)
-                else:
-                    self._values.append((metric, ts, value, attrs))
-        except Exception:
-            self.logger.debug("Error while parsing line %s" % line, exc_info=True)
-            self._error_count += 1
-            self.logger.error("Parser error: %s out of %s" % (self._error_count, self._line_count))
+            # Otherwise, assume it's a metric
+            try:
+                metric, ts, value, attrs = datum
+            except Exception:
+                continue
+
+            # Validation
+            invalid_reasons = []
+            try:
+                # Bucket points into 15 second buckets
+                ts = (int(float(ts)) / self._freq) * self._freq
+                date = datetime.fromtimestamp(ts)
+                assert date.year > 1990
+            except Exception:
+                invalid_reasons.append('invalid timestamp')
+
+            try:
+                value = float(value)
+            except Exception:
+                invalid_reasons.append('invalid metric value')
+
+            if invalid_reasons:
+                self.logger.debug('Invalid parsed values %s (%s): "%s"',
+                    repr(datum), ', '.join(invalid_reasons), line)
+            else:
+                self._add_point(metric, ts, value, attrs)
+
+    def _add_point(self, metric, ts, value, attrs):
+        """
+        Fold the point into the one of its timestamp bucket, metric, host and
+        device
+        """
+        key = (ts, metric, attrs.get('host_name', None), attrs.get('device_name', None))
+        point = self._points.get(key)
+        if point is None:
+            self._points[key] = [value, value, dict(attrs)]
+        else:
+            point[0] = value
+            point[1] += value
+            point[2].update(attrs)
+        self._point_count += 1
 
     def _default_line_parser(self, logger, line):
         sep = ' '
@@ -296,40 +469,25 @@ class Dogstream(object):
 
         return metric, timestamp, value, attributes
 
-    def _aggregate(self, values):
-        """ Aggregate values down to the second and store as:
+    def _aggregate(self, points):
+        """ Aggregate the points folded by bucket and store as:
             {
                 "dogstream": [(metric, timestamp, value, {key: val})]
             }
-            If there are many values per second for a metric, take the median
+            If there are many values in a bucket for a metric, take the last
+            one, or their sum for a counter
         """
         output = []
 
-        values.sort(key=point_sorter)
-
-        for (timestamp, metric, host_name, device_name), val_attrs in groupby(values, key=point_sorter):
-            attributes = {}
-            vals = []
-            for _metric, _timestamp, v, a in val_attrs:
-                try:
-                    v = float(v)
-                    vals.append(v)
-                    attributes.update(a)
-                except Exception:
-                    self.logger.debug("Could not convert %s into a float", v)
-
-            if len(vals) == 1:
-                val = vals[0]
-            elif len(vals) > 1:
-                val = vals[-1]
-            else: # len(vals) == 0
-                continue
+        for key in sorted(points):
+            timestamp, metric, _, _ = key
+            last_value, total, attributes = points[key]
 
             metric_type = str(attributes.get('metric_type', '')).lower()
-            if metric_type == 'gauge':
-                val = float(val)
-            elif metric_type == 'counter':
-                val = sum(vals)
+            if metric_type == 'counter':
+                val = total
+            else:
+                val = last_value
 
             output.append((metric, timestamp, val, attributes))
 
@@ -72,16 +72,18 @@ class Pool(object):
     few different ways
     """
 
-    def __init__(self, nworkers, name="Pool"):
+    def __init__(self, nworkers, name="Pool", daemon=False):
         """
         \param nworkers (integer) number of worker threads to start
         \param name (string) prefix for the worker threads' name
+        \param daemon (boolean) whether the worker threads are daemonic
         """
         self._workq = Queue.Queue()
         self._closed = False
         self._workers = []
         for idx in xrange(nworkers):
             thr = PoolWorker(self._workq, name="Worker-%s-%d" % (name, idx))
+            thr.daemon = daemon
             try:
                 thr.start()
             except:
@@ -0,0 +1,107 @@
+"""
+Scheduling of the checks.d check instances configured with their own
+collection interval.
+"""
+# stdlib
+import heapq
+import itertools
+import random
+import time
+
+# Fraction of its interval the first run of an instance is delayed by, at most
+DEFAULT_JITTER = 1.0
+
+
+def get_collection_interval(check, instance):
+    """
+    Return the `collection_interval` of a check instance, in seconds, or None
+    if it runs with every collection run of the collector.
+    """
+    interval = instance.get('collection_interval', check.init_config.get('collection_interval'))
+    if interval is None:
+        return None
+    interval = float(interval)
+    if interval <= 0:
+        return None
+    return interval
+
+
+class CheckScheduler(object):
+    """
+    Priority queue of the next runs of the check instances which have a
+    `collection_interval`: they run every `collection_interval` seconds,
+    whether it is shorter or longer than the `check_freq` of the collector.
+
+    The first run of each instance is delayed by a random fraction of its
+    interval (at most `jitter`) so that instances with the same interval
+    don't all run at once. The next runs keep this phase.
+    """
+
+    def __init__(self, jitter=DEFAULT_JITTER):
+        self.jitter = jitter
+        # (run time, sequence number, check, instance index, interval)
+        self._queue = []
+        self._sequence = itertools.count()
+        # check -> frozenset of the indexes of its scheduled instances
+        self._scheduled_instances = {}
+
+    def __len__(self):
+        return len(self._queue)
+
+    def update(self, checks, now=None):
+        """
+        Schedule the instances of the checks not scheduled yet, and stop
+        scheduling the ones which are not in `checks` anymore.
+        """
+        now = now or time.time()
+        checks = list(checks)
+
+        removed = set(self._scheduled_instances).difference(checks)
+        for check in removed:
+            del self._scheduled_instances[check]
+        if removed:
+            self._queue = [entry for entry in self._queue if entry[2] in self._scheduled_instances]
+            heapq.heapify(self._queue)
+
+        for check in checks:
+            if check in self._scheduled_instances:
+                continue
+            scheduled = set()
+            for i, instance in enumerate(check.instances):
+                interval = get_collection_interval(check, instance)
+                if interval is None:
+                    continue
+                scheduled.add(i)
+                run_time = now + random.random() * self.jitter * interval
+                heapq.heappush(self._queue, (run_time, next(self._sequence), check, i, interval))
+            self._scheduled_instances[check] = frozenset(scheduled)
+
+    def scheduled_instances(self, check):
+        """ Return the indexes of the instances of `check` which are scheduled """
+        return self._scheduled_instances.get(check, frozenset())
+
+    def next_run_time(self):
+        """ Return when the next instance is due, None if none is scheduled """
+        if not self._queue:
+            return None
+        return self._queue[0][0]
+
+    def pop_due(self, now=None):
+        """
+        Return the instances due at `now`, as a dict check -> sorted list of
+        instance indexes, and schedule their next run. The runs an instance
+        missed, because the collector was busy, are skipped.
+        """
+        now = now or time.time()
+        queue = self._queue
+        due = {}
+        while queue and queue[0][0] <= now:
+            run_time, _, check, i, interval = queue[0]
+            due.setdefault(check, []).append(i)
+
+            missed = int((now - run_time) // interval) + 1
+            heapq.heapreplace(queue, (run_time + missed * interval, next(self._sequence), check, i, interval))
+
+        for instances in due.itervalues():
+            instances.sort()
+        return due
@@ -3,6 +3,7 @@ Unix system checks.
 """
 # stdlib
 import operator
+import os
 import platform
 import re
 import sys
@@ -23,6 +24,26 @@ except ImportError:
 # locale-resilient float converter
 to_float = lambda s: float(s.replace(",", "."))
 
+DEFAULT_PROCFS_PATH = '/proc'
+
+# /proc/diskstats counts sectors of 512 bytes, whatever the device
+DISKSTATS_SECTOR_SIZE = 512
+
+# Indexes of the /proc/diskstats counters, after the major, minor and device
+# name columns
+(DISK_READS, DISK_READS_MERGED, DISK_SECTORS_READ, DISK_MS_READING,
+ DISK_WRITES, DISK_WRITES_MERGED, DISK_SECTORS_WRITTEN, DISK_MS_WRITING,
+ DISK_IOS_IN_PROGRESS, DISK_MS_DOING_IO, DISK_WEIGHTED_MS_DOING_IO) = range(11)
+
+# Columns of the aggregated cpu line of /proc/stat, in jiffies
+CPU_STAT_COLUMNS = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq',
+                    'steal', 'guest', 'guest_nice')
+
+
+def read_proc_file(procfs_path, name):
+    with open(os.path.join(procfs_path, name), 'r') as f:
+        return f.read()
+
 
 class IO(Check):
 
@@ -31,6 +52,8 @@ class IO(Check):
         self.header_re = re.compile(r'([%\\/\-_a-zA-Z0-9]+)[\s+]?')
         self.item_re = re.compile(r'^([a-zA-Z0-9\/]+)')
         self.value_re = re.compile(r'\d+\.\d+')
+        # (uptime, {device: counters}) of the previous run
+        self._last_diskstats = None
 
     def _parse_linux2(self, output):
         recentStats = output.split('Device:')[2].split('\n')
@@ -70,6 +93,86 @@ class IO(Check):
 
         return ioStats
 
+    @staticmethod
+    def _parse_diskstats(output):
+        """
+        Return the counters of each device of /proc/diskstats, as a dict
+        device -> list of ints. Devices which never did any I/O are skipped
+        like iostat does.
+        """
+        # $ cat /proc/diskstats
+        #    8       0 sda 22342 1209 1170754 14220 47203 35633 2393800 81432 0 35312 95652
+        #    8       1 sda1 22143 1209 1169122 14168 47203 35633 2393800 81432 0 35280 95600
+        #    7       0 loop0 0 0 0 0 0 0 0 0 0 0 0
+        diskstats = {}
+        for line in output.splitlines():
+            fields = line.split()
+            # Partitions of old kernels only have 4 counters
+            if len(fields) < 14:
+                continue
+            counters = [int(f) for f in fields[3:14]]
+            if any(counters):
+                diskstats[fields[2]] = counters
+        return diskstats
+
+    @staticmethod
+    def _compute_linux_io_stats(previous, current, interval):
+        """
+        Compute the `iostat -x -k` statistics of each device from two
+        /proc/diskstats snapshots taken `interval` seconds apart.
+        """
+        io_stats = {}
+        for device, counters in current.iteritems():
+            previous_counters = previous.get(device)
+            if previous_counters is None:
+                continue
+            delta = [c - p for c, p in zip(counters, previous_counters)]
+            # The counters wrapped around or the device was replaced
+            if any(d < 0 for i, d in enumerate(delta) if i != DISK_IOS_IN_PROGRESS):
+                continue
+
+            reads, writes = delta[DISK_READS], delta[DISK_WRITES]
+            ios = reads + writes
+            ms_reading, ms_writing = delta[DISK_MS_READING], delta[DISK_MS_WRITING]
+            sectors_to_kb = DISKSTATS_SECTOR_SIZE / 1024.0
+            stats = {
+                'rrqm/s': delta[DISK_READS_MERGED] / interval,
+                'wrqm/s': delta[DISK_WRITES_MERGED] / interval,
+                'r/s': reads / interval,
+                'w/s': writes / interval,
+                'rkB/s': delta[DISK_SECTORS_READ] * sectors_to_kb / interval,
+                'wkB/s': delta[DISK_SECTORS_WRITTEN] * sectors_to_kb / interval,
+                'avgrq-sz': float(delta[DISK_SECTORS_READ] + delta[DISK_SECTORS_WRITTEN]) / ios if ios else 0,
+                'avgqu-sz': delta[DISK_WEIGHTED_MS_DOING_IO] / (interval * 1000),
+                'await': float(ms_reading + ms_writing) / ios if ios else 0,
+                'r_await': float(ms_reading) / reads if reads else 0,
+                'w_await': float(ms_writing) / writes if writes else 0,
+                'svctm': float(delta[DISK_MS_DOING_IO]) / ios if ios else 0,
+                '%util': min(100.0, delta[DISK_MS_DOING_IO] / (interval * 10)),
+            }
+            # Same format as iostat
+            io_stats[device] = dict((k, '%.2f' % v) for k, v in stats.iteritems())
+
+        return io_stats
+
+    def _check_linux(self, procfs_path):
+        """
+        Compute the I/O statistics since the previous run from
+        /proc/diskstats, without sleeping. The first run returns no
+        statistics.
+        """
+        uptime = float(read_proc_file(procfs_path, 'uptime').split()[0])
+        diskstats = self._parse_diskstats(read_proc_file(procfs_path, 'diskstats'))
+
+        io_stats = {}
+        if self._last_diskstats is not None:
+            last_uptime, last_diskstats = self._last_diskstats
+            interval = uptime - last_uptime
+            if interval > 0:
+                io_stats = self._compute_linux_io_stats(last_diskstats, diskstats, interval)
+        self._last_diskstats = (uptime, diskstats)
+        return io_stats
+
     def _parse_darwin(self, output):
         lines = [l.split() for l in output.split("\n") if len(l) > 0]
         disks = lines[0]
@@ -113,6 +216,13 @@ class IO(Check):
         io = {}
         try:
             if Platform.is_linux():
+                try:
+                    io.update(self._check_linux(agentConfig.get('procfs_path', DEFAULT_PROCFS_PATH)))
+                except IOError:
+                    self.logger.debug("Cannot read /proc/diskstats, falling back on iostat", exc_info=True)
+                else:
+                    return self._filter_devices(agentConfig, io)
+
                 stdout, _, _ = get_subprocess_output(['iostat', '-d', '1', '2', '-x', '-k'], self.logger)
 
                 #                 Linux 2.6.32-343-ec2 (ip-10-35-95-10)   12/11/2012      _x86_64_        (2 CPU)
@@ -199,21 +309,24 @@ class IO(Check):
             else:
                 return False
 
-            # If we filter devices, do it know.
-            device_blacklist_re = agentConfig.get('device_blacklist_re', None)
-            if device_blacklist_re:
-                filtered_io = {}
-                for device, stats in io.iteritems():
-                    if not device_blacklist_re.match(device):
-                        filtered_io[device] = stats
-            else:
-                filtered_io = io
-            return filtered_io
+            return self._filter_devices(agentConfig, io)
 
         except Exception:
             self.logger.exception("Cannot extract IO statistics")
             return False
 
+    @staticmethod
+    def _filter_devices(agentConfig, io):
+        device_blacklist_re = agentConfig.get('device_blacklist_re', None)
+        if device_blacklist_re:
+            filtered_io = {}
+            for device, stats in io.iteritems():
+                if not device_blacklist_re.match(device):
+                    filtered_io[device] = stats
+        else:
+            filtered_io = io
+        return filtered_io
+
 
 class Load(Check):
 
@@ -563,6 +676,67 @@ class Processes(Check):
 
 class Cpu(Check):
 
+    def __init__(self, logger):
+        Check.__init__(self, logger)
+        # Counters of the aggregated cpu line of /proc/stat at the previous run
+        self._last_cpu_stat = None
+
+    @staticmethod
+    def _parse_cpu_stat(output):
+        """
+        Return the counters of the aggregated cpu line of /proc/stat, as a
+        dict column -> jiffies. Columns older kernels don't have are 0.
+        """
+        # $ cat /proc/stat
+        # cpu  30841 0 3603 297878 133 0 9 598 0 0
+        # cpu0 30841 0 3603 297878 133 0 9 598 0 0
+        for line in output.splitlines():
+            fields = line.split()
+            if fields and fields[0] == 'cpu':
+                counters = [int(f) for f in fields[1:len(CPU_STAT_COLUMNS) + 1]]
+                counters.extend([0] * (len(CPU_STAT_COLUMNS) - len(counters)))
+                return dict(zip(CPU_STAT_COLUMNS, counters))
+        return None
+
+    @staticmethod
+    def _compute_cpu_percentages(previous, current):
+        """
+        Compute the `mpstat` percentages of the cpu time spent in each state
+        between two /proc/stat snapshots.
+        """
+        delta = dict((k, current[k] - previous[k]) for k in CPU_STAT_COLUMNS)
+        # Guest time is accounted in user time too
+        total = sum(delta[k] for k in CPU_STAT_COLUMNS if k not in ('guest', 'guest_nice'))
+        if total <= 0 or any(v < 0 for v in delta.itervalues()):
+            return None
+        percentages = dict((k, 100.0 * v / total) for k, v in delta.iteritems())
+        return {
+            '%usr': max(0.0, percentages['user'] - percentages['guest']),
+            '%nice': max(0.0, percentages['nice'] - percentages['guest_nice']),
+            '%sys': percentages['system'],
+            '%iowait': percentages['iowait'],
+            '%irq': percentages['irq'],
+            '%soft': percentages['softirq'],
+            '%steal': percentages['steal'],
+            '%guest': percentages['guest'],
+            '%idle': percentages['idle'],
+        }
+
+    def _check_linux(self, procfs_path):
+        """
+        Compute the cpu usage since the previous run from /proc/stat,
+        without sleeping. The first run returns None.
+        """
+        cpu_stat = self._parse_cpu_stat(read_proc_file(procfs_path, 'stat'))
+        if cpu_stat is None:
+            raise IOError("No cpu line in /proc/stat")
+
+        cpu_metrics = None
+        if self._last_cpu_stat is not None:
+            cpu_metrics = self._compute_cpu_percentages(self._last_cpu_stat, cpu_stat)
+        self._last_cpu_stat = cpu_stat
+        return cpu_metrics
+
     def check(self, agentConfig):
         """Return an aggregate of CPU stats across all CPUs
         When figures are not available, False is sent back.
@@ -586,6 +760,20 @@ class Cpu(Check):
                 return 0.0
         try:
             if Platform.is_linux():
+                try:
+                    cpu_metrics = self._check_linux(agentConfig.get('procfs_path', DEFAULT_PROCFS_PATH))
+                except IOError:
+                    self.logger.debug("Cannot read /proc/stat, falling back on mpstat", exc_info=True)
+                else:
+                    if cpu_metrics is None:
+                        return False
+                    return format_results(cpu_metrics['%usr'] + cpu_metrics['%nice'],
+                                          cpu_metrics['%sys'] + cpu_metrics['%irq'] + cpu_metrics['%soft'],
+                                          cpu_metrics['%iowait'],
+                                          cpu_metrics['%idle'],
+                                          cpu_metrics['%steal'],
+                                          cpu_metrics['%guest'])
+
                 output, _, _ = get_subprocess_output(['mpstat', '1', '3'], self.logger)
                 mpstat = output.splitlines()
                 # topdog@ip:~$ mpstat 1 3
@@ -1,7 +1,9 @@
 # stdlib
 import ConfigParser
 from cStringIO import StringIO
+import copy
 import glob
+import hashlib
 import imp
 import inspect
 import itertools
@@ -15,6 +17,7 @@ import re
 from socket import gaierror, gethostbyname
 import string
 import sys
+import time
 import traceback
 from urlparse import urlparse
 
@@ -312,6 +315,21 @@ def get_histogram_percentiles(configstr=None):
 
     return result
 
+def get_histogram_sketch_accuracy(configstr=None):
+    if configstr is None:
+        return None
+
+    try:
+        accuracy = float(configstr)
+        if accuracy <= 0 or accuracy >= 1:
+            raise ValueError
+    except ValueError:
+        log.warning("Bad histogram sketch accuracy {0}, must be float in ]0;1[, skipping"
+            .format(configstr))
+        return None
+
+    return accuracy
+
 def get_config(parse_args=True, cfg_path=None, options=None):
     if parse_args:
         options, _ = get_parsed_args()
@@ -425,6 +443,9 @@ def get_config(parse_args=True, cfg_path=None, options=None):
         if config.has_option('Main', 'histogram_percentiles'):
             agentConfig['histogram_percentiles'] = get_histogram_percentiles(config.get('Main', 'histogram_percentiles'))
 
+        if config.has_option('Main', 'histogram_sketch_accuracy'):
+            agentConfig['histogram_sketch_accuracy'] = get_histogram_sketch_accuracy(config.get('Main', 'histogram_sketch_accuracy'))
+
         # Disable Watchdog (optionally)
         if config.has_option('Main', 'watchdog'):
             if config.get('Main', 'watchdog').lower() in ('no', 'false'):
@@ -723,34 +744,95 @@ def get_ssl_certificate(osname, filename):
     log.info("Certificate file NOT found at %s" % str(path))
     return None
 
+# checks.d module path -> ((mtime, size), module) of the modules imported, so
+# that reloading the configuration only imports the modules which changed
+_checksd_modules = {}
+
+# conf.d file path -> (digest, config) of the configurations parsed
+_check_configs = {}
+
+# check name -> (check path, module, config digest, agentConfig, check) of the
+# checks initialized, reused as long as neither their code nor their
+# configuration changes so that they keep their state across reloads
+_initialized_checks = {}
+
+
 def check_yaml(conf_path):
     with open(conf_path) as f:
-        check_config = yaml.load(f.read(), Loader=yLoader)
-        assert 'init_config' in check_config, "No 'init_config' section found"
-        assert 'instances' in check_config, "No 'instances' section found"
+        return _parse_check_yaml(f.read())
+
+
+def _parse_check_yaml(content):
+    check_config = yaml.load(content, Loader=yLoader)
+    assert 'init_config' in check_config, "No 'init_config' section found"
+    assert 'instances' in check_config, "No 'instances' section found"
+
+    valid_instances = True
+    if check_config['instances'] is None or not isinstance(check_config['instances'], list):
+        valid_instances = False
+    else:
+        for i in check_config['instances']:
+            if not isinstance(i, dict):
+                valid_instances = False
+                break
+    if not valid_instances:
+        raise Exception('You need to have at least one instance defined in the YAML file for this check')
+    else:
+        return check_config
+
+
+def _load_check_config(conf_path):
+    """
+    Return the digest of the check configuration file and its parsed content,
+    only parsed again when the file changed.
+    """
+    with open(conf_path) as f:
+        content = f.read()
+    digest = hashlib.md5(content).hexdigest()
+
+    cached = _check_configs.get(conf_path)
+    if cached is None or cached[0] != digest:
+        cached = (digest, _parse_check_yaml(content))
+        _check_configs[conf_path] = cached
+
+    # The checks are free to modify their configuration
+    return digest, copy.deepcopy(cached[1])
+
+
+def _load_check_module(check_name, check_path):
+    """
+    Import the checks.d module, unless it has already been imported and the
+    file hasn't changed since.
+    """
+    stat = os.stat(check_path)
+    signature = (stat.st_mtime, stat.st_size)
+
+    cached = _checksd_modules.get(check_path)
+    if cached is None or cached[0] != signature:
+        # Import a new module rather than executing the new code in the
+        # module of the checks initialized before
+        module_name = 'checksd_%s' % check_name
+        sys.modules.pop(module_name, None)
+        cached = (signature, imp.load_source(module_name, check_path))
+        _checksd_modules[check_path] = cached
+
+    return cached[1]
 
-        valid_instances = True
-        if check_config['instances'] is None or not isinstance(check_config['instances'], list):
-            valid_instances = False
-        else:
-            for i in check_config['instances']:
-                if not isinstance(i, dict):
-                    valid_instances = False
-                    break
-        if not valid_instances:
-            raise Exception('You need to have at least one instance defined in the YAML file for this check')
-        else:
-            return check_config
 
 def load_check_directory(agentConfig, hostname):
     ''' Return the initialized checks from checks.d, and a mapping of checks that failed to
     initialize. Only checks that have a configuration
-    file in conf.d will be returned. '''
+    file in conf.d will be returned. The checks of the previous load which were
+    initialized again or aren't loaded anymore are returned as `replaced_checks`,
+    they should be stopped. '''
     from checks import AgentCheck, AGENT_METRICS_CHECK_NAME
 
     initialized_checks = {}
     init_failed_checks = {}
     deprecated_checks = {}
+    load_timings = {}
+    reused_checks = []
+    previous_checks = [entry[4] for entry in _initialized_checks.itervalues()]
     agentConfig['checksd_hostname'] = hostname
 
     deprecated_configs_enabled = [v for k,v in OLD_STYLE_PARAMETERS if len([l for l in agentConfig if l.startswith(k)]) > 0]
@@ -782,6 +864,7 @@ def load_check_directory(agentConfig, hostname):
     for check in itertools.chain(*checks_paths):
         check_name = os.path.basename(check).split('.')[0]
         check_config = None
+        config_digest = None
         if check_name in initialized_checks or check_name in init_failed_checks:
             log.debug('Skipping check %s because it has already been loaded from another location', check)
             continue
@@ -805,7 +888,7 @@ def load_check_directory(agentConfig, hostname):
 
         if conf_exists:
             try:
-                check_config = check_yaml(conf_path)
+                config_digest, check_config = _load_check_config(conf_path)
             except Exception, e:
                 log.exception("Unable to parse yaml config in %s" % conf_path)
                 traceback_message = traceback.format_exc()
@@ -829,14 +912,27 @@ def load_check_directory(agentConfig, hostname):
 
         # If we are here, there is a valid matching configuration file.
         # Let's try to import the check
+        import_start = time.time()
         try:
-            check_module = imp.load_source('checksd_%s' % check_name, check)
+            check_module = _load_check_module(check_name, check)
         except Exception, e:
             traceback_message = traceback.format_exc()
             # There is a configuration file for that check but the module can't be imported
             init_failed_checks[check_name] = {'error':e, 'traceback':traceback_message}
             log.exception('Unable to import check module %s.py from checks.d' % check_name)
             continue
+        import_time = time.time() - import_start
+
+        # Keep the check initialized by the previous load if neither its
+        # module nor its configuration changed
+        previous = _initialized_checks.get(check_name)
+        if previous is not None and config_digest is not None \
+                and previous[0] == check and previous[1] is check_module \
+                and previous[2] == config_digest and previous[3] is agentConfig:
+            initialized_checks[check_name] = previous[4]
+            reused_checks.append(check_name)
+            log.debug('Check %s is unchanged, keeping it' % check_name)
+            continue
 
         # We make sure that there is an AgentCheck class defined
         check_class = None
@@ -868,6 +964,7 @@ def load_check_directory(agentConfig, hostname):
             init_config = {}
 
         instances = check_config['instances']
+        init_start = time.time()
         try:
             try:
                 c = check_class(check_name, init_config=init_config,
@@ -884,21 +981,38 @@ def load_check_directory(agentConfig, hostname):
             init_failed_checks[check_name] = {'error':e, 'traceback':traceback_message}
         else:
             initialized_checks[check_name] = c
+            _initialized_checks[check_name] = (check, check_module, config_digest, agentConfig, c)
+            load_timings[check_name] = (import_time, time.time() - init_start)
 
         # Add custom pythonpath(s) if available
         if 'pythonpath' in check_config:
             pythonpath = check_config['pythonpath']
             if not isinstance(pythonpath, list):
                 pythonpath = [pythonpath]
-            sys.path.extend(pythonpath)
+            sys.path.extend(p for p in pythonpath if p not in sys.path)
 
         log.debug('Loaded check.d/%s.py' % check_name)
 
+    # Forget the checks which aren't loaded anymore
+    for check_name in _initialized_checks.keys():
+        if check_name not in initialized_checks:
+            del _initialized_checks[check_name]
+
+    kept_checks = set(id(c) for c in initialized_checks.itervalues())
+    replaced_checks = [c for c in previous_checks if id(c) not in kept_checks]
+
     init_failed_checks.update(deprecated_checks)
     log.info('initialized checks.d checks: %s' % [k for k in initialized_checks.keys() if k != AGENT_METRICS_CHECK_NAME])
+    if reused_checks:
+        log.info('unchanged checks.d checks kept: %s' % reused_checks)
+    if load_timings:
+        log.info('checks.d checks import/init times: %s' % ', '.join(
+            '%s: %.3fs/%.3fs' % (name, import_time, init_time)
+            for name, (import_time, init_time) in sorted(load_timings.iteritems())))
     log.info('initialization failed checks.d checks: %s' % init_failed_checks.keys())
     return {'initialized_checks':initialized_checks.values(),
             'init_failed_checks':init_failed_checks,
+            'replaced_checks':replaced_checks,
             }
 
 
@@ -12,7 +12,11 @@ from utils.proxy import set_no_proxy_settings  # noqa
 set_no_proxy_settings()
 
 # stdlib
+from collections import deque
+from errno import EAGAIN, EWOULDBLOCK
+import heapq
 import logging
+import multiprocessing
 import optparse
 import os
 import select
@@ -22,6 +26,7 @@ import sys
 import threading
 from time import sleep, time
 from urllib import urlencode
+from uuid import uuid4
 import zlib
 
 # For pickle & PID files, see issue 293
@@ -39,6 +44,7 @@ from config import get_config, get_version
 from daemon import AgentSupervisor, Daemon
 from util import chunks, get_hostname, get_uuid, plural
 from utils.pidfile import PidFile
+from utils.platform import Platform
 
 # urllib3 logs a bunch of stuff at the info level
 requests_log = logging.getLogger("requests.packages.urllib3")
@@ -64,6 +70,35 @@ FLUSH_LOGGING_INITIAL = 10
 FLUSH_LOGGING_COUNT = 5
 EVENT_CHUNK_SIZE = 50
 COMPRESS_THRESHOLD = 1024
+# Maximum size (in bytes) of a compressed series payload, the series of a
+# flush are split in several payloads above it
+DEFAULT_MAX_PAYLOAD_SIZE = 2 * 1024 * 1024
+SERIES_PAYLOAD_PREFIX = '{"series": ['
+SERIES_PAYLOAD_SEPARATOR = ', '
+SERIES_PAYLOAD_SUFFIX = ']}'
+SERIES_PAYLOAD_HEADERS = {'Content-Type': 'application/json', 'Content-Encoding': 'deflate'}
+# Number of series serialized at once, a payload is filled by batches
+SERIES_BATCH_SIZE = 100
+# Maximum number of datagrams drained from the socket on each wakeup of the
+# receive loop. 1 keeps the historical one recv per select behaviour.
+DEFAULT_RECV_BATCH_SIZE = 1
+# How often (in seconds) the server reports its receive statistics
+SERVER_STATS_INTERVAL = DOGSTATSD_FLUSH_INTERVAL
+# How long (in seconds) the reporter waits for a worker to export its state
+WORKER_EXPORT_TIMEOUT = 5
+# Not exposed by the socket module of python 2.7, this is the Linux value
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+# Asynchronous submission, see PayloadSender: number of payloads waiting to
+# be sent (or retried) in memory, size of the payloads spilled to disk when
+# it's full (in bytes), and backoff between the attempts to send a payload
+# (in seconds)
+DEFAULT_SUBMISSION_QUEUE_SIZE = 100
+DEFAULT_MAX_SPILL_SIZE = 100 * 1024 * 1024
+DEFAULT_RETRY_BACKOFF = 2
+MAX_RETRY_BACKOFF = 120
+MAX_SUBMISSION_ATTEMPTS = 8
+SUBMISSION_TIMEOUT = 5
+SPILL_FILE_SUFFIX = '.payload'
 
 
 def add_serialization_status_metric(status, hostname):
@@ -122,10 +157,403 @@ def serialize_metrics(metrics, hostname):
     return serialized, headers
 
 
+def zlib_compress_bound(size):
+    """ Upper bound of the size of `size` bytes once deflated, see compressBound in zlib """
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 13
+
+
+class CompressedSeriesPayload(object):
+    """
+    A `{"series": [...]}` payload, compressed as series are added to it,
+    which refuses series that could make it larger than `max_size` bytes.
+
+    The compressed size is only known exactly after a sync flush of the
+    compressor, so the payload is sync flushed when the worst case size of
+    what was added since the last one gets close to `max_size`.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.compressor = zlib.compressobj()
+        self.chunks = []
+        self.is_empty = True
+        # Compressed size so far, compressed size at the last sync flush, and
+        # uncompressed size of what was added since
+        self.compressed_size = 0
+        self.synced_size = 0
+        self.unsynced_size = 0
+        self._write(SERIES_PAYLOAD_PREFIX)
+
+    def _write(self, data):
+        chunk = self.compressor.compress(data)
+        self.chunks.append(chunk)
+        self.compressed_size += len(chunk)
+        self.unsynced_size += len(data)
+
+    def _sync(self):
+        chunk = self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.chunks.append(chunk)
+        self.compressed_size += len(chunk)
+        self.synced_size = self.compressed_size
+        self.unsynced_size = 0
+
+    def _max_size_with(self, size):
+        return self.synced_size + zlib_compress_bound(
+            self.unsynced_size + size + len(SERIES_PAYLOAD_SUFFIX))
+
+    def add(self, serialized_series):
+        """
+        Add serialized series (separated by SERIES_PAYLOAD_SEPARATOR if there
+        are several), return False if the payload is too full for them.
+        """
+        if not self.is_empty:
+            serialized_series = SERIES_PAYLOAD_SEPARATOR + serialized_series
+
+        if self._max_size_with(len(serialized_series)) > self.max_size:
+            if self.unsynced_size:
+                self._sync()
+            if self._max_size_with(len(serialized_series)) > self.max_size:
+                if not self.is_empty:
+                    return False
+                log.warning("Series larger than the maximum payload size (%s bytes),"
+                            " sending them anyway" % self.max_size)
+
+        self._write(serialized_series)
+        self.is_empty = False
+        return True
+
+    def close(self):
+        """ Return the compressed payload """
+        self._write(SERIES_PAYLOAD_SUFFIX)
+        self.chunks.append(self.compressor.flush())
+        return ''.join(self.chunks)
+
+
+def serialize_metrics_payloads(metrics, hostname, max_payload_size=DEFAULT_MAX_PAYLOAD_SIZE):
+    """
+    Serialize `metrics` in compressed payloads of at most `max_payload_size`
+    bytes, and yield them with their headers.
+    Series are serialized and compressed one at a time, so that neither the
+    whole JSON body nor the whole compressed body of a flush is ever built.
+    """
+    statuses = ["success"]
+
+    def serialized_series():
+        for batch in chunks(metrics, SERIES_BATCH_SIZE):
+            try:
+                # Strip the brackets of the list
+                yield json.dumps(batch)[1:-1]
+                continue
+            except UnicodeDecodeError as e:
+                log.exception("Unable to serialize payload. Trying to replace bad characters. %s", e)
+                if "failure" not in statuses:
+                    statuses.append("failure")
+
+            for metric in batch:
+                try:
+                    yield json.dumps(metric)
+                except UnicodeDecodeError:
+                    try:
+                        log.error(metric)
+                        yield json.dumps(unicode_metrics([metric])[0])
+                    except Exception as e:
+                        log.exception("Unable to serialize series. Giving up. %s", e)
+                        if "permanent_failure" not in statuses:
+                            statuses.append("permanent_failure")
+
+        yield json.dumps([add_serialization_status_metric(status, hostname)
+                          for status in statuses])[1:-1]
+
+    payload = CompressedSeriesPayload(max_payload_size)
+    for serialized in serialized_series():
+        if not payload.add(serialized):
+            yield payload.close(), dict(SERIES_PAYLOAD_HEADERS)
+            payload = CompressedSeriesPayload(max_payload_size)
+            payload.add(serialized)
+
+    yield payload.close(), dict(SERIES_PAYLOAD_HEADERS)
+
+
 def serialize_event(event):
     return json.dumps(event)
 
 
+def get_udp_socket_drops(sock):
+    """
+    Return the number of datagrams dropped by the kernel for this socket
+    because its receive buffer was full, as reported in /proc/net/udp{,6}.
+    Return None when it can't be found (e.g. not on Linux).
+    """
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        for path in ('/proc/net/udp', '/proc/net/udp6'):
+            with open(path) as f:
+                f.readline()  # header
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        return int(fields[12])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class Payload(object):
+    """ A serialized payload to POST, and its delivery attempts """
+
+    def __init__(self, url, data, headers):
+        self.url = url
+        self.data = data
+        self.headers = headers
+        self.attempts = 0
+
+
+class PayloadSender(object):
+    """
+    Send payloads from a pool of threads, so that a slow or unavailable
+    endpoint doesn't hold the flushes of the reporter.
+
+    Payloads that can't be sent are retried with an exponential backoff.
+    At most `max_queue_size` payloads wait in memory, the following ones
+    are spilled to `spill_dir` when it's set (and dropped otherwise), then
+    read back once the queue has room again. Spilled payloads left by a
+    previous run are sent too.
+    """
+
+    def __init__(self, workers_count=1, max_queue_size=DEFAULT_SUBMISSION_QUEUE_SIZE,
+                 spill_dir=None, max_spill_size=DEFAULT_MAX_SPILL_SIZE,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF, timeout=SUBMISSION_TIMEOUT):
+        self.workers_count = workers_count
+        self.max_queue_size = max_queue_size
+        self.spill_dir = spill_dir
+        self.max_spill_size = max_spill_size
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.workers = []
+        # Payloads ready to be sent, and heap of (retry time, payload id, payload)
+        self.ready = deque()
+        self.retries = []
+        self.sending_count = 0
+        # (path, size) of the spilled payloads, oldest first
+        self.spilled = deque()
+        self.spilled_size = 0
+        if spill_dir:
+            self._load_spilled()
+
+        # Stats since the last `submit_stats`
+        self.latencies = []
+        self.retry_count = 0
+        self.drop_count = 0
+        self.spill_count = 0
+
+    def queue_size(self):
+        return len(self.ready) + len(self.retries) + self.sending_count
+
+    def start(self):
+        for i in xrange(self.workers_count):
+            worker = threading.Thread(target=self._work, name="PayloadSender-%s" % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=SUBMISSION_TIMEOUT):
+        """ Stop the workers, and spill the payloads which weren't sent """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join(timeout)
+
+        with self.condition:
+            payloads = list(self.ready) + [payload for _, _, payload in self.retries]
+            self.ready.clear()
+            self.retries = []
+            for payload in payloads:
+                self._overflow(payload)
+
+    def submit(self, url, data, headers):
+        with self.condition:
+            payload = Payload(url, data, headers)
+            # Once stopped, nothing sends the queued payloads anymore
+            if not self.stopped and self.queue_size() < self.max_queue_size:
+                self.ready.append(payload)
+                self.condition.notify()
+            else:
+                self._overflow(payload)
+
+    def _next_payload(self):
+        """ Wait for a payload to send, return None once stopped """
+        with self.condition:
+            while not self.stopped:
+                if self.ready:
+                    payload = self.ready.popleft()
+                elif self.retries and self.retries[0][0] <= time():
+                    payload = heapq.heappop(self.retries)[2]
+                elif self.spilled and self.queue_size() < self.max_queue_size:
+                    payload = self._unspill()
+                    if payload is None:
+                        continue
+                else:
+                    timeout = 1
+                    if self.retries:
+                        timeout = min(timeout, max(0, self.retries[0][0] - time()))
+                    self.condition.wait(timeout)
+                    continue
+                self.sending_count += 1
+                return payload
+        return None
+
+    def _work(self):
+        session = requests.Session()
+        while True:
+            payload = self._next_payload()
+            if payload is None:
+                return
+            try:
+                retry = self._send(session, payload)
+            except Exception:
+                log.exception("Unexpected error while sending a payload to %s" % payload.url)
+                retry = False
+
+            with self.condition:
+                self.sending_count -= 1
+                if not retry:
+                    continue
+                payload.attempts += 1
+                if payload.attempts >= MAX_SUBMISSION_ATTEMPTS:
+                    log.error("Dropping a payload to %s after %s attempts" % (payload.url, payload.attempts))
+                    self.drop_count += 1
+                    continue
+                self.retry_count += 1
+                backoff = min(self.retry_backoff * 2 ** (payload.attempts - 1), MAX_RETRY_BACKOFF)
+                if not self.stopped and self.queue_size() < self.max_queue_size:
+                    heapq.heappush(self.retries, (time() + backoff, id(payload), payload))
+                    self.condition.notify()
+                else:
+                    self._overflow(payload)
+
+    def _send(self, session, payload):
+        """ POST the payload, return whether it should be retried """
+        start_time = time()
+        try:
+            r = session.post(payload.url, data=payload.data, timeout=self.timeout, headers=payload.headers)
+        except Exception as e:
+            log.warning("Unable to post payload to %s, will retry: %s" % (payload.url, e))
+            return True
+        duration = time() - start_time
+        with self.condition:
+            self.latencies.append(duration)
+
+        log.debug("%s POST %s (%sms)" % (r.status_code, payload.url, round(duration * 1000.0, 4)))
+        if r.status_code >= 500 or r.status_code in (408, 429):
+            log.warning("Payload to %s failed with status code %s, will retry" % (payload.url, r.status_code))
+            return True
+        if r.status_code >= 400:
+            log.error("Payload to %s rejected with status code %s" % (payload.url, r.status_code))
+            with self.condition:
+                self.drop_count += 1
+        return False
+
+    def _overflow(self, payload):
+        """ Spill or drop a payload that doesn't fit in memory, with the condition held """
+        if not self.spill_dir:
+            log.warning("Submission queue full, dropping a payload to %s" % payload.url)
+            self.drop_count += 1
+            return
+
+        path = os.path.join(self.spill_dir, "%017.6f-%s%s" % (time(), uuid4().hex, SPILL_FILE_SUFFIX))
+        try:
+            data = payload.data
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            # A JSON header line, followed by the raw body
+            with open(path, 'wb') as f:
+                f.write(json.dumps({'url': payload.url, 'headers': payload.headers}))
+                f.write('\n')
+                f.write(data)
+            size = os.path.getsize(path)
+        except (IOError, OSError, TypeError, ValueError):
+            log.exception("Unable to spill a payload to %s, dropping it" % path)
+            self.drop_count += 1
+            return
+        self.spilled.append((path, size))
+        self.spilled_size += size
+        self.spill_count += 1
+
+        while self.spilled_size > self.max_spill_size and len(self.spilled) > 1:
+            oldest_path, oldest_size = self.spilled.popleft()
+            log.warning("Spilled payloads exceed %s bytes, dropping %s" % (self.max_spill_size, oldest_path))
+            self._remove_spilled(oldest_path, oldest_size)
+            self.drop_count += 1
+
+    def _unspill(self):
+        path, size = self.spilled.popleft()
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                data = f.read()
+            # httplib can't mix unicode headers with a binary body
+            headers = dict(
+                (k.encode('utf-8'), v.encode('utf-8') if isinstance(v, unicode) else v)
+                for k, v in header['headers'].iteritems()
+            )
+            payload = Payload(header['url'].encode('utf-8'), data, headers)
+        except Exception:
+            log.exception("Unable to read the spilled payload %s, dropping it" % path)
+            payload = None
+        self._remove_spilled(path, size)
+        return payload
+
+    def _remove_spilled(self, path, size):
+        self.spilled_size -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _load_spilled(self):
+        try:
+            if not os.path.isdir(self.spill_dir):
+                os.makedirs(self.spill_dir)
+            # File names start with their spill time
+            for name in sorted(os.listdir(self.spill_dir)):
+                if name.endswith(SPILL_FILE_SUFFIX):
+                    path = os.path.join(self.spill_dir, name)
+                    size = os.path.getsize(path)
+                    self.spilled.append((path, size))
+                    self.spilled_size += size
+        except OSError:
+            log.exception("Unable to use %s to spill payloads, disabling it" % self.spill_dir)
+            self.spill_dir = None
+        if self.spilled:
+            log.info("%s payloads spilled by a previous run will be sent" % len(self.spilled))
+
+    def submit_stats(self, aggregator):
+        """ Submit the queue depth, latency and errors since the last call to the aggregator """
+        with self.condition:
+            latencies = self.latencies
+            self.latencies = []
+            stats = [
+                ('datadog.dogstatsd.submission.queue_size', self.queue_size(), 'g'),
+                ('datadog.dogstatsd.submission.spilled_payloads', len(self.spilled), 'g'),
+                ('datadog.dogstatsd.submission.retries', self.retry_count, 'c'),
+                ('datadog.dogstatsd.submission.dropped', self.drop_count, 'c'),
+                ('datadog.dogstatsd.submission.spilled', self.spill_count, 'c'),
+            ]
+            self.retry_count = 0
+            self.drop_count = 0
+            self.spill_count = 0
+
+        if latencies:
+            stats.append(('datadog.dogstatsd.submission.latency.avg', sum(latencies) / len(latencies), 'g'))
+            stats.append(('datadog.dogstatsd.submission.latency.max', max(latencies), 'g'))
+        for name, value, mtype in stats:
+            aggregator.submit_metric(name, value, mtype)
+
+
 class Reporter(threading.Thread):
     """
     The reporter periodically sends the aggregated metrics to the
@@ -133,11 +561,15 @@ class Reporter(threading.Thread):
     """
 
     def __init__(self, interval, metrics_aggregator, api_host, api_key=None,
-                 use_watchdog=False, event_chunk_size=None):
+                 use_watchdog=False, event_chunk_size=None, worker_pool=None,
+                 max_payload_size=None, payload_sender=None):
         threading.Thread.__init__(self)
         self.interval = int(interval)
         self.finished = threading.Event()
         self.metrics_aggregator = metrics_aggregator
+        # When dogstatsd runs several server processes, their state is merged
+        # into `metrics_aggregator` before each flush.
+        self.worker_pool = worker_pool
         self.flush_count = 0
         self.log_count = 0
         self.hostname = get_hostname()
@@ -150,6 +582,11 @@ class Reporter(threading.Thread):
         self.api_key = api_key
         self.api_host = api_host
         self.event_chunk_size = event_chunk_size or EVENT_CHUNK_SIZE
+        self.max_payload_size = max_payload_size or DEFAULT_MAX_PAYLOAD_SIZE
+        # Keep the connections to the forwarder alive between flushes
+        self.http_session = requests.Session()
+        # Payloads are sent synchronously, from the flush, without a sender
+        self.payload_sender = payload_sender
 
     def stop(self):
         log.info("Stopping reporter")
@@ -163,13 +600,28 @@ class Reporter(threading.Thread):
         # Persist a start-up message.
         DogstatsdStatus().persist()
 
-        while not self.finished.isSet():  # Use camel case isSet for 2.4 support.
+        if self.payload_sender is not None:
+            self.payload_sender.start()
+
+        # Always flush once more after being stopped, so that nothing is lost
+        finished = False
+        while not finished:
             self.finished.wait(self.interval)
+            finished = self.finished.isSet()  # Use camel case isSet for 2.4 support.
+            if self.worker_pool is not None:
+                self.worker_pool.merge_into(self.metrics_aggregator)
             self.metrics_aggregator.send_packet_count('datadog.dogstatsd.packet.count')
+            if self.payload_sender is not None:
+                self.payload_sender.submit_stats(self.metrics_aggregator)
+            self.metrics_aggregator.send_contexts_dropped('datadog.dogstatsd.contexts_dropped')
             self.flush()
             if self.watchdog:
                 self.watchdog.reset()
 
+        # Stop the sender after the last flush, its payloads are spilled
+        if self.payload_sender is not None:
+            self.payload_sender.stop()
+
         # Clean up the status messages.
         log.debug("Stopped reporter")
         DogstatsdStatus.remove_latest_status()
@@ -224,12 +676,12 @@ class Reporter(threading.Thread):
                 log.exception("Error flushing metrics")
 
     def submit(self, metrics):
-        body, headers = serialize_metrics(metrics, self.hostname)
         params = {}
         if self.api_key:
             params['api_key'] = self.api_key
         url = '%s/api/v1/series?%s' % (self.api_host, urlencode(params))
-        self.submit_http(url, body, headers)
+        for body, headers in serialize_metrics_payloads(metrics, self.hostname, self.max_payload_size):
+            self.submit_http(url, body, headers)
 
     def submit_events(self, events):
         headers = {'Content-Type':'application/json'}
@@ -253,10 +705,15 @@ class Reporter(threading.Thread):
 
     def submit_http(self, url, data, headers):
         headers["DD-Dogstatsd-Version"] = get_version()
+        if self.payload_sender is not None:
+            log.debug("Queuing payload to %s" % url)
+            self.payload_sender.submit(url, data, headers)
+            return
+
         log.debug("Posting payload to %s" % url)
         try:
             start_time = time()
-            r = requests.post(url, data=data, timeout=5, headers=headers)
+            r = self.http_session.post(url, data=data, timeout=5, headers=headers)
             r.raise_for_status()
 
             if r.status_code >= 200 and r.status_code < 205:
@@ -288,12 +745,24 @@ class Server(object):
     A statsd udp server.
     """
 
-    def __init__(self, metrics_aggregator, host, port, forward_to_host=None, forward_to_port=None):
+    def __init__(self, metrics_aggregator, host, port, forward_to_host=None, forward_to_port=None,
+                 so_rcvbuf=None, recv_batch_size=None, reuse_port=False):
         self.host = host
         self.port = int(port)
         self.address = (self.host, self.port)
         self.metrics_aggregator = metrics_aggregator
         self.buffer_size = 1024 * 8
+        self.so_rcvbuf = int(so_rcvbuf) if so_rcvbuf else None
+        self.recv_batch_size = max(1, int(recv_batch_size or DEFAULT_RECV_BATCH_SIZE))
+        self.reuse_port = reuse_port
+        # Pipe to the parent process when running as a `ServerWorker`
+        self.control_conn = None
+
+        # Receive statistics, reset every SERVER_STATS_INTERVAL
+        self.batch_count = 0
+        self.datagram_count = 0
+        self.max_batch_size = 0
+        self.last_kernel_drops = None
 
         self.running = False
 
@@ -312,12 +781,61 @@ class Server(object):
             except Exception:
                 log.exception("Error while setting up connection to external statsd server")
 
+    def _set_receive_buffer(self):
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.so_rcvbuf)
+            # The kernel caps the value (net.core.rmem_max on Linux), report
+            # what we actually got.
+            actual = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            log.info("Socket receive buffer set to %s bytes (requested %s)" % (actual, self.so_rcvbuf))
+        except socket.error:
+            log.exception("Unable to set the socket receive buffer to %s bytes" % self.so_rcvbuf)
+
+    def submit_stats(self):
+        """
+        Submit the receive statistics since the last call to the aggregator:
+        the average and max number of datagrams read per wakeup, and the number
+        of datagrams dropped by the kernel.
+        """
+        aggregator = self.metrics_aggregator
+        if self.batch_count:
+            aggregator.submit_metric('datadog.dogstatsd.packet.batch_size',
+                                     float(self.datagram_count) / self.batch_count, 'g')
+            aggregator.submit_metric('datadog.dogstatsd.packet.batch_size.max',
+                                     self.max_batch_size, 'g')
+
+        kernel_drops = get_udp_socket_drops(self.socket)
+        if kernel_drops is not None:
+            if self.last_kernel_drops is not None:
+                aggregator.submit_metric('datadog.dogstatsd.packet.drops',
+                                         max(0, kernel_drops - self.last_kernel_drops), 'c')
+            self.last_kernel_drops = kernel_drops
+
+        self.batch_count = 0
+        self.datagram_count = 0
+        self.max_batch_size = 0
+
+    def handle_control_message(self):
+        try:
+            message = self.control_conn.recv()
+        except EOFError:
+            log.warning("Lost the connection to the parent process, stopping")
+            self.stop()
+            return
+
+        if message == 'export':
+            self.control_conn.send(self.metrics_aggregator.export_state())
+
     def start(self):
         """ Run the server. """
         # Bind to the UDP socket.
         # IPv4 only
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.setblocking(0)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        if self.so_rcvbuf:
+            self._set_receive_buffer()
         try:
             self.socket.bind(self.address)
         except socket.gaierror:
@@ -330,26 +848,64 @@ class Server(object):
 
         # Inline variables for quick look-up.
         buffer_size = self.buffer_size
+        recv_batch_size = self.recv_batch_size
         aggregator_submit = self.metrics_aggregator.submit_packets
         sock = [self.socket]
+        control_conn = self.control_conn
+        if control_conn is not None:
+            sock.append(control_conn)
         socket_recv = self.socket.recv
+        socket_error = socket.error
+        would_block = (EAGAIN, EWOULDBLOCK)
         select_select = select.select
         select_error = select.error
         timeout = UDP_SOCKET_TIMEOUT
         should_forward = self.should_forward
         forward_udp_sock = self.forward_udp_sock
+        next_stats = time() + SERVER_STATS_INTERVAL
 
         # Run our select loop.
         self.running = True
         while self.running:
             try:
-                ready = select_select(sock, [], [], timeout)
-                if ready[0]:
-                    message = socket_recv(buffer_size)
-                    aggregator_submit(message)
+                ready = select_select(sock, [], [], timeout)[0]
+                if control_conn in ready:
+                    self.handle_control_message()
+                    ready.remove(control_conn)
+                if ready:
+                    # Drain up to recv_batch_size datagrams from the socket
+                    # before going back to select.
+                    messages = [socket_recv(buffer_size)]
+                    while len(messages) < recv_batch_size:
+                        try:
+                            messages.append(socket_recv(buffer_size))
+                        except socket_error, e:
+                            if e.args[0] in would_block:
+                                break
+                            raise
+
+                    batch_size = len(messages)
+                    self.batch_count += 1
+                    self.datagram_count += batch_size
+                    if batch_size > self.max_batch_size:
+                        self.max_batch_size = batch_size
+
+                    try:
+                        aggregator_submit('\n'.join(messages))
+                    except Exception:
+                        log.exception('Error receiving datagram')
 
                     if should_forward:
-                        forward_udp_sock.send(message)
+                        for message in messages:
+                            try:
+                                forward_udp_sock.send(message)
+                            except Exception:
+                                log.exception('Error forwarding datagram')
+
+                now = time()
+                if now >= next_stats:
+                    next_stats = now + SERVER_STATS_INTERVAL
+                    self.submit_stats()
             except select_error, se:
                 # Ignore interrupted system calls from sigterm.
                 errno = se[0]
@@ -364,6 +920,107 @@ class Server(object):
         self.running = False
 
 
+class ServerWorker(multiprocessing.Process):
+    """
+    Runs a `Server` in its own process. Its aggregator only accumulates
+    points, the closed buckets are exported to the parent on request.
+    """
+
+    def __init__(self, server, control_conn):
+        multiprocessing.Process.__init__(self, name='dogstatsd-worker')
+        self.server = server
+        self.server.control_conn = control_conn
+
+    def _handle_sigterm(self, signum, frame):
+        self.server.stop()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        # The parent process handles keyboard interrupts and stops us.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.server.start()
+
+
+class ServerWorkerPool(object):
+    """
+    Runs one `ServerWorker` process per server, all of them bound to the same
+    port with SO_REUSEPORT so that the kernel shards the traffic between them.
+    Has the same start/stop interface as `Server`.
+    """
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.workers = [None] * len(servers)
+        self.running = False
+
+    def _spawn_worker(self, i):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        worker = ServerWorker(self.servers[i], child_conn)
+        worker.daemon = True
+        worker.start()
+        self.workers[i] = (worker, parent_conn)
+
+    def merge_into(self, aggregator):
+        """ Merge the exported state of every worker into `aggregator`. """
+        for i, worker_and_conn in enumerate(list(self.workers)):
+            if worker_and_conn is None:
+                continue
+            worker, conn = worker_and_conn
+            if not worker.is_alive():
+                continue
+            try:
+                conn.send('export')
+                if not conn.poll(WORKER_EXPORT_TIMEOUT):
+                    log.warning("Dogstatsd worker #%s didn't export its metrics within %ss"
+                                % (i, WORKER_EXPORT_TIMEOUT))
+                    continue
+                # Also merge late answers to previous requests
+                while conn.poll():
+                    aggregator.merge_state(conn.recv())
+            except (EOFError, IOError):
+                log.warning("Unable to get the metrics of dogstatsd worker #%s" % i)
+
+    def spawn_workers(self):
+        """
+        Fork the worker processes, if they're not running yet. Call it before
+        starting any thread: a process forked while another thread holds a
+        lock (of the logging module, of a queue) would deadlock on it.
+        """
+        if all(self.workers):
+            return
+        log.info("Starting %s dogstatsd workers" % len(self.servers))
+        for i in xrange(len(self.servers)):
+            self._spawn_worker(i)
+
+    def start(self):
+        self.running = True
+        self.spawn_workers()
+
+        # Dead workers aren't forked again since the reporter threads are
+        # running by now, the kernel sends their share of the traffic to the
+        # sockets of the others. Once they're all dead, fail so that
+        # dogstatsd gets restarted.
+        dead_workers = set()
+        while self.running:
+            for i, (worker, _) in enumerate(self.workers):
+                if i not in dead_workers and not worker.is_alive():
+                    log.error("Dogstatsd worker #%s died (exit code %s)" % (i, worker.exitcode))
+                    dead_workers.add(i)
+            if len(dead_workers) == len(self.workers):
+                self.running = False
+                raise Exception("All the dogstatsd workers died")
+            sleep(1)
+
+        for worker, _ in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker, _ in self.workers:
+            worker.join(UDP_SOCKET_TIMEOUT)
+
+    def stop(self):
+        self.running = False
+
+
 class Dogstatsd(Daemon):
     """ This class is the dogstatsd daemon. """
 
@@ -383,6 +1040,10 @@ class Dogstatsd(Daemon):
         # Handle Keyboard Interrupt
         signal.signal(signal.SIGINT, self._handle_sigterm)
 
+        # Fork the server workers before starting any thread
+        if isinstance(self.server, ServerWorkerPool):
+            self.server.spawn_workers()
+
         # Start the reporting thread before accepting data
         self.reporter.start()
 
@@ -433,6 +1094,14 @@ def init(config_path=None, use_watchdog=False, use_forwarder=False, args=None):
     forward_to_port = c.get('statsd_forward_port')
     event_chunk_size = c.get('event_chunk_size')
     recent_point_threshold = c.get('recent_point_threshold', None)
+    so_rcvbuf = c.get('dogstatsd_so_rcvbuf')
+    recv_batch_size = c.get('dogstatsd_recv_batch_size')
+    max_payload_size = int(c.get('dogstatsd_max_payload_size') or DEFAULT_MAX_PAYLOAD_SIZE)
+    submission_workers = int(c.get('dogstatsd_submission_workers') or 0)
+    workers_count = int(c.get('dogstatsd_workers') or 1)
+    if workers_count > 1 and not Platform.is_linux():
+        log.warning("dogstatsd_workers is only supported on Linux, running a single server")
+        workers_count = 1
 
     target = c['dd_url']
     if use_forwarder:
@@ -444,19 +1113,28 @@ def init(config_path=None, use_watchdog=False, use_forwarder=False, args=None):
     # server and reporting threads.
     assert 0 < interval
 
+    aggregator_kwargs = {
+        'recent_point_threshold': recent_point_threshold,
+        'histogram_aggregates': c.get('histogram_aggregates'),
+        'histogram_percentiles': c.get('histogram_percentiles'),
+        'histogram_sketch_accuracy': c.get('histogram_sketch_accuracy'),
+        'utf8_decoding': c['utf8_decoding'],
+    }
+    if c.get('dogstatsd_context_cache_size') is not None:
+        aggregator_kwargs['context_cache_size'] = int(c['dogstatsd_context_cache_size'])
+    if c.get('dogstatsd_max_contexts') is not None:
+        aggregator_kwargs['max_contexts'] = int(c['dogstatsd_max_contexts'])
+    if c.get('dogstatsd_max_contexts_per_metric') is not None:
+        aggregator_kwargs['max_contexts_per_metric'] = int(c['dogstatsd_max_contexts_per_metric'])
+    if c.get('dogstatsd_context_overflow') is not None:
+        aggregator_kwargs['context_overflow'] = c['dogstatsd_context_overflow']
     aggregator = MetricsBucketAggregator(
         hostname,
         aggregator_interval,
-        recent_point_threshold=recent_point_threshold,
         formatter=get_formatter(c),
-        histogram_aggregates=c.get('histogram_aggregates'),
-        histogram_percentiles=c.get('histogram_percentiles'),
-        utf8_decoding=c['utf8_decoding']
+        **aggregator_kwargs
     )
 
-    # Start the reporting thread.
-    reporter = Reporter(interval, aggregator, target, api_key, use_watchdog, event_chunk_size)
-
     # Start the server on an IPv4 stack
     # Default to loopback
     server_host = c['bind_host']
@@ -464,7 +1142,34 @@ def init(config_path=None, use_watchdog=False, use_forwarder=False, args=None):
     if non_local_traffic:
         server_host = ''
 
-    server = Server(aggregator, server_host, port, forward_to_host=forward_to_host, forward_to_port=forward_to_port)
+    worker_pool = None
+    if workers_count > 1:
+        # Each worker aggregates what it receives in its own aggregator, the
+        # reporter merges them into `aggregator` which formats and flushes.
+        servers = [
+            Server(MetricsBucketAggregator(hostname, aggregator_interval, **aggregator_kwargs),
+                   server_host, port, forward_to_host=forward_to_host, forward_to_port=forward_to_port,
+                   so_rcvbuf=so_rcvbuf, recv_batch_size=recv_batch_size, reuse_port=True)
+            for _ in xrange(workers_count)
+        ]
+        server = worker_pool = ServerWorkerPool(servers)
+    else:
+        server = Server(aggregator, server_host, port, forward_to_host=forward_to_host, forward_to_port=forward_to_port,
+                        so_rcvbuf=so_rcvbuf, recv_batch_size=recv_batch_size)
+
+    payload_sender = None
+    if submission_workers > 0:
+        payload_sender = PayloadSender(
+            submission_workers,
+            max_queue_size=int(c.get('dogstatsd_submission_queue_size') or DEFAULT_SUBMISSION_QUEUE_SIZE),
+            spill_dir=c.get('dogstatsd_spill_dir'),
+            max_spill_size=int(c.get('dogstatsd_max_spill_size') or DEFAULT_MAX_SPILL_SIZE),
+        )
+
+    # Start the reporting thread.
+    reporter = Reporter(interval, aggregator, target, api_key, use_watchdog, event_chunk_size,
+                        worker_pool=worker_pool, max_payload_size=max_payload_size,
+                        payload_sender=payload_sender)
 
     return reporter, server, c
 
@@ -4,7 +4,7 @@ import time
 import unittest
 
 # 3p
-from mock import Mock
+from mock import MagicMock, Mock, patch
 from nose.plugins.attrib import attr
 
 # project
@@ -121,6 +121,44 @@ class TestMongoUnit(AgentCheckTest):
         self.assertEquals((GAUGE, 'mongodb.foobar.exclusive'), resolve_metric('foobar.W', metrics_to_collect))  # noqa
 
 
+    def test_client_reuse(self):
+        """
+        Reuse the client and the list of databases across runs, fetch the
+        stats of every database.
+        """
+        import pymongo
+
+        def command(name, *args, **kwargs):
+            if name == 'serverStatus':
+                return {'ok': 1, 'uptime': 10, 'connections': {'current': 1, 'available': 2}}
+            if name == 'replSetGetStatus':
+                raise pymongo.errors.OperationFailure("not running with --replSet: replSetGetStatus")
+            if name == 'dbstats':
+                return {'objects': 3}
+            return {'ok': 1}
+
+        client = MagicMock()
+        client.__getitem__.return_value.command.side_effect = command
+        client.database_names.return_value = ['test', 'foo', 'bar']
+
+        config = {
+            'instances': [self.MONGODB_CONFIG]
+        }
+        with patch('pymongo.mongo_client.MongoClient', return_value=client) as mongo_client:
+            self.run_check(config)
+            self.run_check(config)
+
+            self.assertEquals(mongo_client.call_count, 1)
+            self.assertEquals(client.database_names.call_count, 1)
+
+        for db_name in ['test', 'foo', 'bar']:
+            self.assertMetric('mongodb.stats.objects', value=3, count=1,
+                              tags=['server:%s' % self.MONGODB_CONFIG['server'],
+                                    'cluster:db:%s' % db_name])
+        self.assertMetric('mongodb.uptime', value=10, count=1)
+        self.assertEquals(self.warnings, [])
+
+
 @attr(requires='mongo')
 class TestMongo(unittest.TestCase):
     def testMongoCheck(self):
@@ -208,6 +208,68 @@ class ProcessCheckTest(AgentCheckTest):
         # Shouldn't throw an exception
         self.run_check(config)
 
+    def test_ad_cache_per_field(self):
+        config = {
+            'instances': [
+                {'name': 'web', 'search_string': ['nginx'], 'ignore_denied_access': 'false'},
+                {'name': 'workers', 'search_string': ['celery worker'], 'exact_match': False},
+            ]
+        }
+        proc = MagicMock(pid=1)
+        proc.name.return_value = 'nginx'
+        proc.cmdline.side_effect = psutil.AccessDenied()
+
+        self.load_check(config)
+        with patch('psutil.process_iter', return_value=[proc]):
+            # Only the instances searching the cmdlines are denied access
+            self.assertEquals(self.check.find_pids('web', ['nginx'], True, ignore_ad=False), set([1]))
+            self.assertEquals(self.check.ad_cache, {1: set(['cmdline'])})
+
+            # The name of the process is still read while the ad cache is valid
+            self.check.last_pid_cache_ts = {}
+            self.assertEquals(self.check.find_pids('web', ['nginx'], True, ignore_ad=False), set([1]))
+            self.assertEquals(proc.name.call_count, 2)
+            self.assertEquals(proc.cmdline.call_count, 1)
+
+    def test_find_pids_single_pass(self):
+        config = {
+            'instances': [
+                {'name': 'web', 'search_string': ['nginx', 'gunicorn']},
+                {'name': 'workers', 'search_string': ['celery worker'], 'exact_match': False},
+                {'name': 'python', 'search_string': ['bin/python'], 'exact_match': False},
+                {'name': 'none', 'search_string': ['postgres']},
+            ]
+        }
+        processes = []
+        for pid, name, cmdline in [(1, 'nginx', ['nginx: master']),
+                                   (2, 'gunicorn', ['/usr/bin/python', '/usr/bin/gunicorn']),
+                                   (3, 'python', ['/usr/bin/python', '/usr/bin/celery worker']),
+                                   (4, 'bash', ['bash'])]:
+            proc = MagicMock(pid=pid)
+            proc.name.return_value = name
+            proc.cmdline.return_value = cmdline
+            processes.append(proc)
+
+        self.load_check(config)
+        with patch('psutil.process_iter', return_value=processes) as process_iter:
+            pids = dict(
+                (instance['name'], self.check.find_pids(instance['name'], instance['search_string'],
+                                                        instance.get('exact_match', True)))
+                for instance in config['instances']
+            )
+
+        # All the instances are searched for in a single pass
+        self.assertEquals(process_iter.call_count, 1)
+        self.assertEquals(pids, {
+            'web': set([1, 2]),
+            'workers': set([3]),
+            'python': set([2, 3]),
+            'none': set(),
+        })
+        for proc in processes:
+            self.assertEquals(proc.name.call_count, 1)
+            self.assertEquals(proc.cmdline.call_count, 1)
+
     def mock_find_pids(self, name, search_string, exact_match=True, ignore_ad=True,
                        refresh_ad_cache=True):
         idx = search_string[0].split('_')[1]
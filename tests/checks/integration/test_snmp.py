@@ -284,6 +284,38 @@ class SNMPTestCase(AgentCheckTest):
 
         self.coverage_report()
 
+    def test_table_v1(self):
+        """
+        Walk SNMP tabular objects with getnext requests, SNMP v1 doesn't
+        support getbulk ones
+        """
+        instance = self.generate_instance_config(self.TABULAR_OBJECTS)
+        instance['snmp_version'] = 1
+        config = {
+            'init_config': {
+                'max_repetitions': 2
+            },
+            'instances': [instance]
+        }
+        self.run_check_n(config, repeat=3)
+        self.service_checks = self.wait_for_async('get_service_checks', 'service_checks', 1)
+
+        # Test metrics
+        for symbol in self.TABULAR_OBJECTS[0]['symbols']:
+            metric_name = "snmp." + symbol
+            self.assertMetric(metric_name, at_least=1)
+            self.assertMetricTag(metric_name, self.CHECK_TAGS[0], at_least=1)
+
+            for mtag in self.TABULAR_OBJECTS[0]['metric_tags']:
+                tag = mtag['tag']
+                self.assertMetricTagPrefix(metric_name, tag, at_least=1)
+
+        # Test service check
+        self.assertServiceCheck("snmp.can_check", status=AgentCheck.OK,
+                                tags=self.CHECK_TAGS, count=1)
+
+        self.coverage_report()
+
     def test_invalid_metric(self):
         """
         Invalid metrics raise a Warning and a critical service check
@@ -123,3 +123,26 @@ class AgentMetricsTestCase(AgentCheckTest):
         }
 
         self.run_check(MOCK_CONFIG, mocks=mocks)
+
+    def test_http_stats(self):
+        ''' Test the reporting of the requests sent through the shared HTTP sessions '''
+        self.load_check(MOCK_CONFIG, AGENT_CONFIG_DEFAULT_MODE)
+        stats = [
+            {'requests': 0, 'connections': 0, 'request_time': 0.0},
+            {'requests': 10, 'connections': 2, 'request_time': 1.0},
+            {'requests': 30, 'connections': 3, 'request_time': 2.0},
+        ]
+        with mock.patch('agent_metrics.session_pool.stats', side_effect=stats):
+            # No request sent yet
+            self.check._submit_http_stats()
+            self.assertEqual(self.check.get_metrics(), [])
+
+            self.check._submit_http_stats()
+            self.check.get_metrics()
+
+            self.check._submit_http_stats()
+            self.metrics = self.check.get_metrics()
+
+        self.assertMetric('datadog.agent.http.requests', value=20)
+        self.assertMetric('datadog.agent.http.connections', value=1)
+        self.assertMetric('datadog.agent.http.latency', value=0.05)
@@ -1,4 +1,5 @@
 # 3p
+import mock
 import simplejson as json
 
 # project
@@ -33,8 +34,8 @@ class TestKubernetes(AgentCheckTest):
     def test_fail(self):
         # To avoid the disparition of some gauges during the second check
         mocks = {
-            '_retrieve_metrics': lambda x: json.loads(Fixtures.read_file("metrics.json")),
-            '_retrieve_kube_labels': lambda: json.loads(Fixtures.read_file("kube_labels.json")),
+            '_retrieve_metrics': lambda x, timeout=None: json.loads(Fixtures.read_file("metrics.json")),
+            '_retrieve_kube_labels': lambda timeout=None: json.loads(Fixtures.read_file("kube_labels.json")),
         }
         config = {
             "instances": [{"host": "foo"}]
@@ -44,11 +45,24 @@ class TestKubernetes(AgentCheckTest):
         self.run_check(config, mocks=mocks, force_reload=True)
         self.assertServiceCheck("kubernetes.kubelet.check", status=AgentCheck.CRITICAL)
 
+    def test_request_timeouts(self):
+        config = {
+            "instances": [{"host": "foo", "enable_master_checks": True, "timeout": 3}]
+        }
+
+        with mock.patch('utils.http.session_pool.get', side_effect=Exception("unreachable")) as get:
+            self.assertRaises(Exception, self.run_check, config, force_reload=True)
+
+        # None of the requests can hang a fetch thread
+        self.assertEquals(get.call_count, 4)
+        for _, kwargs in get.call_args_list:
+            self.assertEquals(kwargs['timeout'], 3.0)
+
     def test_metrics(self):
         # To avoid the disparition of some gauges during the second check
         mocks = {
-            '_retrieve_metrics': lambda x: json.loads(Fixtures.read_file("metrics.json")),
-            '_retrieve_kube_labels': lambda: json.loads(Fixtures.read_file("kube_labels.json")),
+            '_retrieve_metrics': lambda x, timeout=None: json.loads(Fixtures.read_file("metrics.json")),
+            '_retrieve_kube_labels': lambda timeout=None: json.loads(Fixtures.read_file("kube_labels.json")),
         }
         config = {
             "instances": [
@@ -98,8 +112,8 @@ class TestKubernetes(AgentCheckTest):
     def test_historate(self):
         # To avoid the disparition of some gauges during the second check
         mocks = {
-            '_retrieve_metrics': lambda x: json.loads(Fixtures.read_file("metrics.json")),
-            '_retrieve_kube_labels': lambda: json.loads(Fixtures.read_file("kube_labels.json")),
+            '_retrieve_metrics': lambda x, timeout=None: json.loads(Fixtures.read_file("metrics.json")),
+            '_retrieve_kube_labels': lambda timeout=None: json.loads(Fixtures.read_file("kube_labels.json")),
         }
         config = {
             "instances": [
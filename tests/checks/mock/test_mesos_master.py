@@ -1,11 +1,14 @@
 # stdlib
 import json
+import time
 
 # 3p
-from mock import patch
+from mock import Mock, patch
 from nose.plugins.attrib import attr
+import requests
 
 # project
+from checks import AgentCheck, CheckException
 from tests.checks.common import AgentCheckTest, Fixtures, get_check_class
 
 
@@ -56,3 +59,74 @@ class TestMesosMaster(AgentCheckTest):
                     self.assertMetric('mesos.framework.total_tasks')
                     self.assertMetric('mesos.role.frameworks.count')
                     self.assertMetric('mesos.role.weight')
+
+    def _mocked_get(self, slow_url=None, failed_url=None):
+        """
+        Mock of `session_pool.get` for a leading master, failing `failed_url`
+        and answering `slow_url` after the timeout
+        """
+        klass = get_check_class('mesos_master')
+        state = {'version': '0.22.0', 'leader': 'master@1', 'pid': 'master@1', 'frameworks': []}
+        stats = {}
+        for metrics in (klass.CLUSTER_TASKS_METRICS, klass.CLUSTER_SLAVES_METRICS,
+                        klass.CLUSTER_RESOURCES_METRICS, klass.CLUSTER_REGISTRAR_METRICS,
+                        klass.CLUSTER_FRAMEWORK_METRICS, klass.SYSTEM_METRICS, klass.STATS_METRICS):
+            stats.update((key, 1) for key in metrics)
+
+        def get(url, timeout):
+            if url == failed_url:
+                raise requests.exceptions.Timeout()
+            if url == slow_url:
+                time.sleep(timeout * 2)
+            if url.endswith('/state.json'):
+                data = state
+            elif url.endswith('/roles.json'):
+                data = {'roles': []}
+            else:
+                data = stats
+            return Mock(status_code=200, json=lambda: data)
+
+        return get
+
+    def test_concurrent_request_error(self):
+        config = {
+            'init_config': {},
+            'instances': [
+                {
+                    'url': 'http://localhost:5050'
+                }
+            ]
+        }
+        get = self._mocked_get(failed_url='http://localhost:5050/roles.json')
+
+        with patch('utils.http.session_pool.get', side_effect=get):
+            self.assertRaises(CheckException, self.run_check, config)
+
+        # The service checks of the concurrent requests are submitted by the check
+        self.assertServiceCheck('mesos_master.can_connect', status=AgentCheck.OK,
+                                tags=['url:http://localhost:5050/state.json'], count=1)
+        self.assertServiceCheck('mesos_master.can_connect', status=AgentCheck.CRITICAL,
+                                tags=['url:http://localhost:5050/roles.json'], count=1)
+        self.assertMetric('mesos.cluster.tasks_running')
+
+    def test_fetch_timeout(self):
+        config = {
+            'init_config': {},
+            'instances': [
+                {
+                    'url': 'http://localhost:5050',
+                    'timeout': 0.1
+                }
+            ]
+        }
+        get = self._mocked_get(slow_url='http://localhost:5050/metrics/snapshot')
+
+        with patch('utils.http.session_pool.get', side_effect=get):
+            self.assertRaises(CheckException, self.run_check, config)
+
+        # A request still running at the deadline is reported as timed out
+        self.assertServiceCheck('mesos_master.can_connect', status=AgentCheck.CRITICAL,
+                                tags=['url:http://localhost:5050/metrics/snapshot'], count=1)
+        critical = [sc for sc in self.service_checks if sc['status'] == AgentCheck.CRITICAL][0]
+        self.assertEquals(critical['message'],
+                          '0.1 seconds timeout when hitting http://localhost:5050/metrics/snapshot')
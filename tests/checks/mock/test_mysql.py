@@ -0,0 +1,90 @@
+# stdlib
+import time
+
+# 3p
+from mock import MagicMock, patch
+
+# project
+from checks import AgentCheck
+from tests.checks.common import AgentCheckTest, load_check
+
+
+class MySqlConnectionTest(AgentCheckTest):
+
+    CHECK_NAME = 'mysql'
+
+    CONNECT_ARGS = ('localhost', 3306, '', 'dog', 'dog', '', {})
+
+    def setUp(self):
+        self.check = load_check(self.CHECK_NAME, {'instances': [{'server': 'localhost'}]}, {})
+
+    def connect(self, max_age=600):
+        with self.check._connect(*self.CONNECT_ARGS, max_age=max_age) as db:
+            return db
+
+    @patch('pymysql.connect', side_effect=lambda **kwargs: MagicMock())
+    def test_connection_reused(self, connect):
+        db = self.connect()
+        self.assertEquals(self.connect(), db)
+        self.assertEquals(connect.call_count, 1)
+        db.ping.assert_called_once_with(False)
+        self.assertFalse(db.close.called)
+
+        self.check.stop()
+        db.close.assert_called_once_with()
+        self.assertEquals(self.check.connections, {})
+
+    @patch('pymysql.connect', side_effect=lambda **kwargs: MagicMock())
+    def test_reconnect(self, connect):
+        # Dead connection
+        db = self.connect()
+        db.ping.side_effect = Exception("MySQL server has gone away")
+        new_db = self.connect()
+        self.assertNotEquals(new_db, db)
+        db.close.assert_called_once_with()
+
+        # Too old connection
+        key = self.check.connections.keys()[0]
+        self.check.connections[key] = (new_db, time.time() - 601)
+        self.assertNotEquals(self.connect(), new_db)
+        new_db.close.assert_called_once_with()
+
+        # Not cached
+        db = self.connect(max_age=0)
+        db.close.assert_called_once_with()
+        self.assertEquals(self.check.connections, {})
+        self.assertEquals(connect.call_count, 4)
+
+    @patch('pymysql.connect', side_effect=lambda **kwargs: MagicMock())
+    def test_error_closes_connection(self, connect):
+        def failing_run():
+            with self.check._connect(*self.CONNECT_ARGS):
+                raise Exception("Lost connection to MySQL server during query")
+
+        self.assertRaises(Exception, failing_run)
+        self.assertEquals(self.check.connections, {})
+        self.assertEquals(len(self.check.get_service_checks()), 2)
+
+        self.connect()
+        self.assertEquals(connect.call_count, 2)
+        service_checks = self.check.get_service_checks()
+        self.assertEquals(service_checks[-1]['status'], AgentCheck.OK)
+
+    @patch('pymysql.connect', side_effect=lambda **kwargs: MagicMock())
+    def test_probes_memoized(self, connect):
+        db = self.connect()
+        cursor = db.cursor.return_value
+        cursor.fetchone.return_value = ('5.6.27-log',)
+        cursor.rowcount = 1
+
+        for _ in xrange(2):
+            self.assertEquals(self.check._get_version(db, 'localhost'), ['5', '6', '27'])
+            self.assertTrue(self.check._version_compatible(db, 'localhost', (5, 6, 6)))
+            self.assertTrue(self.check._is_innodb_engine_enabled(db))
+        self.assertEquals(cursor.execute.call_count, 2)
+
+        # Probed again on a new connection
+        self.check.stop()
+        db = self.connect()
+        db.cursor.return_value.fetchone.return_value = ('5.7.10',)
+        self.assertEquals(self.check._get_version(db, 'localhost'), ['5', '7', '10'])
@@ -1,9 +1,15 @@
 # stdlib
+import os
+import shutil
 import tempfile
 import time
 
+# 3p
+from mock import patch
+
 # project
 from tests.checks.common import AgentCheckTest, Fixtures
+from utils.tailfile import OffsetRegistry
 
 
 class NagiosTestCase(AgentCheckTest):
@@ -14,6 +20,17 @@ class NagiosTestCase(AgentCheckTest):
     NAGIOS_TEST_HOST_TEMPLATE = "[HOSTPERFDATA]\t$TIMET$\t$HOSTNAME$\t$HOSTEXECUTIONTIME$\t$HOSTOUTPUT$\t$HOSTPERFDATA$"
     NAGIOS_TEST_SVC_TEMPLATE = "[SERVICEPERFDATA]\t$TIMET$\t$HOSTNAME$\t$SERVICEDESC$\t$SERVICEEXECUTIONTIME$\t$SERVICELATENCY$\t$SERVICEOUTPUT$\t$SERVICEPERFDATA$"
 
+    def setUp(self):
+        # Keep the offsets of the tailed files away from the other tests and the agent
+        self.offsets_dir = tempfile.mkdtemp()
+        offsets = OffsetRegistry(os.path.join(self.offsets_dir, 'tailfile_offsets.json'))
+        self.offsets_patcher = patch('utils.tailfile._offset_registry', offsets)
+        self.offsets_patcher.start()
+
+    def tearDown(self):
+        self.offsets_patcher.stop()
+        shutil.rmtree(self.offsets_dir)
+
     def get_config(self, nagios_conf, events=False, service_perf=False, host_perf=False):
         """
         Helper to generate a valid Nagios configuration
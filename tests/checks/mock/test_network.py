@@ -30,7 +30,8 @@ class TestCheckNetwork(AgentCheckTest):
                 }
             ]
         }
-        self.load_check(self.config)
+        # Without socket tables in procfs, `ss` and `netstat` are used
+        self.load_check(self.config, dict(self.DEFAULT_AGENT_CONFIG, procfs_path='/nonexistent/proc'))
 
     CX_STATE_GAUGES_VALUES = {
         'system.net.udp4.connections': 2,
@@ -64,3 +65,29 @@ class TestCheckNetwork(AgentCheckTest):
         # Assert metrics
         for metric, value in self.CX_STATE_GAUGES_VALUES.iteritems():
             self.assertMetric(metric, value=value)
+
+    @mock.patch('network.get_subprocess_output')
+    @mock.patch('network.Platform.is_linux', return_value=True)
+    def test_cx_state_linux_proc(self, mock_platform, mock_subprocess):
+        self.load_check(self.config, dict(self.DEFAULT_AGENT_CONFIG, procfs_path=Fixtures.file('proc')))
+        self.run_check({})
+
+        # Assert metrics
+        for metric, value in self.CX_STATE_GAUGES_VALUES.iteritems():
+            self.assertMetric(metric, value=value)
+        self.assertFalse(mock_subprocess.called)
+
+    def test_cx_state_linux_proc_without_ipv6(self):
+        check = self.check
+        real_count = check._count_proc_net_states
+
+        def count_without_ipv6(path):
+            if path.endswith('6'):
+                raise IOError(2, 'No such file or directory', path)
+            return real_count(path)
+
+        with mock.patch.object(check, '_count_proc_net_states', side_effect=count_without_ipv6):
+            metrics = check._parse_proc_net_cx_state(Fixtures.file('proc'))
+
+        for metric, value in self.CX_STATE_GAUGES_VALUES.iteritems():
+            self.assertEquals(metrics[metric], 0 if '6.' in metric else value, metric)
@@ -3,15 +3,19 @@ import logging
 import sys
 import unittest
 
+# 3p
+from nose.plugins.skip import SkipTest
+
 # project
 from checks.system.unix import (
+    Cpu,
     IO,
     Load,
     Memory,
 )
 from checks.system.common import System
 from config import get_system_stats
-from tests.checks.common import get_check
+from tests.checks.common import Fixtures, get_check
 from utils.platform import Platform
 
 logging.basicConfig(level=logging.DEBUG)
@@ -125,6 +129,58 @@ sda               0.00     0.00  0.00  0.00     0.00     0.00     0.00     0.00
             {'system.io.bytes_per_s': float(0),}
         )
 
+    def testLinuxIOFromProc(self):
+        checker = IO(logger)
+
+        # The first run has nothing to compare the counters to
+        self.assertEquals(checker._check_linux(Fixtures.file('proc_1')), {})
+
+        results = checker._check_linux(Fixtures.file('proc_2'))
+        # Devices without I/O, new ones and old kernel partitions are skipped
+        self.assertEquals(sorted(results), ['hda', 'sda', 'sdb'])
+        self.assertEquals(results['sda'], {
+            'rrqm/s': '1.00', 'wrqm/s': '2.00', 'r/s': '5.00', 'w/s': '15.00',
+            'rkB/s': '40.00', 'wkB/s': '120.00', 'avgrq-sz': '16.00', 'avgqu-sz': '0.10',
+            'await': '2.00', 'r_await': '2.00', 'w_await': '2.00', 'svctm': '2.50',
+            '%util': '5.00',
+        })
+        self.assertEquals(set(results['hda'].values()), set(['0.00']))
+
+        # Counters which went backwards are ignored
+        previous = {'sda': [10] * 11, 'sdb': [10] * 11}
+        current = {'sda': [20] * 11, 'sdb': [20] * 10 + [5]}
+        self.assertEquals(sorted(IO._compute_linux_io_stats(previous, current, 10)), ['sda'])
+
+    def testLinuxCpuFromProc(self):
+        checker = Cpu(logger)
+        proc_1 = Fixtures.file('proc_1')
+        proc_2 = Fixtures.file('proc_2')
+
+        self.assertEquals(checker._check_linux(proc_1), None)
+        results = checker._check_linux(proc_2)
+        expected = {
+            '%usr': 20, '%nice': 0, '%sys': 10, '%iowait': 5, '%irq': 1,
+            '%soft': 2, '%steal': 2, '%guest': 10, '%idle': 50,
+        }
+        self.assertEquals(sorted(results), sorted(expected))
+        for name, value in expected.iteritems():
+            self.assertAlmostEqual(results[name], value)
+
+        # Counters which went backwards are ignored
+        self.assertEquals(checker._check_linux(proc_1), None)
+
+    def testCpu(self):
+        if not Platform.is_linux():
+            raise SkipTest()
+        checker = Cpu(logger)
+        agentConfig = {'procfs_path': Fixtures.file('proc_1')}
+        self.assertEquals(checker.check(agentConfig), False)
+        agentConfig['procfs_path'] = Fixtures.file('proc_2')
+        results = checker.check(agentConfig)
+        for name, value in (('cpuUser', 20), ('cpuSystem', 13), ('cpuWait', 5),
+                            ('cpuIdle', 50), ('cpuStolen', 2), ('cpuGuest', 10)):
+            self.assertAlmostEqual(results[name], value)
+
     def testNetwork(self):
         # FIXME: cx_state to true, but needs sysstat installed
         config = """
@@ -118,7 +118,7 @@ class YARNCheck(AgentCheckTest):
 
     YARN_NODE_METRICS_TAGS = ['cluster_id:1324053971963', 'node_id:h2:1235']
 
-    @mock.patch('requests.get', side_effect=requests_get_mock)
+    @mock.patch('utils.http.session_pool.get', side_effect=requests_get_mock)
     def test_check(self, mock_requests):
         config = {
             'instances': [self.YARN_CONFIG]
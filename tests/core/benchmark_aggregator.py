@@ -2,9 +2,43 @@
 """
 Performance tests for the agent/dogstatsd metrics aggregator.
 """
+# stdlib
+import sys
+from time import time
+
+# project
 from aggregator import MetricsAggregator, MetricsBucketAggregator
 
 
+def deep_getsizeof(obj, seen):
+    """ Size of `obj` and of everything it references, counted once """
+    size = 0
+    # Iterative, the links of the LRU caches nest deeper than the recursion
+    # limit
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or callable(obj):
+            continue
+        seen.add(id(obj))
+
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            for key, value in obj.iteritems():
+                stack.append(key)
+                stack.append(value)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+    return size
+
+
 class TestAggregatorPerf(object):
 
     FLUSH_COUNT = 10
@@ -38,6 +72,84 @@ class TestAggregatorPerf(object):
 
             ma.flush()
 
+    def _submit_repeated_series(self, ma):
+        """ Submit the same few series over and over, return the packets/s """
+        packets = []
+        for j in xrange(self.METRIC_COUNT):
+            packets.extend([
+                'counter.%s:1|c|#env:prod,role:front,service:web,version:1.2.3' % j,
+                'gauge.%s:%s|g|#env:prod,role:front,host:some.other.host' % (j, 1.5 * j),
+                'histogram.%s:%s|h|@0.5|#env:prod,role:front,service:web' % (j, j),
+                'timer.%s:%s|ms|#env:prod,role:front,device:sda1' % (j, 3.14),
+            ])
+
+        start = time()
+        for _ in xrange(self.FLUSH_COUNT):
+            for i in xrange(self.LOOPS_PER_FLUSH):
+                for packet in packets:
+                    ma.submit_packets(packet)
+            ma.flush()
+        duration = time() - start
+
+        return self.FLUSH_COUNT * self.LOOPS_PER_FLUSH * len(packets) / duration
+
+    def test_dogstatsd_context_cache_perf(self):
+        uncached = self._submit_repeated_series(MetricsBucketAggregator('my.host', context_cache_size=0))
+        cached = self._submit_repeated_series(MetricsBucketAggregator('my.host'))
+        print "Repeated series without context cache: %d packets/s" % uncached
+        print "Repeated series with context cache: %d packets/s (x%.2f)" % (cached, cached / uncached)
+
+    def test_dogstatsd_memory_per_context(self):
+        context_count = 50000
+        ma = MetricsBucketAggregator('my.host', interval=10,
+                                     max_contexts=10 * context_count,
+                                     max_contexts_per_metric=10 * context_count)
+        for i in xrange(context_count):
+            # High cardinality tag, shared by a few metric names
+            ma.submit_packets('app.requests.%s:1|c|#env:prod,service:web,endpoint:/api/v%s'
+                              % (i % 50, i / 50))
+            ma.submit_packets('app.latency.%s:%s|h|#env:prod,service:web,endpoint:/api/v%s'
+                              % (i % 50, i, i / 50))
+
+        # The whole aggregator: the metrics, and the interned contexts, the
+        # context cache and the context limiter state kept for them
+        seen = set()
+        sizes = [
+            ('metrics', deep_getsizeof(ma.metric_by_bucket, seen)),
+            ('interned contexts', deep_getsizeof(ma._interned, seen)),
+            ('context cache', deep_getsizeof(ma.context_cache, seen)),
+            ('context limiter', deep_getsizeof(ma.context_limiter, seen)),
+        ]
+        total = sum(size for _, size in sizes) + deep_getsizeof(ma, seen)
+        print "Memory used by the dogstatsd aggregator: %d bytes per context (%s)" % (
+            total / (2 * context_count),
+            ", ".join("%s: %d" % (name, size / (2 * context_count)) for name, size in sizes))
+
+    def test_dogstatsd_flush_idle_counters_perf(self):
+        """ Flush when few counters out of many change between flushes """
+        idle_count = 100000
+        changed_count = 1000
+        interval = 10
+        ma = MetricsBucketAggregator('my.host', interval=interval, expiry_seconds=3600)
+
+        # Submit points in past buckets, so that each flush closes one
+        first_bucket = time() - self.FLUSH_COUNT * interval
+        for i in xrange(idle_count):
+            ma.submit_metric('idle.counter', 1, 'c', tags=['id:%s' % i], timestamp=first_bucket)
+        ma.flush()
+
+        duration = 0
+        for flush in xrange(1, self.FLUSH_COUNT):
+            for i in xrange(changed_count):
+                ma.submit_metric('changed.counter', 1, 'c', tags=['id:%s' % i],
+                                 timestamp=first_bucket + flush * interval)
+            start = time()
+            ma.flush()
+            duration += time() - start
+
+        print "Flush of %d counters, %d changed: %.1fms" % (
+            idle_count + changed_count, changed_count, 1000 * duration / (self.FLUSH_COUNT - 1))
+
     def test_checksd_aggregation_perf(self):
         ma = MetricsAggregator('my.host')
 
@@ -110,4 +222,7 @@ if __name__ == '__main__':
     t = TestAggregatorPerf()
     #t.test_dogstatsd_aggregation_perf()
     #t.test_checksd_aggregation_perf()
+    #t.test_dogstatsd_context_cache_perf()
+    #t.test_dogstatsd_memory_per_context()
+    #t.test_dogstatsd_flush_idle_counters_perf()
     t.test_dogstatsd_utf8_events()
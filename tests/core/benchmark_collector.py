@@ -0,0 +1,55 @@
+"""
+Performance tests for the collector checks.d runs.
+"""
+# stdlib
+from time import sleep, time
+
+# project
+from checks import AgentCheck
+from checks.collector import Collector
+
+
+class SleepCheck(AgentCheck):
+    """ A check waiting on I/O, like one querying a slow HTTP endpoint """
+    def check(self, instance):
+        sleep(instance['sleep'])
+        self.gauge('test.slept', instance['sleep'])
+
+
+class TestCollectorPerf(object):
+
+    CHECK_COUNT = 20
+    CHECK_SLEEP = 0.1
+    CHECK_RUNNERS = 4
+    RUN_COUNT = 3
+
+    def run_checks(self, collector, checks):
+        if collector.check_runners > 1:
+            check_runs = collector._run_checks_concurrently(checks)
+        else:
+            check_runs = collector._run_checks_sequentially(checks)
+        return list(check_runs)
+
+    def test_checks_d_cycle_perf(self):
+        """ Collection runs of checks mostly sleeping, sequential vs concurrent """
+        checks = [SleepCheck('sleep%s' % i, {}, {}, [{'sleep': self.CHECK_SLEEP}])
+                  for i in xrange(self.CHECK_COUNT)]
+
+        for check_runners in (1, self.CHECK_RUNNERS):
+            collector = Collector({'check_runners': str(check_runners)}, [], {}, 'foo')
+            try:
+                start = time()
+                for _ in xrange(self.RUN_COUNT):
+                    check_runs = self.run_checks(collector, checks)
+                    assert len(check_runs) == self.CHECK_COUNT
+                duration = time() - start
+            finally:
+                collector.stop()
+
+            print "%s checks sleeping %ss, %s check runner(s): %.3fs per collection run" % (
+                self.CHECK_COUNT, self.CHECK_SLEEP, check_runners, duration / self.RUN_COUNT)
+
+
+if __name__ == '__main__':
+    t = TestCollectorPerf()
+    t.test_checks_d_cycle_perf()
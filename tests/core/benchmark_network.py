@@ -0,0 +1,76 @@
+"""
+Performance tests for the connection state collection of the network check.
+"""
+# stdlib
+import os
+import random
+import shutil
+import tempfile
+from time import time
+
+# project
+from tests.checks.common import load_check
+
+TCP_STATES = ['01', '01', '01', '06', '06', '0A', '08', '02']
+
+
+def write_tcp_table(path, line_count, ipv6=False):
+    address_width = 32 if ipv6 else 8
+    with open(path, 'w') as f:
+        f.write('  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt'
+                '   uid  timeout inode\n')
+        for i in xrange(line_count):
+            f.write('%4d: %0*X:%04X %0*X:%04X %s 00000000:00000000 02:000A8C1A 00000000  1000'
+                    '        0 %d 2 0000000000000000 20 4 30 10 -1\n' % (
+                        i, address_width, i, i % 65536, address_width, 2 * i, 443,
+                        random.choice(TCP_STATES), i))
+
+
+def write_ss_output(path, line_count):
+    ss_states = ['ESTAB', 'ESTAB', 'ESTAB', 'TIME-WAIT', 'TIME-WAIT', 'LISTEN', 'CLOSE-WAIT', 'SYN-SENT']
+    with open(path, 'w') as f:
+        f.write('Netid  State      Recv-Q Send-Q     Local Address:Port       Peer Address:Port\n')
+        for i in xrange(line_count):
+            f.write('tcp    %-10s 0      0          10.0.%d.%d:%d        46.105.75.4:443\n' % (
+                random.choice(ss_states), i / 256 % 256, i % 256, i % 65536))
+
+
+class TestNetworkCxStatePerf(object):
+
+    LINE_COUNT = 100000
+    RUNS = 5
+
+    def setUp(self):
+        self.procfs_path = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.procfs_path, 'net'))
+        write_tcp_table(os.path.join(self.procfs_path, 'net', 'tcp'), self.LINE_COUNT)
+        write_tcp_table(os.path.join(self.procfs_path, 'net', 'tcp6'), self.LINE_COUNT, ipv6=True)
+        for table in ('udp', 'udp6'):
+            write_tcp_table(os.path.join(self.procfs_path, 'net', table), self.LINE_COUNT / 10)
+        self.ss_output = os.path.join(self.procfs_path, 'ss')
+        write_ss_output(self.ss_output, self.LINE_COUNT)
+
+        self.check = load_check('network', {'init_config': {}, 'instances': [{}]},
+                                {'checksd_hostname': 'foo', 'procfs_path': self.procfs_path})
+
+    def tearDown(self):
+        shutil.rmtree(self.procfs_path)
+
+    def test_proc_net_cx_state_perf(self):
+        start = time()
+        for _ in xrange(self.RUNS):
+            metrics = self.check._parse_proc_net_cx_state(self.procfs_path)
+        proc_duration = (time() - start) / self.RUNS
+        assert metrics['system.net.tcp4.established'] + metrics['system.net.tcp4.time_wait'] > 0
+
+        # Parsing of the `ss` output, for one IP version, without the fork
+        start = time()
+        for _ in xrange(self.RUNS):
+            with open(self.ss_output) as f:
+                lines = f.read().splitlines()
+            self.check._parse_linux_cx_state(lines[1:], self.check.TCP_STATES['ss'], 1, ip_version='4')
+        ss_duration = (time() - start) / self.RUNS
+
+        print "Connection states of %d sockets: %.1fms from procfs, " \
+            "%.1fms parsing the `ss` output of half of them" % (
+                2 * self.LINE_COUNT, 1000 * proc_duration, 1000 * ss_duration)
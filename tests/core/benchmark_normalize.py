@@ -0,0 +1,91 @@
+"""
+Performance tests for the metric name normalization of the checks.
+"""
+# stdlib
+import re
+from time import time
+
+# project
+from checks import AgentCheck
+
+FIRST_CAP_RE = re.compile('(.)([A-Z][a-z]+)')
+ALL_CAP_RE = re.compile('([a-z0-9])([A-Z])')
+METRIC_REPLACEMENT = re.compile(r'([^a-zA-Z0-9_.]+)|(^[^a-zA-Z]+)')
+DOT_UNDERSCORE_CLEANUP = re.compile(r'_*\._*')
+
+
+def reference_normalize(metric, prefix=None, fix_case=False):
+    """ AgentCheck.normalize, without cache """
+    if fix_case:
+        name = reference_convert_to_underscore_separated(metric)
+        if prefix is not None:
+            prefix = reference_convert_to_underscore_separated(prefix)
+    else:
+        name = re.sub(r"[,\+\*\-/()\[\]{}\s]", "_", metric)
+    name = re.sub(r"__+", "_", name)
+    name = re.sub(r"^_", "", name)
+    name = re.sub(r"_$", "", name)
+    name = re.sub(r"\._", ".", name)
+    name = re.sub(r"_\.", ".", name)
+
+    if prefix is not None:
+        return prefix + "." + name
+    else:
+        return name
+
+
+def reference_convert_to_underscore_separated(name):
+    """ AgentCheck.convert_to_underscore_separated, without cache """
+    metric_name = FIRST_CAP_RE.sub(r'\1_\2', name)
+    metric_name = ALL_CAP_RE.sub(r'\1_\2', metric_name).lower()
+    metric_name = METRIC_REPLACEMENT.sub('_', metric_name)
+    return DOT_UNDERSCORE_CLEANUP.sub('.', metric_name).strip('_')
+
+
+class TestNormalizePerf(object):
+
+    RUNS = 100
+    # Names like the ones of the elastic, mongo, rabbitmq or haproxy checks
+    METRIC_NAMES = [
+        'nodes.%s.indices.search.query_time_in_millis' % i for i in xrange(100)
+    ] + [
+        'opcounters%sPerSecond.%s' % (op, i) for op in ('Insert', 'Query', 'GetMore') for i in xrange(100)
+    ] + [
+        'queue_totals.messages_ready(%s)' % i for i in xrange(100)
+    ] + [
+        '__Backend-%s/req_rate{max}__' % i for i in xrange(100)
+    ] + [
+        u'r\xe9plica.%sLagMs' % i for i in xrange(100)
+    ]
+
+    def test_normalize_matches_reference(self):
+        check = AgentCheck('test', {}, {'checksd_hostname': 'foo'})
+        for prefix in (None, 'prefix', 'SomePrefix'):
+            for fix_case in (False, True):
+                expected = [reference_normalize(name, prefix, fix_case) for name in self.METRIC_NAMES]
+                # Twice, for the cached names
+                for _ in xrange(2):
+                    assert [check.normalize(name, prefix, fix_case) for name in self.METRIC_NAMES] == expected
+                    assert check.normalize_names(self.METRIC_NAMES, prefix, fix_case) == expected
+                assert [check.convert_to_underscore_separated(name) for name in self.METRIC_NAMES] == \
+                    [reference_convert_to_underscore_separated(name) for name in self.METRIC_NAMES]
+
+    def _names_per_second(self, normalize):
+        start = time()
+        for _ in xrange(self.RUNS):
+            normalize()
+        return self.RUNS * len(self.METRIC_NAMES) / (time() - start)
+
+    def test_normalize_perf(self):
+        check = AgentCheck('test', {}, {'checksd_hostname': 'foo'})
+        names = self.METRIC_NAMES
+        for fix_case in (False, True):
+            reference = self._names_per_second(
+                lambda: [reference_normalize(name, 'prefix', fix_case) for name in names])
+            cached = self._names_per_second(
+                lambda: [check.normalize(name, 'prefix', fix_case) for name in names])
+            vectorized = self._names_per_second(
+                lambda: check.normalize_names(names, 'prefix', fix_case))
+            print "Normalize (fix_case=%s): %d names/s without cache, %d names/s cached (x%.1f), " \
+                "%d names/s cached and vectorized (x%.1f)" % (
+                    fix_case, reference, cached, cached / reference, vectorized, vectorized / reference)
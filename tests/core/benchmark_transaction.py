@@ -0,0 +1,69 @@
+"""
+Performance tests for the forwarder transaction manager.
+"""
+# stdlib
+from datetime import timedelta
+from time import time
+
+# project
+from transaction import Transaction, TransactionManager
+
+
+class FailingTransaction(Transaction):
+    def __init__(self, manager, size):
+        Transaction.__init__(self)
+        self._trManager = manager
+        self._size = size
+
+    def flush(self):
+        self._trManager.tr_error(self)
+
+
+class TestTransactionManagerPerf(object):
+
+    QUEUED_COUNT = 20000
+    FLUSH_COUNT = 100
+    NEW_COUNT = 1000
+    TR_SIZE = 1000
+
+    def flush(self, manager):
+        manager.flush()
+        # Transactions don't call flush_next themselves, that would recurse
+        # once per transaction
+        while manager._trs_to_flush is not None:
+            manager.flush_next()
+
+    def test_transaction_manager_outage_perf(self):
+        """ Flush ticks, new transactions and completions with a large queue during an outage """
+        manager = TransactionManager(timedelta(seconds=90), self.QUEUED_COUNT * self.TR_SIZE, timedelta(0))
+        for _ in xrange(self.QUEUED_COUNT):
+            manager.append(FailingTransaction(manager, self.TR_SIZE))
+        # All of them fail once, and are replayed later
+        self.flush(manager)
+
+        start = time()
+        for _ in xrange(self.FLUSH_COUNT):
+            self.flush(manager)
+        flush_duration = time() - start
+
+        # The queue is full, each new transaction drops another one
+        start = time()
+        for _ in xrange(self.NEW_COUNT):
+            manager.append(FailingTransaction(manager, self.TR_SIZE))
+        append_duration = time() - start
+
+        start = time()
+        for tr in list(manager.get_transactions())[-self.NEW_COUNT:]:
+            manager.tr_success(tr)
+        success_duration = time() - start
+
+        print "%s queued transactions: %.3fms per flush, %.3fms per append, %.3fms per success" % (
+            self.QUEUED_COUNT,
+            1000 * flush_duration / self.FLUSH_COUNT,
+            1000 * append_duration / self.NEW_COUNT,
+            1000 * success_duration / self.NEW_COUNT)
+
+
+if __name__ == '__main__':
+    t = TestTransactionManagerPerf()
+    t.test_transaction_manager_outage_perf()
@@ -753,6 +753,29 @@ class TestUnitMetricsBucketAggregator(unittest.TestCase):
             else:
                 assert False, 'invalid : %s' % packet
 
+    def test_counter_expiry_index(self):
+        stats = MetricsBucketAggregator('myhost', interval=10, expiry_seconds=100)
+        first = ('first.counter', (), 'myhost', None)
+        second = ('second.counter', (), 'myhost', None)
+        stats.index_counter(first, 1001)
+        stats.index_counter(second, 1005)
+        stats.index_counter(first, 1003)
+        stats.index_counter(first, 1052)
+        nt.assert_equal(stats.counter_expiry_index, {1000: [first, second], 1050: [first]})
+
+        # Counters sampled after the expiry timestamp in the same bucket stay indexed
+        stats.expire_counters(1004)
+        nt.assert_equal(stats.last_sample_time_by_context, {first: 1052, second: 1005})
+        nt.assert_equal(stats.counter_expiry_index, {1000: [second], 1050: [first]})
+
+        stats.expire_counters(1010)
+        nt.assert_equal(stats.last_sample_time_by_context, {first: 1052})
+        nt.assert_equal(stats.counter_expiry_index, {1050: [first]})
+
+        stats.expire_counters(1060)
+        nt.assert_equal(stats.last_sample_time_by_context, {})
+        nt.assert_equal(stats.counter_expiry_index, {})
+
     def test_metrics_expiry(self):
         # Ensure metrics eventually expire and stop submitting.
         ag_interval = self.interval
@@ -1034,3 +1057,67 @@ class TestUnitMetricsBucketAggregator(unittest.TestCase):
         stats = MetricsBucketAggregator('myhost', interval=5)
         nt.assert_equal(stats.calculate_bucket_start(13284287), 13284285)
         nt.assert_equal(stats.calculate_bucket_start(13284280), 13284280)
+
+    def test_merge_state(self):
+        packets = [
+            'my.counter:1|c|#tag1',
+            'my.counter:3|c|#tag1',
+            'my.counter:2|c|@0.5',
+            'my.gauge:1|g',
+            'my.gauge:5|g',
+            'my.set:a|s',
+            'my.set:b|s',
+            'my.set:a|s',
+            'my.hist:1|h',
+            'my.hist:5|h',
+            'my.hist:3|h',
+            'my.hist:2|h',
+            '_e{5,4}:title|text',
+            '_sc|check|0',
+        ]
+
+        self.wait_for_bucket_boundary()
+        single = MetricsBucketAggregator('myhost', interval=self.interval)
+        merged = MetricsBucketAggregator('myhost', interval=self.interval)
+        workers = [MetricsBucketAggregator('myhost', interval=self.interval) for _ in range(2)]
+        for i, packet in enumerate(packets):
+            single.submit_packets(packet)
+            workers[i % 2].submit_packets(packet)
+
+        # Nothing is exported until the bucket is closed
+        for worker in workers:
+            merged.merge_state(worker.export_state())
+        nt.assert_equal(merged.metric_by_bucket, {})
+
+        self.sleep_for_interval_length()
+        for worker in workers:
+            merged.merge_state(worker.export_state())
+            nt.assert_equal(worker.metric_by_bucket, {})
+
+        nt.assert_equal(merged.count, single.count)
+        nt.assert_equal(self.sort_metrics(merged.flush()), self.sort_metrics(single.flush()))
+        nt.assert_equal(merged.flush_events(), single.flush_events())
+        nt.assert_equal(merged.flush_service_checks(), single.flush_service_checks())
+
+    def test_context_limiter_merge_state(self):
+        self.wait_for_bucket_boundary()
+        merged = MetricsBucketAggregator('myhost', interval=self.interval, max_contexts=2)
+        workers = [MetricsBucketAggregator('myhost', interval=self.interval, max_contexts=2)
+                   for _ in range(2)]
+        for i in xrange(10):
+            workers[i % 2].submit_packets('my.counter:1|c|#id:%s' % i)
+
+        self.sleep_for_interval_length()
+        for worker in workers:
+            merged.merge_state(worker.export_state())
+            # Exported contexts don't count towards the worker's limit anymore
+            nt.assert_equal(worker.context_limiter.context_count, 0)
+
+        merged.send_contexts_dropped('datadog.dogstatsd.contexts_dropped')
+        self.sleep_for_interval_length()
+        metrics = self.sort_metrics(merged.flush())
+        nt.assert_equal(len(set(m['tags'] for m in metrics if m['metric'] == 'my.counter')), 4)
+        dropped = [m for m in metrics if m['metric'] == 'datadog.dogstatsd.contexts_dropped']
+        nt.assert_equal(len(dropped), 1)
+        nt.assert_equal(dropped[0]['tags'], ['metric_name:my.counter'])
+        nt.assert_equal(dropped[0]['points'][0][1], 6)
@@ -0,0 +1,69 @@
+# stdlib
+import unittest
+
+# project
+from checks import AgentCheck
+from checks.scheduler import CheckScheduler, get_collection_interval
+
+
+class TestCheckScheduler(unittest.TestCase):
+
+    def make_check(self, intervals, init_config=None):
+        instances = [{} if interval is None else {'collection_interval': interval}
+                     for interval in intervals]
+        return AgentCheck('test', init_config or {}, {}, instances)
+
+    def test_collection_interval(self):
+        check = self.make_check([5, None, 0], init_config={'collection_interval': 300})
+        self.assertEquals(get_collection_interval(check, check.instances[0]), 5)
+        self.assertEquals(get_collection_interval(check, check.instances[1]), 300)
+        self.assertEquals(get_collection_interval(check, check.instances[2]), None)
+        self.assertEquals(get_collection_interval(self.make_check([]), {}), None)
+
+    def test_pop_due(self):
+        scheduler = CheckScheduler(jitter=0)
+        fast_check = self.make_check([5, None])
+        slow_check = self.make_check([300])
+        scheduler.update([fast_check, slow_check], now=1000)
+
+        self.assertEquals(len(scheduler), 2)
+        self.assertEquals(scheduler.scheduled_instances(fast_check), frozenset([0]))
+        self.assertEquals(scheduler.scheduled_instances(self.make_check([None])), frozenset())
+        self.assertEquals(scheduler.next_run_time(), 1000)
+
+        self.assertEquals(scheduler.pop_due(now=1000), {fast_check: [0], slow_check: [0]})
+        self.assertEquals(scheduler.next_run_time(), 1005)
+        self.assertEquals(scheduler.pop_due(now=1004), {})
+        self.assertEquals(scheduler.pop_due(now=1005), {fast_check: [0]})
+
+        # Missed runs are skipped, the next ones keep their phase
+        self.assertEquals(scheduler.pop_due(now=1022), {fast_check: [0]})
+        self.assertEquals(scheduler.next_run_time(), 1025)
+
+        self.assertEquals(scheduler.pop_due(now=1300), {fast_check: [0], slow_check: [0]})
+
+    def test_jitter(self):
+        scheduler = CheckScheduler()
+        checks = [self.make_check([10]) for _ in xrange(100)]
+        scheduler.update(checks, now=1000)
+
+        run_times = [entry[0] for entry in scheduler._queue]
+        self.assertTrue(all(1000 <= t < 1010 for t in run_times))
+        # Spread over the interval
+        self.assertTrue(max(run_times) - min(run_times) > 5)
+        self.assertEquals(sum(len(i) for i in scheduler.pop_due(now=1010).itervalues()), 100)
+
+    def test_update(self):
+        scheduler = CheckScheduler(jitter=0)
+        old_check = self.make_check([5])
+        check = self.make_check([10])
+        scheduler.update([old_check, check], now=1000)
+        scheduler.pop_due(now=1000)
+
+        # Known checks keep their schedule, removed ones are unscheduled
+        new_check = self.make_check([5])
+        scheduler.update([check, new_check], now=1003)
+        self.assertEquals(len(scheduler), 2)
+        self.assertEquals(scheduler.scheduled_instances(old_check), frozenset())
+        self.assertEquals(scheduler.pop_due(now=1003), {new_check: [0]})
+        self.assertEquals(scheduler.pop_due(now=1010), {check: [0], new_check: [0]})
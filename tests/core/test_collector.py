@@ -0,0 +1,163 @@
+# stdlib
+import time
+import unittest
+
+# 3p
+import mock
+
+# project
+from checks import AgentCheck
+from checks.check_status import (
+    CheckStatus,
+    InstanceStatus,
+    STATUS_ERROR,
+    STATUS_OK,
+    STATUS_WARNING,
+)
+from checks.collector import Collector
+
+
+class SleepCheck(AgentCheck):
+    def __init__(self, name, sleep):
+        AgentCheck.__init__(self, name, {}, {}, [{'sleep': sleep}])
+        self.run_count = 0
+
+    def check(self, instance):
+        self.run_count += 1
+        time.sleep(instance['sleep'])
+        self.gauge('test.slept', instance['sleep'])
+
+
+class TestCollectorCheckRunners(unittest.TestCase):
+
+    def setUp(self):
+        self.collector = Collector({'check_runners': '4', 'check_timeout': '0.5'}, [], {}, 'foo')
+
+    def tearDown(self):
+        self.collector.stop()
+
+    def test_run_checks_concurrently(self):
+        checks = [SleepCheck('sleep%s' % i, 0.2) for i in xrange(4)]
+
+        start = time.time()
+        check_runs = list(self.collector._run_checks_concurrently(checks))
+        self.assertTrue(time.time() - start < 0.6)
+
+        self.assertEquals(sorted(r.check.name for r in check_runs), sorted(c.name for c in checks))
+        for check_run in check_runs:
+            self.assertEquals(check_run.status.status, STATUS_OK)
+            self.assertEquals([m[0] for m in check_run.metrics], ['test.slept'])
+            self.assertEquals([sc['check'] for sc in check_run.service_checks],
+                              ['datadog.agent.check_status'])
+            self.assertEquals(check_run.service_checks[0]['status'], AgentCheck.OK)
+            self.assertTrue(check_run.run_time >= 0.2)
+
+    def test_late_check(self):
+        fast_check = SleepCheck('fast', 0)
+        slow_check = SleepCheck('slow', 1)
+        checks = [fast_check, slow_check]
+
+        # The slow check misses its deadline
+        start = time.time()
+        check_runs = dict((r.check.name, r) for r in self.collector._run_checks_concurrently(checks))
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEquals(check_runs['fast'].status.status, STATUS_OK)
+        late_run = check_runs['slow']
+        self.assertEquals(late_run.metrics, [])
+        self.assertEquals(late_run.status.instance_statuses[0].status, STATUS_WARNING)
+        self.assertEquals(late_run.service_checks[0]['status'], AgentCheck.WARNING)
+        self.assertEquals(late_run.status.service_check_count, 1)
+
+        # It's not run again while in flight
+        check_runs = dict((r.check.name, r) for r in self.collector._run_checks_concurrently(checks))
+        self.assertEquals(check_runs['slow'].service_checks[0]['status'], AgentCheck.WARNING)
+        self.assertEquals(slow_check.run_count, 1)
+
+        # Its results come once it completes
+        time.sleep(1)
+        check_runs = dict((r.check.name, r) for r in self.collector._run_checks_concurrently(checks))
+        self.assertEquals(check_runs['slow'].status.status, STATUS_OK)
+        self.assertEquals([m[0] for m in check_runs['slow'].metrics], ['test.slept'])
+        self.assertEquals(fast_check.run_count, 3)
+        self.assertEquals(slow_check.run_count, 2)
+
+    def test_stop_replaced_checks(self):
+        fast_check = SleepCheck('fast', 0)
+        slow_check = SleepCheck('slow', 1)
+        fast_check.stop = mock.Mock()
+        slow_check.stop = mock.Mock()
+        list(self.collector._run_checks_concurrently([fast_check, slow_check]))
+
+        # A replaced check still running is only stopped once it completes
+        self.collector.stop_checks([fast_check, slow_check])
+        self.collector._stop_replaced_checks()
+        self.assertEquals(fast_check.stop.call_count, 1)
+        self.assertEquals(slow_check.stop.call_count, 0)
+
+        time.sleep(1)
+        list(self.collector._run_checks_concurrently([]))
+        self.collector._stop_replaced_checks()
+        self.assertEquals(fast_check.stop.call_count, 1)
+        self.assertEquals(slow_check.stop.call_count, 1)
+
+    def test_busy_check_runners(self):
+        self.collector.stop()
+        self.collector = Collector({'check_runners': '2', 'check_timeout': '0.1'}, [], {}, 'foo')
+        checks = [SleepCheck('slow%s' % i, 0.5) for i in xrange(3)]
+
+        # The third check can't start before a late check completes
+        start = time.time()
+        check_runs = list(self.collector._run_checks_concurrently(checks))
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEquals(len(check_runs), 3)
+        for check_run in check_runs:
+            self.assertEquals(check_run.service_checks[0]['status'], AgentCheck.WARNING)
+        self.assertEquals(
+            sum('waiting for a check runner' in r.status.instance_statuses[0].warnings[0] for r in check_runs), 1)
+
+        # Then it runs on the first check runner available
+        time.sleep(0.5)
+        check_runs = list(self.collector._run_checks_concurrently(checks))
+        self.assertEquals(sorted(r.check.name for r in check_runs if r.metrics), ['slow0', 'slow1'])
+        self.assertEquals([c.run_count for c in checks], [2, 1, 1])
+
+    def test_run_checks_sequentially(self):
+        collector = Collector({}, [], {}, 'foo')
+        checks = [SleepCheck('sleep%s' % i, 0) for i in xrange(2)]
+        check_runs = list(collector._run_checks_sequentially(checks))
+        self.assertEquals([r.check.name for r in check_runs], ['sleep0', 'sleep1'])
+        self.assertEquals(collector._check_pool, None)
+
+
+class TestCollectorCheckScheduling(unittest.TestCase):
+
+    def test_scheduled_instances(self):
+        collector = Collector({'check_schedule_jitter': '0'}, [], {}, 'foo')
+        check = AgentCheck('test', {}, {}, [{}, {'collection_interval': 60}])
+        instance_runs = []
+        check.check = lambda instance: instance_runs.append(instance.get('collection_interval'))
+        collector.initialized_checks_d = [check]
+        collector._check_scheduler.update([check])
+
+        # The scheduled instance is due right away
+        self.assertEquals(collector._get_due_checks(), ([check], {check: [0, 1]}))
+        self.assertEquals(collector._get_due_checks(), ([check], {check: [0]}))
+
+        # It runs between collection runs when it's due
+        collector._check_scheduler._queue[0] = (0,) + collector._check_scheduler._queue[0][1:]
+        collector.run_scheduled_checks()
+        self.assertEquals(instance_runs, [60])
+        self.assertEquals(len(collector._pending_check_runs), 1)
+        self.assertEquals(collector.next_scheduled_run_time() > time.time(), True)
+
+    def test_merge_check_status(self):
+        first = CheckStatus('test', [InstanceStatus(0, STATUS_OK), InstanceStatus(1, STATUS_OK)],
+                            metric_count=2, service_check_count=1)
+        second = CheckStatus('test', [InstanceStatus(1, STATUS_ERROR, error='boom')],
+                             metric_count=3, service_check_count=1)
+        Collector._merge_check_status(first, second)
+        self.assertEquals([(s.instance_id, s.status) for s in first.instance_statuses],
+                          [(0, STATUS_OK), (1, STATUS_ERROR)])
+        self.assertEquals(first.metric_count, 5)
+        self.assertEquals(first.service_check_count, 2)
+        self.assertEquals(first.status, STATUS_ERROR)
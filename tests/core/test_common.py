@@ -1,6 +1,7 @@
 # stdlib
 import logging
 import os
+import threading
 import time
 import unittest
 
@@ -10,6 +11,8 @@ from checks import (
     AgentCheck,
     Check,
     CheckException,
+    FETCH_POOL_SIZE,
+    FetchTimeout,
     Infinity,
     UnknownValue,
 )
@@ -119,6 +122,14 @@ class TestCore(unittest.TestCase):
         self.assertEqual(self.ac.normalize("PauseTotalNs", "prefix", fix_case = True), "prefix.pause_total_ns")
         self.assertEqual(self.ac.normalize("Metric.wordThatShouldBeSeparated", "prefix", fix_case = True), "prefix.metric.word_that_should_be_separated")
 
+        # Cached names are the same, and so are the names normalized at once
+        self.assertEqual(self.ac.normalize("PauseTotalNs", "prefix", fix_case = True), "prefix.pause_total_ns")
+        self.assertEquals(self.ac.normalize_names(["metric", "__metric__", "metric", "abc.metric(a+b+c{}/5)"], "prefix"),
+                          ["prefix.metric", "prefix.metric", "prefix.metric", "prefix.abc.metric_a_b_c_5"])
+        self.assertEquals(self.ac.normalize_names(["PauseTotalNs", "GcCount"], fix_case=True),
+                          ["pause_total_ns", "gc_count"])
+        self.assertEquals(self.ac.normalize_names([]), [])
+
     def test_service_check(self):
         check_name = 'test.service_check'
         status = AgentCheck.CRITICAL
@@ -144,6 +155,65 @@ class TestCore(unittest.TestCase):
         }], val)
         self.assertEquals(len(check.service_checks), 0, check.service_checks)
 
+    def test_fetch_concurrently(self):
+        check = AgentCheck('test', {}, {'checksd_hostname': 'foo'})
+
+        def fail():
+            raise ValueError("nope")
+
+        results, errors = check.fetch_concurrently({
+            'a': lambda: 1,
+            'b': lambda: 2,
+            'c': fail,
+        }, timeout=5)
+        self.assertEquals(results, {'a': 1, 'b': 2})
+        self.assertEquals(errors.keys(), ['c'])
+        self.assertTrue(isinstance(errors['c'], ValueError))
+
+        self.assertEquals(check.fetch_concurrently({}, timeout=5), ({}, {}))
+
+        # The calls are run in parallel
+        start = time.time()
+        results, errors = check.fetch_concurrently(
+            dict((i, lambda: time.sleep(0.5)) for i in range(4)), timeout=5)
+        self.assertEquals(len(results), 4)
+        self.assertEquals(errors, {})
+        self.assertTrue(time.time() - start < 1.5)
+
+    def test_fetch_concurrently_timeout(self):
+        check = AgentCheck('test', {}, {'checksd_hostname': 'foo'})
+
+        # The results of the calls that completed are returned on timeout
+        start = time.time()
+        results, errors = check.fetch_concurrently({
+            'fast': lambda: 'done',
+            'slow': lambda: time.sleep(3),
+        }, timeout=0.5)
+        self.assertTrue(time.time() - start < 2)
+        self.assertEquals(results, {'fast': 'done'})
+        self.assertEquals(errors.keys(), ['slow'])
+        self.assertTrue(isinstance(errors['slow'], FetchTimeout))
+
+    def test_fetch_concurrently_pool(self):
+        check = AgentCheck('test', {}, {'checksd_hostname': 'foo'})
+
+        def thread_name():
+            time.sleep(0.1)
+            return threading.current_thread().name
+
+        # The calls given up on don't start new threads
+        for _ in range(3):
+            check.fetch_concurrently(dict((i, lambda: time.sleep(1)) for i in range(8)), timeout=0.1)
+        thread_count = threading.active_count()
+        check.fetch_concurrently(dict((i, lambda: time.sleep(1)) for i in range(8)), timeout=0.1)
+        self.assertEquals(threading.active_count(), thread_count)
+
+        # The calls run on the threads of the shared pool
+        results, errors = check.fetch_concurrently(dict((i, thread_name) for i in range(4)), timeout=5)
+        self.assertEquals(errors, {})
+        pool_threads = set('Worker-Fetch-%s' % i for i in range(FETCH_POOL_SIZE))
+        self.assertTrue(set(results.values()) <= pool_threads, results)
+
     def test_collector(self):
         agentConfig = {
             'api_key': 'test_apikey',
@@ -5,7 +5,11 @@ import os.path
 import tempfile
 import unittest
 
+# 3p
+import mock
+
 # project
+from agent import Agent
 from config import get_config, load_check_directory
 from util import is_valid_hostname, windows_friendly_colon_split
 from utils.pidfile import PidFile
@@ -110,3 +114,85 @@ class TestConfig(unittest.TestCase):
 
         for c in DEFAULT_CHECKS:
             self.assertTrue(c in init_checks_names)
+
+    def testReloadKeepsUnchangedChecks(self):
+        checksd_dir = tempfile.mkdtemp()
+        confd_dir = tempfile.mkdtemp()
+        check_path = os.path.join(checksd_dir, 'reload_test.py')
+        conf_path = os.path.join(confd_dir, 'reload_test.yaml')
+
+        def write(path, content, mtime):
+            with open(path, 'w') as f:
+                f.write(content)
+            os.utime(path, (mtime, mtime))
+
+        write(check_path, "from checks import AgentCheck\n"
+                          "class ReloadTest(AgentCheck):\n"
+                          "    pass\n", 1000)
+        write(conf_path, "init_config:\ninstances:\n  - host: a\n", 1000)
+
+        agentConfig = {"additional_checksd": checksd_dir}
+
+        def load():
+            checks = load_check_directory(agentConfig, "foo")['initialized_checks']
+            return [c for c in checks if c.name == 'reload_test'][0]
+
+        with mock.patch('config.get_confd_path', return_value=confd_dir):
+            check = load()
+            check.state = 'kept'
+            self.assertEquals(check.instances, [{'host': 'a'}])
+
+            # Nothing changed: the same check is kept, with its state
+            self.assertTrue(load() is check)
+
+            # The configuration changed: the check is initialized again
+            write(conf_path, "init_config:\ninstances:\n  - host: b\n", 1000)
+            reloaded = load()
+            self.assertFalse(reloaded is check)
+            self.assertEquals(reloaded.instances, [{'host': 'b'}])
+            self.assertTrue(load() is reloaded)
+
+            # The check module changed: it's imported again
+            write(check_path, "from checks import AgentCheck\n"
+                              "class ReloadTest(AgentCheck):\n"
+                              "    reimported = True\n", 2000)
+            reimported = load()
+            self.assertFalse(reimported is reloaded)
+            self.assertTrue(reimported.reimported)
+
+    def testReloadStopsReplacedChecks(self):
+        checksd_dir = tempfile.mkdtemp()
+        confd_dir = tempfile.mkdtemp()
+        with open(os.path.join(checksd_dir, 'reload_stop_test.py'), 'w') as f:
+            f.write("from checks import AgentCheck\n"
+                    "class ReloadStopTest(AgentCheck):\n"
+                    "    stopped = False\n"
+                    "    def stop(self):\n"
+                    "        self.stopped = True\n")
+        conf_path = os.path.join(confd_dir, 'reload_stop_test.yaml')
+        with open(conf_path, 'w') as f:
+            f.write("init_config:\ninstances:\n  - host: a\n")
+
+        agent = Agent('/tmp/reload_stop_test.pid', autorestart=False)
+        agent._agentConfig = {"additional_checksd": checksd_dir}
+
+        def loaded_check():
+            return [c for c in agent._checksd['initialized_checks'] if c.name == 'reload_stop_test'][0]
+
+        with mock.patch('config.get_confd_path', return_value=confd_dir), \
+                mock.patch('agent.get_hostname', return_value='foo'):
+            agent.reload_configs()
+            check = loaded_check()
+
+            # An unchanged check keeps running
+            agent.reload_configs()
+            self.assertTrue(loaded_check() is check)
+            self.assertFalse(check.stopped)
+
+            # The check replaced by a reload is stopped, it may keep connections open
+            with open(conf_path, 'w') as f:
+                f.write("init_config:\ninstances:\n  - host: b\n")
+            agent.reload_configs()
+            self.assertFalse(loaded_check() is check)
+            self.assertTrue(check.stopped)
+            self.assertFalse(loaded_check().stopped)
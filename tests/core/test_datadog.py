@@ -4,12 +4,17 @@ from datetime import datetime
 import logging
 import os
 import re
-from tempfile import gettempdir, NamedTemporaryFile
+import shutil
+from tempfile import gettempdir, mkdtemp, NamedTemporaryFile
 import time
 import unittest
 
+# 3p
+from mock import patch
+
 # project
 from checks.datadog import Dogstreams, EventDefaults
+from utils.tailfile import OffsetRegistry
 
 log = logging.getLogger('datadog.test')
 
@@ -20,6 +25,14 @@ def parse_ancient_function_plugin(logger, line):
     res[3] = {'metric_type': 'gauge'}
 
 
+def parse_stuck_function_plugin(logger, line):
+    """Stateless parser getting stuck on the 4th point"""
+    res = line.split()
+    if res[1] == '1000000003':
+        time.sleep(2)
+    return res[0], int(res[1]), float(res[2]), {'metric_type': 'gauge'}
+
+
 def parse_function_plugin(logger, line, state):
     """Simple stateful parser"""
     try:
@@ -89,6 +102,12 @@ class TailTestCase(unittest.TestCase):
         self.log_file = NamedTemporaryFile()
         self.logger = logging.getLogger('test.dogstream')
 
+        # Keep the offsets of the tailed files away from the other tests and the agent
+        self.offsets_dir = mkdtemp()
+        offsets = OffsetRegistry(os.path.join(self.offsets_dir, 'tailfile_offsets.json'))
+        self.offsets_patcher = patch('utils.tailfile._offset_registry', offsets)
+        self.offsets_patcher.start()
+
     def _write_log(self, log_data):
         for data in log_data:
             print >> self.log_file, data
@@ -96,6 +115,8 @@ class TailTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.log_file.close()
+        self.offsets_patcher.stop()
+        shutil.rmtree(self.offsets_dir)
 
 
 class TestDogstream(TailTestCase):
@@ -453,3 +474,52 @@ class TestDogstream(TailTestCase):
         dogstream = Dogstreams.init(self.logger, {'dogstreams': '%s:dogstream.supervisord_log:parse_supervisord' % self.log_file.name})
         actual_output = dogstream.check(self.config, move_end=False)
         self.assertEquals(expected_output, actual_output)
+
+    def test_parse_pool(self):
+        """Stateless parsers run on the pool, the lines keep their order"""
+        log_data = []
+        for i in range(20):
+            log_data.append(' INFO [CompactionExecutor:%s] 2012-05-12 21:10:%02d,058 Compacting sstable %s' % (i, i, i))
+            log_data.append('test.metric.a %s %s metric_type=gauge' % (1000000000 + i, i))
+        self._write_log(log_data)
+
+        dogstreams_config = '%s:dogstream.cassandra:parse_cassandra, %s:%s:parse_function_plugin' % (
+            self.log_file.name, self.log_file.name, __name__)
+        expected_output = Dogstreams.init(self.logger, {'dogstreams': dogstreams_config}).check(
+            self.config, move_end=False)
+        self.assertEquals(len(expected_output['dogstreamEvents']), 20)
+
+        with patch('checks.datadog.PARSE_CHUNK_SIZE', 3):
+            pooled = Dogstreams.init(self.logger, {'dogstreams': dogstreams_config, 'dogstream_processes': '2'})
+            cassandra, stateful = pooled.dogstreams
+            # Stateful parsers can't be run on the pool
+            self.assertTrue(cassandra.parse_pool is not None)
+            self.assertTrue(stateful.parse_pool is None)
+            try:
+                actual_output = pooled.check(self.config, move_end=False)
+            finally:
+                cassandra.parse_pool.terminate()
+
+        self.assertEquals(expected_output, actual_output)
+
+    def test_parse_pool_timeout(self):
+        """A chunk the pool doesn't parse in time counts as errors, and restarts the pool"""
+        log_data = ['test.metric.%s %s %s metric_type=gauge' % (i, 1000000000 + i, i) for i in range(6)]
+        self._write_log(log_data)
+
+        dogstreams_config = '%s:%s:parse_stuck_function_plugin' % (self.log_file.name, __name__)
+        with patch('checks.datadog.PARSE_CHUNK_SIZE', 3):
+            with patch('checks.datadog.PARSE_CHUNK_TIMEOUT', 0.5):
+                pooled = Dogstreams.init(self.logger, {'dogstreams': dogstreams_config, 'dogstream_processes': '1'})
+                dogstream = pooled.dogstreams[0]
+                pool = dogstream.parse_pool._pool
+                try:
+                    actual_output = pooled.check(self.config, move_end=False)
+                finally:
+                    pooled.stop()
+
+        # The first chunk is parsed, the stuck one counts as errors
+        self.assertEquals(len(actual_output['dogstream']), 3)
+        self.assertEquals(dogstream._error_count, 3)
+        self.assertEquals(dogstream._line_count, 6)
+        self.assertTrue(dogstream.parse_pool._pool is not pool)
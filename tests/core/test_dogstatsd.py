@@ -1,15 +1,39 @@
 # -*- coding: utf-8 -*-
 # stdlib
+import os
 import random
+import shutil
+import socket
+import tempfile
+import threading
 import time
 import unittest
+import zlib
 
 # 3p
 from nose.plugins.attrib import attr
+from nose.plugins.skip import SkipTest
+import mock
 import nose.tools as nt
+import simplejson as json
 
 # project
-from aggregator import DEFAULT_HISTOGRAM_AGGREGATES, get_formatter, MetricsAggregator
+from aggregator import (
+    api_formatter,
+    DEFAULT_HISTOGRAM_AGGREGATES,
+    get_formatter,
+    MetricsAggregator,
+    MetricsBucketAggregator,
+)
+from dogstatsd import (
+    get_udp_socket_drops,
+    PayloadSender,
+    Reporter,
+    serialize_metrics_payloads,
+    Server,
+    ServerWorkerPool,
+)
+from utils.platform import Platform
 
 
 class TestUnitDogStatsd(unittest.TestCase):
@@ -170,6 +194,55 @@ class TestUnitDogStatsd(unittest.TestCase):
         serialized = dogstatsd.serialize_metrics([api_formatter("foo", 12, 1, ('tag',), 'host')], "test-host")
         assert '"tags": ["tag"]' in serialized[0]
 
+    def test_serialize_metrics_payloads(self):
+        metrics = [
+            api_formatter('my.metric.%s' % i, i, 1, ('tag:%s' % random.random(),), 'myhost')
+            for i in xrange(5000)
+        ]
+        max_payload_size = 20000
+
+        series = []
+        payloads = list(serialize_metrics_payloads(metrics, 'myhost', max_payload_size))
+        nt.assert_true(len(payloads) > 1)
+        for payload, headers in payloads:
+            nt.assert_true(len(payload) <= max_payload_size, len(payload))
+            nt.assert_equal(headers['Content-Encoding'], 'deflate')
+            series.extend(json.loads(zlib.decompress(payload))['series'])
+
+        # All the series are sent once, in order, with the serialization status
+        nt.assert_equal([s['metric'] for s in series[:-1]], [m['metric'] for m in metrics])
+        nt.assert_equal(series[-1]['metric'], 'datadog.dogstatsd.serialization_status')
+        nt.assert_equal(series[-1]['tags'], ['status:success'])
+
+    def test_reporter_submit_payloads(self):
+        reporter = Reporter(10, MetricsAggregator('myhost'), 'http://localhost:17123',
+                            api_key='apikey', max_payload_size=20000)
+        reporter.http_session = mock.Mock()
+        reporter.submit([api_formatter('my.metric', i, 1, ('tag:%s' % random.random(),), 'myhost')
+                         for i in xrange(5000)])
+
+        nt.assert_true(reporter.http_session.post.call_count > 1)
+        series_count = 0
+        for args, kwargs in reporter.http_session.post.call_args_list:
+            nt.assert_equal(args[0], 'http://localhost:17123/api/v1/series?api_key=apikey')
+            series_count += len(json.loads(zlib.decompress(kwargs['data']))['series'])
+        nt.assert_equal(series_count, 5001)
+
+    def test_serialize_metrics_payloads_unicode(self):
+        metrics = [
+            api_formatter('my.metric', 1, 1, ('tag:\xe9',), 'myhost'),
+            api_formatter('my.other.metric', 2, 1, ('tag:a',), 'myhost'),
+        ]
+        payloads = list(serialize_metrics_payloads(metrics, 'myhost'))
+        nt.assert_equal(len(payloads), 1)
+        series = json.loads(zlib.decompress(payloads[0][0]))['series']
+        nt.assert_equal([s['metric'] for s in series], [
+            'my.metric', 'my.other.metric',
+            'datadog.dogstatsd.serialization_status', 'datadog.dogstatsd.serialization_status'
+        ])
+        nt.assert_equal(series[0]['tags'], [u'tag:\ufffd'])
+        nt.assert_equal(series[3]['tags'], ['status:failure'])
+
     def test_counter(self):
         stats = MetricsAggregator('myhost')
 
@@ -832,6 +905,124 @@ class TestUnitDogStatsd(unittest.TestCase):
         nt.assert_equals(third['metric'], 'line_ending.windows')
         nt.assert_equals(third['points'][0][1], 300)
 
+    def test_context_cache(self):
+        packets = [
+            'cached.counter:1|c|#tag2,tag1:a:b',
+            'cached.counter:2|c|#tag1:a:b,tag2',
+            'cached.counter:3|c|#tag2,tag1:a:b,tag2',
+            'cached.gauge:1.5|g|@0.5|#host:otherhost,device:sda',
+            'cached.gauge:3|g|@0.5|#host:otherhost,device:sda',
+            'cached.hist:1|h:2|h|#tag1',
+            'cached.hist:3|h:4|h|#tag1',
+            'cached.set:a|s',
+            'cached.set:b|s',
+            'cached.counter:4|c',
+        ]
+
+        stats = MetricsAggregator('myhost')
+        uncached_stats = MetricsAggregator('myhost', context_cache_size=0)
+        nt.assert_equal(uncached_stats.context_cache, None)
+        for packet in packets:
+            stats.submit_packets(packet)
+            uncached_stats.submit_packets(packet)
+
+        # Packets batching several values aren't cached
+        nt.assert_equal(len(stats.context_cache), 6)
+
+        def values(metrics):
+            return [(m['metric'], m['tags'], m['host'], m['device_name'], m['points'][0][1])
+                    for m in self.sort_metrics(metrics)]
+        nt.assert_equal(values(stats.flush()), values(uncached_stats.flush()))
+
+        # Invalid values of cached series are still rejected
+        self.assertRaises(Exception, stats.submit_packets, 'cached.counter:abc|c')
+        self.assertRaises(Exception, stats.submit_packets, 'cached.counter:1:2|c')
+
+    def test_context_cache_size(self):
+        stats = MetricsAggregator('myhost', context_cache_size=10)
+        for i in xrange(100):
+            stats.submit_packets('metric.%s:1|c' % i)
+        nt.assert_equal(len(stats.context_cache), 10)
+        nt.assert_equal(len(stats.flush()), 100)
+
+    def test_interned_contexts(self):
+        stats = MetricsAggregator('myhost')
+        stats.submit_packets('first.metric:1|c|#tag1,tag2')
+        stats.submit_packets('second.metric:1|g|#tag2,tag1')
+        stats.submit_packets('second.metric:1|g|#tag2,tag1,host:otherhost')
+
+        first, second, third = sorted(stats.metrics.values(), key=lambda m: (m.name, m.hostname))
+        # Metrics don't have an instance dict
+        nt.assert_false(hasattr(first, '__dict__'))
+        # Tags and hostnames are shared between series
+        nt.assert_true(first.tags is second.tags)
+        nt.assert_true(first.hostname is second.hostname)
+        nt.assert_true(second.tags is third.tags)
+        for context, metric in stats.metrics.iteritems():
+            nt.assert_true(context[1] is metric.tags)
+
+    def test_context_limiter(self):
+        stats = MetricsAggregator('myhost', max_contexts=15, max_contexts_per_metric=10)
+        for i in xrange(20):
+            stats.submit_packets('request.count:1|c|#request_id:%s' % i)
+            stats.submit_packets('request.time:1|h|#request_id:%s' % i)
+            stats.submit_packets('other.metric:%s|g' % i)
+
+        contexts_by_name = {}
+        for context in stats.metrics:
+            contexts_by_name[context[0]] = contexts_by_name.get(context[0], 0) + 1
+        # The global limit is reached before the per metric limit
+        nt.assert_equal(contexts_by_name, {'request.count': 7, 'request.time': 7, 'other.metric': 1})
+
+        # Known contexts are still aggregated
+        stats.submit_packets('request.count:1|c|#request_id:0')
+        stats.submit_packets('request.count:1|c|#request_id:10')
+        stats.send_contexts_dropped('datadog.dogstatsd.contexts_dropped')
+        metrics = self.sort_metrics(stats.flush())
+        dropped = dict((m['tags'][0], m['points'][0][1]) for m in metrics
+                       if m['metric'] == 'datadog.dogstatsd.contexts_dropped')
+        # 13 contexts dropped for each, estimated with a HyperLogLog
+        nt.assert_equal(sorted(dropped), ['metric_name:request.count', 'metric_name:request.time'])
+        for count in dropped.itervalues():
+            nt.assert_almost_equal(count, 13, delta=1)
+        counts = [m for m in metrics if m['metric'] == 'request.count']
+        nt.assert_equal(counts[0]['tags'], ('request_id:0',))
+        nt.assert_equal(counts[0]['points'][0][1], 2)
+
+        # The dropped contexts are only reported once
+        stats.send_contexts_dropped('datadog.dogstatsd.contexts_dropped')
+        nt.assert_equal([m for m in stats.flush() if m['metric'] == 'datadog.dogstatsd.contexts_dropped'], [])
+
+    def test_context_limiter_fold(self):
+        stats = MetricsAggregator('myhost', max_contexts_per_metric=3, context_overflow='fold')
+        for i in xrange(5):
+            stats.submit_packets('request.count:1|c|#request_id:%s' % i)
+        stats.submit_packets('request.count:1|c|#request_id:0,host:otherhost')
+        stats.submit_packets('request.count:1|c|#request_id:1,host:otherhost')
+
+        # Folded series keep their host and device
+        metrics = sorted((m['tags'], m['host'], m['points'][0][1]) for m in stats.flush())
+        nt.assert_equal(metrics, [
+            (('dd.context_overflow:true',), 'myhost', 2),
+            (('dd.context_overflow:true',), 'otherhost', 2),
+            (('request_id:0',), 'myhost', 1),
+            (('request_id:1',), 'myhost', 1),
+            (('request_id:2',), 'myhost', 1),
+        ])
+
+    def test_context_limiter_expiry(self):
+        stats = MetricsAggregator('myhost', max_contexts=2, expiry_seconds=1)
+        stats.submit_packets('first:1|g')
+        stats.submit_packets('second:1|g')
+        stats.submit_packets('third:1|g')
+        nt.assert_equal(len(stats.flush()), 2)
+
+        # Expired contexts free their slots on flush
+        time.sleep(1.5)
+        nt.assert_equal(stats.flush(), [])
+        stats.submit_packets('third:1|g')
+        nt.assert_equal([m['metric'] for m in stats.flush()], ['third'])
+
     def test_no_proxy(self):
         """ Starting with Agent 5.0.0, there should always be a local forwarder
         running and all payloads should go through it. So we should make sure
@@ -866,3 +1057,261 @@ class TestUnitDogStatsd(unittest.TestCase):
         del env["https_proxy"]
         del env["HTTP_PROXY"]
         del env["HTTPS_PROXY"]
+
+
+class TestDogstatsdServer(unittest.TestCase):
+
+    @staticmethod
+    def get_free_port():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_batched_receive(self):
+        aggregator = MetricsAggregator('myhost')
+        port = self.get_free_port()
+        server = Server(aggregator, '127.0.0.1', port, recv_batch_size=16,
+                        so_rcvbuf=1024 * 1024)
+        submitted = []
+
+        def submit_packets(packets):
+            submitted.append(packets)
+            MetricsAggregator.submit_packets(aggregator, packets)
+        aggregator.submit_packets = submit_packets
+
+        thread = threading.Thread(target=server.start)
+        thread.daemon = True
+        thread.start()
+        self.wait_for(lambda: server.running)
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in xrange(100):
+            client.sendto('batched.counter:1|c', ('127.0.0.1', port))
+        self.wait_for(lambda: aggregator.count == 100)
+
+        nt.assert_true(0 < server.batch_count <= 100)
+        nt.assert_equal(server.datagram_count, 100)
+        nt.assert_true(1 <= server.max_batch_size <= 16)
+        # The datagrams of a batch are submitted at once
+        nt.assert_equal(len(submitted), server.batch_count)
+
+        server.submit_stats()
+        nt.assert_equal(server.batch_count, 0)
+        metrics = dict((m['metric'], m) for m in aggregator.flush())
+        nt.assert_equal(metrics['batched.counter']['points'][0][1], 100)
+        nt.assert_true('datadog.dogstatsd.packet.batch_size' in metrics)
+        nt.assert_true('datadog.dogstatsd.packet.batch_size.max' in metrics)
+
+        server.stop()
+        # Wake up the select loop
+        client.sendto('batched.counter:1|c', ('127.0.0.1', port))
+        thread.join(5)
+        nt.assert_false(thread.is_alive())
+        client.close()
+
+    def test_udp_socket_drops(self):
+        if not Platform.is_linux():
+            raise SkipTest("/proc/net/udp is only available on Linux")
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        try:
+            nt.assert_equal(get_udp_socket_drops(sock), 0)
+        finally:
+            sock.close()
+
+    @attr(requires='core_integration')
+    def test_worker_pool(self):
+        port = self.get_free_port()
+        servers = [
+            Server(MetricsBucketAggregator('myhost', interval=1), '127.0.0.1', port, reuse_port=True)
+            for _ in range(2)
+        ]
+        pool = ServerWorkerPool(servers)
+        thread = threading.Thread(target=pool.start)
+        thread.daemon = True
+        thread.start()
+        try:
+            self.wait_for(lambda: all(pool.workers))
+            # Let the workers bind
+            time.sleep(0.5)
+
+            for i in xrange(100):
+                # Use different source ports so that the traffic is spread
+                client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                client.sendto('pool.counter:1|c\npool.set:%s|s' % i, ('127.0.0.1', port))
+                client.close()
+
+            # Wait for the bucket to close
+            time.sleep(1.5)
+            aggregator = MetricsBucketAggregator('myhost', interval=1)
+            pool.merge_into(aggregator)
+            nt.assert_equal(aggregator.count, 200)
+
+            metrics = dict((m['metric'], m) for m in aggregator.flush())
+            nt.assert_equal(metrics['pool.counter']['points'][0][1], 100)
+            nt.assert_equal(metrics['pool.set']['points'][0][1], 100)
+        finally:
+            pool.stop()
+            thread.join(10)
+        nt.assert_false(thread.is_alive())
+
+
+    def test_worker_pool_dead_workers(self):
+        # The workers exit right away
+        pool = ServerWorkerPool([mock.Mock(), mock.Mock()])
+        pool.spawn_workers()
+        workers = [worker for worker, _ in pool.workers]
+
+        with nt.assert_raises(Exception):
+            pool.start()
+        # They were forked once, by `spawn_workers`
+        nt.assert_equal([worker for worker, _ in pool.workers], workers)
+        nt.assert_false(pool.running)
+
+
+class TestPayloadSender(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+        self.session_patcher = mock.patch('dogstatsd.requests.Session')
+        self.session = self.session_patcher.start().return_value
+
+    def tearDown(self):
+        self.session_patcher.stop()
+        shutil.rmtree(self.spill_dir)
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def posted_data(self):
+        return [kwargs['data'] for _, kwargs in self.session.post.call_args_list]
+
+    def test_retry(self):
+        self.session.post.side_effect = [
+            Exception("Connection refused"),
+            mock.Mock(status_code=503),
+            mock.Mock(status_code=202),
+        ]
+        sender = PayloadSender(retry_backoff=0.01)
+        sender.start()
+        sender.submit('http://localhost:17123/api/v1/series', 'payload', {})
+        self.wait_for(lambda: self.session.post.call_count == 3 and sender.queue_size() == 0)
+        sender.stop()
+        nt.assert_equal(self.posted_data(), ['payload'] * 3)
+
+        aggregator = MetricsAggregator('myhost')
+        sender.submit_stats(aggregator)
+        stats = dict((m['metric'], m['points'][0][1]) for m in aggregator.flush())
+        nt.assert_equal(stats['datadog.dogstatsd.submission.retries'], 2)
+        nt.assert_equal(stats['datadog.dogstatsd.submission.dropped'], 0)
+        nt.assert_equal(stats['datadog.dogstatsd.submission.queue_size'], 0)
+        nt.assert_true('datadog.dogstatsd.submission.latency.avg' in stats)
+
+    def test_rejected_payloads_are_not_retried(self):
+        self.session.post.return_value = mock.Mock(status_code=400)
+        sender = PayloadSender(retry_backoff=0.01)
+        sender.start()
+        sender.submit('http://localhost:17123/api/v1/series', 'payload', {})
+        self.wait_for(lambda: sender.queue_size() == 0 and sender.drop_count == 1)
+        sender.stop()
+        nt.assert_equal(self.session.post.call_count, 1)
+
+    def test_full_queue_without_spill(self):
+        sender = PayloadSender(max_queue_size=2)
+        for i in xrange(5):
+            sender.submit('http://localhost:17123/api/v1/series', 'payload %s' % i, {})
+        nt.assert_equal(sender.queue_size(), 2)
+        nt.assert_equal(sender.drop_count, 3)
+
+    def test_spill(self):
+        self.session.post.return_value = mock.Mock(status_code=202)
+        sender = PayloadSender(max_queue_size=2, spill_dir=self.spill_dir)
+        for i in xrange(5):
+            sender.submit('http://localhost:17123/api/v1/series', 'payload %s' % i, {'header': i})
+        nt.assert_equal(sender.queue_size(), 2)
+        nt.assert_equal(len(os.listdir(self.spill_dir)), 3)
+
+        # Payloads left in memory are spilled on stop, and sent on the next run
+        sender.stop()
+        nt.assert_equal(len(os.listdir(self.spill_dir)), 5)
+        sender = PayloadSender(max_queue_size=2, spill_dir=self.spill_dir)
+        sender.start()
+        self.wait_for(lambda: self.session.post.call_count == 5 and sender.queue_size() == 0)
+        sender.stop()
+
+        nt.assert_equal(sorted(self.posted_data()), ['payload %s' % i for i in xrange(5)])
+        nt.assert_equal(os.listdir(self.spill_dir), [])
+
+    def test_spill_format(self):
+        sender = PayloadSender(max_queue_size=0, spill_dir=self.spill_dir)
+        data = zlib.compress('{"series": []}\n' * 10)
+        headers = {'Content-Type': 'application/json', 'Content-Encoding': 'deflate'}
+        sender.submit('http://localhost:17123/api/v1/series', data, headers)
+
+        # The raw body follows a JSON header, nothing is unpickled
+        path = os.path.join(self.spill_dir, os.listdir(self.spill_dir)[0])
+        with open(path, 'rb') as f:
+            nt.assert_equal(json.loads(f.readline())['headers'], headers)
+            nt.assert_equal(f.read(), data)
+
+        payload = PayloadSender(spill_dir=self.spill_dir)._unspill()
+        nt.assert_equal(payload.url, 'http://localhost:17123/api/v1/series')
+        nt.assert_equal(payload.data, data)
+        nt.assert_equal(payload.headers, headers)
+        nt.assert_true(all(isinstance(k, str) and isinstance(v, str) for k, v in payload.headers.iteritems()))
+
+    def test_submit_after_stop(self):
+        sender = PayloadSender(spill_dir=self.spill_dir)
+        sender.start()
+        sender.stop()
+        sender.submit('http://localhost:17123/api/v1/series', 'payload', {})
+        nt.assert_equal(sender.queue_size(), 0)
+        nt.assert_equal(len(os.listdir(self.spill_dir)), 1)
+
+    def test_reporter_last_flush(self):
+        self.session.post.return_value = mock.Mock(status_code=202)
+        sender = PayloadSender(spill_dir=self.spill_dir)
+        aggregator = MetricsAggregator('myhost')
+        reporter = Reporter(3600, aggregator, 'http://localhost:17123', payload_sender=sender)
+        reporter.start()
+        aggregator.submit_packets('_sc|my.last.check|0')
+        reporter.stop()
+        reporter.join()
+
+        # The payloads of the last flush are either sent or spilled, not lost
+        nt.assert_true(sender.stopped)
+        nt.assert_equal(sender.queue_size(), 0)
+        payloads = self.posted_data()
+        sender = PayloadSender(spill_dir=self.spill_dir)
+        while sender.spilled:
+            payloads.append(sender._unspill().data)
+        nt.assert_true(any('my.last.check' in data for data in payloads))
+
+    def test_max_spill_size(self):
+        sender = PayloadSender(max_queue_size=1, spill_dir=self.spill_dir, max_spill_size=1000)
+        for i in xrange(10):
+            sender.submit('http://localhost:17123/api/v1/series', 'x' * 300, {})
+        nt.assert_true(sender.spilled_size <= 1000)
+        nt.assert_equal(len(os.listdir(self.spill_dir)), len(sender.spilled))
+        nt.assert_equal(sender.drop_count + len(sender.spilled), 9)
+
+    def test_reporter_queues_payloads(self):
+        sender = PayloadSender()
+        reporter = Reporter(10, MetricsAggregator('myhost'), 'http://localhost:17123',
+                            payload_sender=sender)
+        reporter.http_session = mock.Mock()
+        reporter.submit_service_checks([{'check': 'my.check', 'status': 0}])
+        nt.assert_equal(reporter.http_session.post.call_count, 0)
+        nt.assert_equal(sender.queue_size(), 1)
+        nt.assert_true('DD-Dogstatsd-Version' in sender.ready[0].headers)
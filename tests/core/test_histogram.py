@@ -1,9 +1,15 @@
 # stdlib
+import random
 import unittest
 
 # project
-from aggregator import Histogram, MetricsAggregator
-from config import get_histogram_aggregates, get_histogram_percentiles
+from aggregator import Histogram, MetricsAggregator, SketchHistogram
+from config import (
+    get_histogram_aggregates,
+    get_histogram_percentiles,
+    get_histogram_sketch_accuracy,
+)
+from utils.sketch import LogBucketSketch
 
 class TestHistogram(unittest.TestCase):
     def test_default(self):
@@ -151,3 +157,92 @@ class TestHistogram(unittest.TestCase):
         self.assertEquals(value_by_type['median'], 9, value_by_type)
         self.assertEquals(value_by_type['max'], 19, value_by_type)
         self.assertEquals(value_by_type['95percentile'], 18, value_by_type)
+
+
+class TestSketchHistogram(unittest.TestCase):
+    ACCURACY = 0.01
+
+    def get_values_by_type(self, stats):
+        value_by_type = {}
+        for k in stats.flush():
+            value_by_type[k['metric'][len('myhistogram')+1:]] = k['points'][0][1]
+        return value_by_type
+
+    def test_sketch_accuracy_config(self):
+        self.assertEquals(get_histogram_sketch_accuracy('0.02'), 0.02)
+        self.assertEquals(get_histogram_sketch_accuracy('1.5'), None)
+        self.assertEquals(get_histogram_sketch_accuracy('aoeu'), None)
+        self.assertEquals(get_histogram_sketch_accuracy(None), None)
+
+    def test_same_outputs_as_histogram(self):
+        percentiles = get_histogram_percentiles('0.5, 0.75, 0.95, 0.99')
+        aggregates = get_histogram_aggregates('min, max, median, avg, count')
+        exact = MetricsAggregator('myhost', histogram_aggregates=aggregates,
+                                  histogram_percentiles=percentiles)
+        sketched = MetricsAggregator('myhost', histogram_aggregates=aggregates,
+                                     histogram_percentiles=percentiles,
+                                     histogram_sketch_accuracy=self.ACCURACY)
+        self.assertEquals(sketched.metric_type_to_class['h'], SketchHistogram)
+        self.assertEquals(sketched.metric_type_to_class['ms'], SketchHistogram)
+
+        rand = random.Random(42)
+        for i in xrange(5000):
+            value = rand.lognormvariate(3, 1.5) * rand.choice([1, 1, 1, -1])
+            exact.submit_packets('myhistogram:{0}|h'.format(value))
+            sketched.submit_packets('myhistogram:{0}|h'.format(value))
+        # Some zeros and sampled values
+        for i in xrange(100):
+            exact.submit_packets('myhistogram:0|h|@0.5')
+            sketched.submit_packets('myhistogram:0|h|@0.5')
+
+        exact_values = self.get_values_by_type(exact)
+        sketched_values = self.get_values_by_type(sketched)
+        self.assertEquals(sorted(exact_values.keys()), sorted(sketched_values.keys()))
+
+        for key in ('min', 'max', 'count'):
+            self.assertEquals(exact_values[key], sketched_values[key], key)
+        self.assertAlmostEquals(exact_values['avg'], sketched_values['avg'])
+        for key in ('median', '50percentile', '75percentile', '95percentile', '99percentile'):
+            self.assertTrue(
+                abs(sketched_values[key] - exact_values[key]) <= self.ACCURACY * abs(exact_values[key]),
+                (key, exact_values[key], sketched_values[key])
+            )
+
+    def test_small_histogram(self):
+        stats = MetricsAggregator('myhost', histogram_sketch_accuracy=self.ACCURACY)
+        stats.submit_packets('myhistogram:3|h')
+        value_by_type = self.get_values_by_type(stats)
+        for key in ('max', 'median', 'avg', '95percentile'):
+            self.assertEquals(value_by_type[key], 3, key)
+        self.assertEquals(value_by_type['count'], 1)
+
+        # The state is reset after a flush
+        self.assertEquals(stats.flush(), [])
+
+    def test_merge(self):
+        left = LogBucketSketch(self.ACCURACY)
+        right = LogBucketSketch(self.ACCURACY)
+        combined = LogBucketSketch(self.ACCURACY)
+        for i in xrange(1, 1000):
+            (left if i % 3 else right).add(i)
+            combined.add(i)
+
+        left.merge(right)
+        self.assertEquals(left.count, combined.count)
+        self.assertEquals(left.sum, combined.sum)
+        self.assertEquals(left.min, 1)
+        self.assertEquals(left.max, 999)
+        for q in (0, 0.25, 0.5, 0.9, 0.99, 1):
+            self.assertEquals(left.quantile(q), combined.quantile(q))
+
+        self.assertRaises(ValueError, left.merge, LogBucketSketch(0.05))
+
+    def test_bounded_memory(self):
+        sketch = LogBucketSketch(self.ACCURACY, max_bins=64)
+        for i in xrange(100000):
+            sketch.add(1.001 ** i)
+        self.assertTrue(len(sketch.positive_bins) <= 64)
+        self.assertEquals(sketch.count, 100000)
+        # The high quantiles keep their accuracy
+        expected = 1.001 ** 98999
+        self.assertTrue(abs(sketch.quantile(0.99) - expected) <= self.ACCURACY * expected)
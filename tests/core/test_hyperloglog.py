@@ -0,0 +1,46 @@
+# stdlib
+from math import sqrt
+import unittest
+
+# project
+from aggregator import ContextLimiter
+from utils.hyperloglog import HyperLogLog
+
+
+class TestHyperLogLog(unittest.TestCase):
+    def test_count(self):
+        for cardinality in (0, 1, 100, 10000, 100000):
+            # Count the contexts over the limit the way the context limiter does
+            limiter = ContextLimiter(max_contexts=1)
+            limiter.admit(('other.metric', (), 'myhost', 'sda'), ())
+            for i in xrange(cardinality):
+                # Duplicates aren't counted
+                for request_id in (i, i / 2):
+                    context = ('my.metric', ('request_id:%s' % request_id,), 'myhost', 'sda')
+                    limiter.admit(context, context[1])
+
+            hll = limiter.dropped_by_name.get('my.metric', HyperLogLog())
+            # Within 3 standard errors, at the precision the limiter uses
+            tolerance = 3 * 1.04 / sqrt(len(hll.registers))
+            self.assertTrue(abs(hll.count() - cardinality) <= tolerance * cardinality,
+                            "%s estimated for %s values" % (hll.count(), cardinality))
+
+    def test_merge(self):
+        first, second, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in xrange(5000):
+            first.add(i)
+            both.add(i)
+        for i in xrange(2500, 10000):
+            second.add(i)
+            both.add(i)
+
+        first.merge(second)
+        self.assertEquals(first.registers, both.registers)
+        self.assertRaises(ValueError, first.merge, HyperLogLog(precision=12))
+
+    def test_fixed_memory(self):
+        hll = HyperLogLog(precision=8)
+        for i in xrange(100000):
+            hll.add(str(i))
+        self.assertEquals(len(hll.registers), 256)
+        self.assertRaises(ValueError, HyperLogLog, 2)
@@ -1,8 +1,16 @@
+# stdlib
 import logging
+import os
+import shutil
 import subprocess
 import tempfile
+import time
 import unittest
 
+# 3p
+import mock
+from nose.plugins.skip import SkipTest
+
 
 class TestTail(unittest.TestCase):
     def setUp(self):
@@ -64,3 +72,169 @@ class TestTail(unittest.TestCase):
             self.assertEquals(self.last_line, new_string[:-1], self.last_line)
         except OSError:
             "logrotate is not present"
+
+
+class TestTailFileRotation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'test.log')
+        self.lines = []
+        self._write('w', "first line\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, mode, data, path=None):
+        with open(path or self.log_path, mode) as f:
+            f.write(data)
+
+    def _tail(self, path=None, **kwargs):
+        from utils.tailfile import TailFile
+        tail = TailFile(logging.getLogger(), path or self.log_path, self.lines.append)
+        gen = tail.tail(line_by_line=False, **kwargs)
+        gen.next()
+        return tail, gen
+
+    def test_lines(self):
+        _, gen = self._tail(move_end=False)
+        self.assertEquals(self.lines, ["first line"])
+
+        # Lines are only processed once complete
+        self._write('a', "second")
+        gen.next()
+        self.assertEquals(self.lines, ["first line"])
+        self._write('a', " line\n\nthird line\n")
+        gen.next()
+        self.assertEquals(self.lines, ["first line", "second line", "", "third line"])
+
+    def test_truncate(self):
+        _, gen = self._tail(move_end=True)
+        self._write('w', "short\n")
+        gen.next()
+        self.assertEquals(self.lines, ["short"])
+
+    def test_rotation(self):
+        _, gen = self._tail(move_end=True)
+
+        rotated_path = self.log_path + '.1'
+        os.rename(self.log_path, rotated_path)
+        gen.next()
+        self.assertEquals(self.lines, [])
+
+        # What was written to the rotated file is read before the new file
+        self._write('a', "late line\n", path=rotated_path)
+        self._write('w', "new line\n")
+        gen.next()
+        self.assertEquals(self.lines, ["late line", "new line"])
+
+        self._write('a', "another line\n")
+        gen.next()
+        self.assertEquals(self.lines, ["late line", "new line", "another line"])
+
+    def test_rotation_without_inotify(self):
+        with mock.patch('utils.tailfile.get_file_watcher', return_value=None):
+            tail, gen = self._tail(move_end=True)
+        self.assertTrue(tail._watcher is None)
+
+        os.rename(self.log_path, self.log_path + '.1')
+        self._write('w', "new line\n")
+        gen.next()
+        self.assertEquals(self.lines, ["new line"])
+
+        self._write('w', "short\n")
+        gen.next()
+        self.assertEquals(self.lines, ["new line", "short"])
+
+    def test_shared_watcher(self):
+        from utils.tailfile import get_file_watcher
+        if get_file_watcher() is None:
+            raise SkipTest("inotify is not available")
+
+        other_path = os.path.join(self.directory, 'other.log')
+        self._write('w', "other first line\n", path=other_path)
+        tail, gen = self._tail(move_end=True)
+        other_tail, other_gen = self._tail(path=other_path, move_end=True)
+        self.assertTrue(tail._watcher is other_tail._watcher)
+
+        # Files that didn't change aren't stat'ed
+        with mock.patch('utils.tailfile.os.stat', side_effect=os.stat) as stat:
+            gen.next()
+            other_gen.next()
+            self.assertEquals(stat.call_count, 0)
+
+            self._write('a', "second line\n")
+            gen.next()
+            other_gen.next()
+            self.assertEquals(stat.call_count, 1)
+        self.assertEquals(self.lines, ["second line"])
+
+
+class TestTailFileOffsets(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'test.log')
+        self.registry_path = os.path.join(self.directory, 'offsets.json')
+        self.lines = []
+        self._write('w', "first line\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, mode, data):
+        with open(self.log_path, mode) as f:
+            f.write(data)
+
+    def _tail(self, **kwargs):
+        from utils.tailfile import OffsetRegistry, TailFile
+        # A new registry, as loaded by an agent starting
+        offsets = OffsetRegistry(self.registry_path)
+        tail = TailFile(logging.getLogger(), self.log_path, self.lines.append,
+                        offsets=offsets, **kwargs)
+        gen = tail.tail(line_by_line=False, move_end=True)
+        gen.next()
+        return gen
+
+    def test_resume(self):
+        # Nothing saved yet, start from the end
+        gen = self._tail()
+        self.assertEquals(self.lines, [])
+        self._write('a', "second line\nunfinished")
+        gen.next()
+        self.assertEquals(self.lines, ["second line"])
+
+        # Lines written while the agent was stopped aren't lost
+        self._write('a', " line\nthird line\n")
+        self._tail()
+        self.assertEquals(self.lines, ["second line", "unfinished line", "third line"])
+
+    def test_resume_rotated(self):
+        self._tail()
+        self._write('a', "second line\n")
+
+        # Rotated while the agent was stopped: read all of the new file
+        os.rename(self.log_path, self.log_path + '.1')
+        self._write('w', "new line\n")
+        self._tail()
+        self.assertEquals(self.lines, ["new line"])
+
+    def test_max_backlog(self):
+        self._tail()
+        self._write('a', "".join("line %s\n" % i for i in range(10)))
+        self._tail(max_backlog=len("line 8\nline 9\n") + 3)
+        self.assertEquals(self.lines, ["line 8", "line 9"])
+
+    def test_max_lines_per_second(self):
+        gen = self._tail(max_lines_per_second=4)
+        self._write('a', "".join("line %s\n" % i for i in range(10)))
+
+        gen.next()
+        self.assertEquals(self.lines, ["line %s" % i for i in range(4)])
+
+        # The lines over the limit are read later...
+        with mock.patch('utils.tailfile.time.time', return_value=time.time() + 1):
+            gen.next()
+        self.assertEquals(self.lines, ["line %s" % i for i in range(8)])
+
+        # ... or by the next agent
+        self._tail()
+        self.assertEquals(self.lines, ["line %s" % i for i in range(10)])
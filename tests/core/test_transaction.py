@@ -17,7 +17,7 @@ from ddagent import (
     MetricTransaction,
     THROTTLING_DELAY,
 )
-from transaction import Transaction, TransactionManager
+from transaction import Transaction, TransactionManager, TransactionQueue
 
 
 class memTransaction(Transaction):
@@ -39,6 +39,74 @@ class memTransaction(Transaction):
         self._trManager.flush_next()
 
 
+class TestTransactionQueue(unittest.TestCase):
+
+    def make_transaction(self, tr_id, next_flush):
+        tr = Transaction()
+        tr.set_id(tr_id)
+        tr._next_flush = next_flush
+        return tr
+
+    def test_pop_ready(self):
+        now = datetime(2016, 1, 1)
+        queue = TransactionQueue()
+        trs = [
+            self.make_transaction(1, now - timedelta(seconds=10)),
+            self.make_transaction(2, now + timedelta(seconds=10)),
+            self.make_transaction(3, now - timedelta(seconds=20)),
+        ]
+        for tr in trs:
+            queue.add(tr)
+
+        # Ready transactions are returned by id, once
+        self.assertEqual(queue.pop_ready(now), [trs[0], trs[2]])
+        self.assertEqual(queue.pop_ready(now), [])
+        self.assertEqual(len(queue), 3)
+
+        # Until they're rescheduled
+        trs[0]._next_flush = now + timedelta(seconds=5)
+        queue.schedule(trs[0])
+        trs[2]._next_flush = now + timedelta(seconds=30)
+        queue.schedule(trs[2])
+        self.assertEqual(queue.pop_ready(now + timedelta(seconds=15)), [trs[0], trs[1]])
+
+        self.assertTrue(queue.remove(trs[0]))
+        self.assertFalse(queue.remove(trs[0]))
+        self.assertEqual(list(queue), [trs[1], trs[2]])
+
+    def test_pop_evictable(self):
+        now = datetime(2016, 1, 1)
+        queue = TransactionQueue()
+        trs = [
+            self.make_transaction(1, now),
+            self.make_transaction(2, now + timedelta(seconds=10)),
+            self.make_transaction(3, now),
+        ]
+        for tr in trs:
+            queue.add(tr)
+
+        # Latest next flush first, then oldest
+        self.assertEqual(queue.pop_evictable(), trs[1])
+        trs[2]._next_flush = now - timedelta(seconds=10)
+        queue.schedule(trs[2])
+        self.assertEqual(queue.pop_evictable(), trs[0])
+        self.assertEqual(queue.pop_evictable(), trs[2])
+        self.assertEqual(queue.pop_evictable(), None)
+        self.assertEqual(len(queue), 0)
+
+    def test_compaction(self):
+        now = datetime(2016, 1, 1)
+        queue = TransactionQueue()
+        tr = self.make_transaction(1, now)
+        queue.add(tr)
+        for i in xrange(5000):
+            tr._next_flush = now + timedelta(seconds=i)
+            queue.schedule(tr)
+        self.assertTrue(len(queue._flush_heap) <= 1000)
+        self.assertTrue(len(queue._eviction_heap) <= 1000)
+        self.assertEqual(queue.pop_ready(now + timedelta(seconds=5000)), [tr])
+
+
 @attr(requires='core_integration')
 class TestTransaction(unittest.TestCase):
 
@@ -0,0 +1,50 @@
+# stdlib
+import unittest
+
+# project
+from utils.cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_get_set(self):
+        cache = LRUCache(2)
+        self.assertEquals(cache.get('a'), None)
+        self.assertEquals(cache.get('a', 0), 0)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEquals(cache.get('a'), 1)
+        self.assertEquals(cache['b'], 2)
+        self.assertRaises(KeyError, cache.__getitem__, 'c')
+
+        cache['a'] = 3
+        self.assertEquals(cache['a'], 3)
+        self.assertEquals(len(cache), 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(3)
+        for key in ('a', 'b', 'c'):
+            cache[key] = key
+
+        # Touch 'a' so that 'b' is now the least recently used key
+        cache.get('a')
+        cache['d'] = 'd'
+        self.assertEquals(len(cache), 3)
+        self.assertFalse('b' in cache)
+        for key in ('a', 'c', 'd'):
+            self.assertTrue(key in cache)
+
+        cache['e'] = 'e'
+        self.assertFalse('c' in cache)
+
+    def test_clear(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache.clear()
+        self.assertEquals(len(cache), 0)
+        cache['b'] = 2
+        cache['c'] = 3
+        cache['d'] = 4
+        self.assertEquals(len(cache), 2)
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, LRUCache, 0)
@@ -0,0 +1,96 @@
+# stdlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import threading
+import unittest
+
+# 3p
+import mock
+
+# project
+from utils.http import retrieve_json, SessionPool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = '{"path": "%s"}' % self.path
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', 'session=%s' % self.path)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.port = self.server.server_address[1]
+        self.pool = SessionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connections(self):
+        for path in ('/a', '/b', '/c'):
+            r = self.pool.get('http://127.0.0.1:%s%s' % (self.port, path))
+            self.assertEquals(r.json(), {'path': path})
+
+        stats = self.pool.stats()
+        self.assertEquals(stats['requests'], 3)
+        self.assertEquals(stats['connections'], 1)
+        self.assertTrue(stats['request_time'] > 0)
+
+    def test_one_session_per_endpoint(self):
+        session = self.pool.session('http://127.0.0.1:%s/a' % self.port)
+        self.assertTrue(self.pool.session('http://127.0.0.1:%s/b?c=d' % self.port) is session)
+        self.assertFalse(self.pool.session('https://127.0.0.1:%s/a' % self.port) is session)
+        self.assertFalse(self.pool.session('http://localhost:%s/a' % self.port) is session)
+
+    def test_one_session_per_tls_options(self):
+        url = 'https://127.0.0.1:%s/a' % self.port
+        session = self.pool.session(url)
+        self.assertTrue(self.pool.session(url, verify=True) is session)
+        self.assertFalse(self.pool.session(url, verify=False) is session)
+        self.assertFalse(self.pool.session(url, verify='/etc/ca.pem') is session)
+        self.assertFalse(self.pool.session(url, cert=('/etc/cert.pem', '/etc/key.pem')) is session)
+        self.assertTrue(self.pool.session(url, cert=['/etc/cert.pem', '/etc/key.pem'])
+                        is self.pool.session(url, cert=('/etc/cert.pem', '/etc/key.pem')))
+
+        # Plain HTTP connections are shared whatever the TLS options
+        url = 'http://127.0.0.1:%s/a' % self.port
+        self.assertTrue(self.pool.session(url, verify=False) is self.pool.session(url))
+
+    def test_cookies_not_kept(self):
+        url = 'http://127.0.0.1:%s/a' % self.port
+        self.pool.get(url)
+        self.assertEquals(len(self.pool.session(url).cookies), 0)
+
+    def test_configure(self):
+        self.pool.configure({'http_pool_size': '3', 'http_timeout': '2.5'})
+        self.assertEquals(self.pool.pool_size, 3)
+
+        url = 'http://127.0.0.1:%s/a' % self.port
+        with mock.patch('requests.Session.request') as request:
+            self.pool.get(url)
+            self.pool.get(url, timeout=10)
+            self.pool.get(url, timeout=None)
+        self.assertEquals(request.call_args_list[0][1]['timeout'], 2.5)
+        self.assertEquals(request.call_args_list[1][1]['timeout'], 10)
+        self.assertEquals(request.call_args_list[2][1]['timeout'], 2.5)
+
+    def test_retrieve_json_default_timeout(self):
+        url = 'http://127.0.0.1:%s/a' % self.port
+        with mock.patch('utils.http.session_pool.timeout', 2.5), \
+                mock.patch('requests.Session.request') as request:
+            retrieve_json(url)
+        self.assertEquals(request.call_args[1]['timeout'], 2.5)
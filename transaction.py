@@ -1,7 +1,7 @@
 # stdlib
 from datetime import datetime, timedelta
+import heapq
 import logging
-from operator import attrgetter
 import sys
 import time
 
@@ -14,6 +14,18 @@ log = logging.getLogger(__name__)
 FLUSH_LOGGING_PERIOD = 20
 FLUSH_LOGGING_INITIAL = 5
 
+EPOCH = datetime(1970, 1, 1)
+# The heaps of a TransactionQueue are rebuilt when they hold more than
+# HEAP_COMPACTION_RATIO entries per transaction
+HEAP_COMPACTION_RATIO = 2
+HEAP_COMPACTION_MIN_SIZE = 1000
+
+def to_timestamp(dt):
+    """ Seconds since the epoch of a naive UTC datetime """
+    td = dt - EPOCH
+    return td.days * 86400 + td.seconds + td.microseconds / 1e6
+
+
 class Transaction(object):
 
     def __init__(self):
@@ -61,6 +73,94 @@ class Transaction(object):
     def flush(self):
         raise NotImplementedError("To be implemented in a subclass")
 
+class TransactionQueue(object):
+    """
+    The transactions of a TransactionManager, indexed by id, with two heaps
+    on their next flush time: one to find the transactions to flush, the
+    other to find the ones to drop first when the queue is too big (latest
+    next flush first, then oldest). Both are logarithmic.
+
+    A transaction is rescheduled by pushing new heap entries, the previous
+    ones are ignored when they are popped.
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        self._flush_heap = []
+        self._eviction_heap = []
+        # Current entry of each transaction in each heap. A transaction
+        # being flushed has no flush entry until it's rescheduled.
+        self._flush_entries = {}
+        self._eviction_entries = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        for tr_id in sorted(self._by_id):
+            yield self._by_id[tr_id]
+
+    def __contains__(self, tr):
+        return tr.get_id() in self._by_id
+
+    def add(self, tr):
+        self._by_id[tr.get_id()] = tr
+        self.schedule(tr)
+
+    def schedule(self, tr):
+        """ (Re)schedule `tr` at its next flush time """
+        tr_id = tr.get_id()
+        next_flush = to_timestamp(tr.get_next_flush())
+
+        flush_entry = (next_flush, tr_id)
+        self._flush_entries[tr_id] = flush_entry
+        heapq.heappush(self._flush_heap, flush_entry)
+        eviction_entry = (-next_flush, tr_id)
+        self._eviction_entries[tr_id] = eviction_entry
+        heapq.heappush(self._eviction_heap, eviction_entry)
+
+        heap_size = max(len(self._flush_heap), len(self._eviction_heap))
+        if heap_size > max(HEAP_COMPACTION_MIN_SIZE, HEAP_COMPACTION_RATIO * len(self._by_id)):
+            self._compact()
+
+    def remove(self, tr):
+        """ Remove `tr`, return False if it wasn't queued """
+        tr_id = tr.get_id()
+        self._flush_entries.pop(tr_id, None)
+        self._eviction_entries.pop(tr_id, None)
+        return self._by_id.pop(tr_id, None) is not None
+
+    def pop_ready(self, now):
+        """ Return the transactions to flush before `now`, by id, and unschedule them """
+        now = to_timestamp(now)
+        ready = []
+        heap = self._flush_heap
+        while heap and heap[0][0] < now:
+            entry = heapq.heappop(heap)
+            if self._flush_entries.get(entry[1]) is entry:
+                del self._flush_entries[entry[1]]
+                ready.append(self._by_id[entry[1]])
+        ready.sort(key=lambda tr: tr.get_id())
+        return ready
+
+    def pop_evictable(self):
+        """ Remove and return the transaction to drop first, None if there is none """
+        heap = self._eviction_heap
+        while heap:
+            entry = heapq.heappop(heap)
+            if self._eviction_entries.get(entry[1]) is entry:
+                tr = self._by_id[entry[1]]
+                self.remove(tr)
+                return tr
+        return None
+
+    def _compact(self):
+        self._flush_heap = self._flush_entries.values()
+        heapq.heapify(self._flush_heap)
+        self._eviction_heap = self._eviction_entries.values()
+        heapq.heapify(self._eviction_heap)
+
+
 class TransactionManager(object):
     """Holds any transaction derived object list and make sure they
        are all commited, without exceeding parameters (throttling, memory consumption) """
@@ -72,7 +172,7 @@ class TransactionManager(object):
 
         self._flush_without_ioloop = False # useful for tests
 
-        self._transactions = []  # List of all non commited transactions
+        self._transactions = TransactionQueue()  # All non commited transactions
         self._total_count = 0  # Maintain size/count not to recompute it everytime
         self._total_size = 0
         self._flush_count = 0
@@ -113,16 +213,16 @@ class TransactionManager(object):
 
         if (self._total_size + tr_size) > self._MAX_QUEUE_SIZE:
             log.warn("Queue is too big, removing old transactions...")
-            new_trs = sorted(self._transactions,key=attrgetter('_next_flush'), reverse = True)
-            for tr2 in new_trs:
-                if (self._total_size + tr_size) > self._MAX_QUEUE_SIZE:
-                    self._transactions.remove(tr2)
-                    self._total_count = self._total_count - 1
-                    self._total_size = self._total_size - tr2.get_size()
-                    log.warn("Removed transaction %s from queue" % tr2.get_id())
+            while (self._total_size + tr_size) > self._MAX_QUEUE_SIZE:
+                tr2 = self._transactions.pop_evictable()
+                if tr2 is None:
+                    break
+                self._total_count = self._total_count - 1
+                self._total_size = self._total_size - tr2.get_size()
+                log.warn("Removed transaction %s from queue" % tr2.get_id())
 
         # Done
-        self._transactions.append(tr)
+        self._transactions.add(tr)
         self._total_count += 1
         self._transactions_received += 1
         self._total_size = self._total_size + tr_size
@@ -136,12 +236,9 @@ class TransactionManager(object):
             log.debug("A flush is already in progress, not doing anything")
             return
 
-        to_flush = []
         # Do we have something to do ?
         now = datetime.utcnow()
-        for tr in self._transactions:
-            if tr.time_to_flush(now):
-                to_flush.append(tr)
+        to_flush = self._transactions.pop_ready(now)
 
         count = len(to_flush)
         should_log = self._flush_count + 1 <= FLUSH_LOGGING_INITIAL or (self._flush_count + 1) % FLUSH_LOGGING_PERIOD == 0
@@ -208,14 +305,17 @@ class TransactionManager(object):
     def tr_error(self,tr):
         tr.inc_error_count()
         tr.compute_next_flush(self._MAX_WAIT_FOR_REPLAY)
+        # It may have been dropped from the queue while it was flushed
+        if tr in self._transactions:
+            self._transactions.schedule(tr)
         log.warn("Transaction %d in error (%s error%s), it will be replayed after %s" %
           (tr.get_id(), tr.get_error_count(), plural(tr.get_error_count()),
            tr.get_next_flush()))
 
     def tr_success(self,tr):
         log.debug("Transaction %d completed" % tr.get_id())
-        self._transactions.remove(tr)
-        self._total_count -= 1
-        self._total_size -= tr.get_size()
+        if self._transactions.remove(tr):
+            self._total_count -= 1
+            self._total_size -= tr.get_size()
         self._transactions_flushed += 1
         self.print_queue_stats()
@@ -0,0 +1,77 @@
+"""
+Bounded in-memory caches.
+"""
+
+# Indexes in the links of the LRUCache circular list
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """
+    A mapping holding at most `maxsize` keys, which evicts the least
+    recently used key when full.
+
+    Recency is tracked with a circular doubly linked list of
+    [prev, next, key, value] links, so that get and set are O(1).
+    Not thread-safe.
+    """
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("maxsize must be a positive integer")
+        self.maxsize = maxsize
+        self._links = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def _move_to_front(self, link):
+        link_prev, link_next = link[PREV], link[NEXT]
+        link_prev[NEXT] = link_next
+        link_next[PREV] = link_prev
+        root = self._root
+        last = root[PREV]
+        last[NEXT] = root[PREV] = link
+        link[PREV] = last
+        link[NEXT] = root
+
+    def get(self, key, default=None):
+        link = self._links.get(key)
+        if link is None:
+            return default
+        self._move_to_front(link)
+        return link[VALUE]
+
+    def __getitem__(self, key):
+        link = self._links[key]
+        self._move_to_front(link)
+        return link[VALUE]
+
+    def __setitem__(self, key, value):
+        link = self._links.get(key)
+        if link is not None:
+            link[VALUE] = value
+            self._move_to_front(link)
+            return
+
+        root = self._root
+        if len(self._links) >= self.maxsize:
+            # Evict the least recently used key
+            oldest = root[NEXT]
+            root[NEXT] = oldest[NEXT]
+            oldest[NEXT][PREV] = root
+            del self._links[oldest[KEY]]
+
+        last = root[PREV]
+        link = [last, root, key, value]
+        last[NEXT] = root[PREV] = self._links[key] = link
+
+    def clear(self):
+        self._links.clear()
+        root = self._root
+        root[:] = [root, root, None, None]
@@ -1,6 +1,142 @@
+# stdlib
+import cookielib
+import threading
+import time
+from urlparse import urlparse
+
+# 3p
 import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept open to each endpoint, at most one per thread requesting it
+# concurrently
+DEFAULT_POOL_SIZE = 10
+
+
+class _RejectCookiesPolicy(cookielib.DefaultCookiePolicy):
+    """
+    Don't keep the cookies set by an endpoint, the checks sharing its session
+    may use different credentials
+    """
+    def set_ok(self, cookie, request):
+        return False
+
+
+class SessionPool(object):
+    """
+    Keep-alive `requests` sessions shared by the checks, one per endpoint
+    (scheme, host and port). Checks scraping the same endpoints on every run
+    reuse their connections, and the TLS sessions established on them,
+    instead of opening new ones.
+
+    `requests` sets the `verify` and `cert` options of a request on the
+    connection pool it uses, so HTTPS endpoints get one session per set of
+    TLS options: connections are never shared by requests verifying the
+    certificates differently, or presenting different client certificates.
+
+    `timeout` is the default timeout of the requests (in seconds, None to
+    wait forever), a request can still set its own.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # (scheme, netloc, verify, cert) -> (session, adapter)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._request_count = 0
+        self._request_time = 0.0
+
+    def configure(self, agentConfig):
+        """
+        Apply the `http_pool_size` and `http_timeout` options of the agent.
+        The pool size only applies to the sessions created afterwards.
+        """
+        if agentConfig.get('http_pool_size'):
+            self.pool_size = int(agentConfig['http_pool_size'])
+        if agentConfig.get('http_timeout'):
+            self.timeout = float(agentConfig['http_timeout'])
+
+    def session(self, url, verify=None, cert=None):
+        """
+        Return the session of the endpoint of `url`, for requests with the
+        `verify` and `cert` options given
+        """
+        parsed_url = urlparse(url)
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        if parsed_url.scheme == 'https':
+            key = (parsed_url.scheme, parsed_url.netloc, True if verify is None else verify, cert)
+        else:
+            # The TLS options don't apply to plain HTTP connections
+            key = (parsed_url.scheme, parsed_url.netloc, None, None)
+        with self._lock:
+            if key not in self._sessions:
+                session = requests.Session()
+                session.cookies.set_policy(_RejectCookiesPolicy())
+                # One pool of `pool_size` connections, for the endpoint only
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('%s://%s' % key[:2], adapter)
+                self._sessions[key] = (session, adapter)
+            return self._sessions[key][0]
+
+    def request(self, method, url, **kwargs):
+        # retrieve_json and the checks pass timeout=None when they have none
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        session = self.session(url, kwargs.get('verify'), kwargs.get('cert'))
+        start = time.time()
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                self._request_count += 1
+                self._request_time += elapsed
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def stats(self):
+        """
+        Return the number of requests sent, the number of connections opened
+        to send them and the total time spent on them since the pool was
+        created.
+        """
+        with self._lock:
+            adapters = [adapter for _, adapter in self._sessions.itervalues()]
+            stats = {
+                'requests': self._request_count,
+                'request_time': self._request_time,
+            }
+
+        connections = 0
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+        stats['connections'] = connections
+
+        return stats
+
+    def close(self):
+        with self._lock:
+            sessions = self._sessions.values()
+            self._sessions = {}
+        for session, _ in sessions:
+            session.close()
+
+
+# The sessions of the checks
+session_pool = SessionPool()
+
 
-def retrieve_json(url):
-    r = requests.get(url)
+def retrieve_json(url, timeout=None):
+    r = session_pool.get(url, timeout=timeout)
     r.raise_for_status()
     return r.json()
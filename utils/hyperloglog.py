@@ -0,0 +1,66 @@
+"""
+Fixed-memory estimator of the number of distinct values added to it.
+
+HyperLogLog (http://algo.inria.fr/flajolet/Publications/FlFuGaMe07.pdf):
+each value is hashed, the first `precision` bits of the hash pick one of
+2 ** precision registers, which keeps the longest run of leading zeros seen
+in the rest of the hash. The standard error of the estimate is about
+1.04 / sqrt(2 ** precision), 3% with the default precision.
+"""
+# stdlib
+from math import log
+
+DEFAULT_PRECISION = 10
+
+MASK_64 = (1 << 64) - 1
+
+
+def mix_hash(value):
+    """ Spread the bits of python's hash of `value` over 64 bits (murmur3 finalizer) """
+    h = hash(value) & MASK_64
+    h ^= h >> 33
+    h = (h * 0xff51afd7ed558ccd) & MASK_64
+    h ^= h >> 33
+    h = (h * 0xc4ceb9fe1a85ec53) & MASK_64
+    h ^= h >> 33
+    return h
+
+
+class HyperLogLog(object):
+    __slots__ = ('precision', 'registers')
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be in [4;16], got %s" % precision)
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        h = mix_hash(value)
+        suffix_bits = 64 - self.precision
+        index = h >> suffix_bits
+        # Position of the first 1 bit in the remaining bits
+        rank = suffix_bits - (h & ((1 << suffix_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """ Count the values added to `other` in this estimator too """
+        if other.precision != self.precision:
+            raise ValueError("Can't merge estimators with different precisions")
+        registers = self.registers
+        for index, rank in enumerate(other.registers):
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def count(self):
+        """ Return the estimated number of distinct values added """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+
+        # Linear counting is more accurate for small cardinalities
+        zeros = self.registers.count('\x00')
+        if zeros and estimate <= 2.5 * m:
+            estimate = m * log(float(m) / zeros)
+        return int(round(estimate))
@@ -45,9 +45,9 @@ def set_kube_settings(instance):
     return _kube_settings
 
 
-def get_kube_labels():
+def get_kube_labels(timeout=None):
     global _kube_settings
-    pods = retrieve_json(_kube_settings["labels_url"])
+    pods = retrieve_json(_kube_settings["labels_url"], timeout=timeout)
     kube_labels = {}
     for pod in pods["items"]:
         metadata = pod.get("metadata", {})
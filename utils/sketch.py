@@ -0,0 +1,149 @@
+"""
+Mergeable quantile sketch with a relative accuracy guarantee.
+
+Values are counted in logarithmically sized buckets, in the spirit of
+DDSketch (http://www.vldb.org/pvldb/vol12/p2195-masson.pdf): any quantile
+is estimated within `relative_accuracy` of the actual sample value,
+whatever the number of samples, using at most `max_bins` buckets per sign.
+"""
+# stdlib
+from math import ceil, log
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+
+# Values closer to 0 than this are counted as zeros
+MIN_INDEXABLE_VALUE = 1e-9
+
+
+class LogBucketSketch(object):
+    __slots__ = ('relative_accuracy', 'max_bins', 'gamma', '_multiplier',
+                 'positive_bins', 'negative_bins', 'zero_count',
+                 'count', 'sum', 'min', 'max')
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in ]0;1[, got %s" % relative_accuracy)
+
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._multiplier = 1 / log(self.gamma)
+
+        # bucket index -> count, for positive and negative values
+        self.positive_bins = {}
+        self.negative_bins = {}
+        self.zero_count = 0
+
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def _key(self, value):
+        return int(ceil(log(value) * self._multiplier))
+
+    def _value(self, key):
+        # The middle of the bucket, within `relative_accuracy` of any
+        # value of the bucket
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value):
+        if value > MIN_INDEXABLE_VALUE:
+            bins = self.positive_bins
+            key = self._key(value)
+        elif value < -MIN_INDEXABLE_VALUE:
+            bins = self.negative_bins
+            key = self._key(-value)
+        else:
+            bins = None
+            self.zero_count += 1
+
+        if bins is not None:
+            bins[key] = bins.get(key, 0) + 1
+            if len(bins) > self.max_bins:
+                self._collapse(bins)
+
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def _collapse(self, bins):
+        """
+        Merge the buckets of the smallest absolute values so that there are
+        at most `max_bins` buckets. The accuracy guarantee is lost for these
+        values only.
+        """
+        keys = sorted(bins)
+        excess = len(keys) - self.max_bins
+        if excess <= 0:
+            return
+        collapsed = 0
+        for key in keys[:excess]:
+            collapsed += bins.pop(key)
+        bins[keys[excess]] += collapsed
+
+    def merge(self, other):
+        """ Add the values counted by `other` to this sketch """
+        if other.gamma != self.gamma:
+            raise ValueError("Can't merge sketches with different relative accuracies")
+
+        for bins, other_bins in ((self.positive_bins, other.positive_bins),
+                                 (self.negative_bins, other.negative_bins)):
+            for key, count in other_bins.iteritems():
+                bins[key] = bins.get(key, 0) + count
+            if len(bins) > self.max_bins:
+                self._collapse(bins)
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if other.count:
+            if self.min is None or other.min < self.min:
+                self.min = other.min
+            if self.max is None or other.max > self.max:
+                self.max = other.max
+
+    def avg(self):
+        if not self.count:
+            return None
+        return self.sum / float(self.count)
+
+    def value_at_rank(self, rank):
+        """
+        Return the estimated value of the sample of index `rank` (0-based)
+        if all the samples were sorted.
+        """
+        if not self.count:
+            return None
+        rank = max(0, min(rank, self.count - 1))
+
+        value = None
+        seen = 0
+        for key in sorted(self.negative_bins, reverse=True):
+            seen += self.negative_bins[key]
+            if seen > rank:
+                value = -self._value(key)
+                break
+        else:
+            seen += self.zero_count
+            if seen > rank:
+                value = 0
+            else:
+                for key in sorted(self.positive_bins):
+                    seen += self.positive_bins[key]
+                    if seen > rank:
+                        value = self._value(key)
+                        break
+
+        # Extremes are known exactly
+        return max(self.min, min(value, self.max))
+
+    def quantile(self, q):
+        """ Return the estimated `q` quantile, 0 <= q <= 1 """
+        if not self.count:
+            return None
+        return self.value_at_rank(int(round(q * (self.count - 1))))
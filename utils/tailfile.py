@@ -1,100 +1,537 @@
+# stdlib
 import binascii
+import errno
+import io
+import logging
 import os
-from stat import ST_INO, ST_SIZE
+import struct
+import threading
+import time
+
+# 3p
+import simplejson as json
+
+# project
+from config import _is_affirmative, _windows_commondata_path
+from utils.pidfile import PidFile
+from utils.platform import Platform
+
+log = logging.getLogger(__name__)
+
+# inotify, through the libc
+_libc = None
+if Platform.is_linux():
+    try:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (ImportError, OSError, AttributeError):
+        _libc = None
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 02000000
+IN_NONBLOCK = 04000
+
+# struct inotify_event, without the name following it
+INOTIFY_EVENT = struct.Struct('iIII')
+INOTIFY_READ_SIZE = 65536
+
+# Bytes of a file left unread when the agent stopped that are read when it
+# starts again, the rest is skipped
+DEFAULT_MAX_BACKLOG_MB = 10
+# Seconds of lines a tailed file can accumulate the budget for, when rate
+# limited
+LINE_BUDGET_MAX_SECONDS = 60
+
+
+class FileWatcher(object):
+    """
+    Watch the tailed files for changes with a single inotify instance, so they
+    only need to be looked at (stat'ed) when something happened to them.
+
+    The directories of the files are watched rather than the files
+    themselves, to see them being moved, removed or created again by a log
+    rotation.
+    """
+    MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+        IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def __init__(self):
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        self._lock = threading.Lock()
+        # directory -> watch descriptor, and back
+        self._wds = {}
+        self._directories = {}
+        # watch descriptor -> names of the files watched in its directory
+        self._names = {}
+        # path -> number of events seen for the file
+        self._versions = {}
+
+    def watch(self, path):
+        """
+        Start watching `path`. Return False when it can't be watched, the
+        changes of the file are then unknown.
+        """
+        directory, name = os.path.split(self._abspath(path))
+        with self._lock:
+            wd = self._wds.get(directory)
+            if wd is None:
+                wd = _libc.inotify_add_watch(self._fd, directory, self.MASK)
+                if wd < 0:
+                    log.debug("Unable to watch %s: %s", directory, os.strerror(ctypes.get_errno()))
+                    return False
+                self._wds[directory] = wd
+                self._directories[wd] = directory
+                self._names.setdefault(wd, set())
+            self._names[wd].add(name)
+            self._versions.setdefault(os.path.join(directory, name), 0)
+            return True
+
+    def version(self, path):
+        """
+        Return a number that changes each time something happens to the file
+        at `path`, None if it isn't watched.
+        """
+        path = self._abspath(path)
+        with self._lock:
+            self._read_events()
+            if os.path.dirname(path) not in self._wds:
+                return None
+            return self._versions.get(path)
+
+    @staticmethod
+    def _abspath(path):
+        # inotify reports the names of the files as bytes
+        path = os.path.abspath(path)
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return path
+
+    def _read_events(self):
+        while True:
+            try:
+                data = os.read(self._fd, INOTIFY_READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return
+                raise
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                self._process_event(wd, mask, name)
+
+    def _process_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # Events were lost, consider that all the files changed
+            for path in self._versions:
+                self._versions[path] += 1
+            return
+
+        directory = self._directories.get(wd)
+        if directory is None:
+            return
+
+        if name:
+            if name in self._names[wd]:
+                self._versions[os.path.join(directory, name)] += 1
+            return
+
+        # Event on the directory itself
+        for watched_name in self._names[wd]:
+            self._versions[os.path.join(directory, watched_name)] += 1
+        if mask & IN_IGNORED:
+            # The directory is gone, and its watch with it
+            del self._directories[wd]
+            del self._wds[directory]
+            for watched_name in self._names.pop(wd):
+                self._versions.pop(os.path.join(directory, watched_name), None)
+
+
+_file_watcher = None
+_file_watcher_lock = threading.Lock()
+
+
+def get_file_watcher():
+    """
+    Return the watcher shared by all the tailed files, None where inotify is
+    not available
+    """
+    global _file_watcher
+    if _libc is None:
+        return None
+
+    with _file_watcher_lock:
+        if _file_watcher is None:
+            try:
+                _file_watcher = FileWatcher()
+            except (OSError, AttributeError) as e:
+                log.info("inotify is not available, tailed files will be stat'ed: %s", e)
+                _file_watcher = False
+
+    return _file_watcher or None
+
+
+class OffsetRegistry(object):
+    """
+    Offsets up to which the tailed files have been read, saved on disk so
+    their tailing resumes where it stopped when the agent restarts.
+
+    The inode and the CRC of the beginning of each file are saved along with
+    its offset, to tell whether it was rotated or truncated in the meantime.
+    The registry is written to a temporary file then renamed over the
+    previous one, so it is never left half-written.
+    """
+    # Entries of the files that haven't moved in a week are dropped
+    EXPIRY = 7 * 24 * 3600
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                log.warning("Unable to read the offsets of the tailed files from %s: %s", self.path, e)
+        except ValueError as e:
+            log.warning("Ignoring the corrupted offsets of the tailed files in %s: %s", self.path, e)
+        return {}
+
+    def get(self, path):
+        """
+        Return the (inode, crc, offset) saved for the file at `path`, None if
+        there isn't any
+        """
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(path))
+        if entry is None:
+            return None
+        return entry['inode'], entry['crc'], entry['offset']
+
+    def update(self, path, inode, crc, offset):
+        with self._lock:
+            self._entries[os.path.abspath(path)] = {
+                'inode': inode,
+                'crc': crc,
+                'offset': offset,
+                'timestamp': time.time(),
+            }
+            self._save()
+
+    def _save(self):
+        expired = time.time() - self.EXPIRY
+        for path, entry in self._entries.items():
+            if entry['timestamp'] < expired:
+                del self._entries[path]
+
+        tmp_path = '%s.%s.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f)
+            if Platform.is_win32() and os.path.exists(self.path):
+                # Can't rename over an existing file on Windows
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            log.warning("Unable to save the offsets of the tailed files to %s: %s", self.path, e)
+
+
+_offset_registry = None
+_offset_registry_lock = threading.Lock()
+
+
+def get_offset_registry():
+    """
+    Return the registry of offsets shared by all the tailed files
+    """
+    global _offset_registry
+    with _offset_registry_lock:
+        if _offset_registry is None:
+            if Platform.is_win32():
+                directory = os.path.join(_windows_commondata_path(), 'Datadog')
+            else:
+                directory = PidFile.get_dir()
+            _offset_registry = OffsetRegistry(os.path.join(directory, 'tailfile_offsets.json'))
+
+    return _offset_registry
+
+
+def get_tail_options(agentConfig):
+    """
+    Return the TailFile options set in the agent configuration
+    """
+    options = {}
+    if _is_affirmative(agentConfig.get('tail_resume', True)):
+        options['offsets'] = get_offset_registry()
+    max_backlog_mb = float(agentConfig.get('tail_max_backlog_mb', DEFAULT_MAX_BACKLOG_MB))
+    if max_backlog_mb > 0:
+        options['max_backlog'] = int(max_backlog_mb * 1024 * 1024)
+    max_lines_per_second = int(agentConfig.get('tail_max_lines_per_second', 0))
+    if max_lines_per_second > 0:
+        options['max_lines_per_second'] = max_lines_per_second
+
+    return options
 
 
 class TailFile(object):
+    """
+    Tail the file at `path` and run `callback` on its lines.
+
+    `offsets` is an OffsetRegistry to resume the tailing where it stopped
+    last time, rather than at the end of the file. When resuming, at most
+    `max_backlog` bytes written in the meantime are read. With
+    `max_lines_per_second` set, the lines over that rate are left for the
+    next run instead.
+    """
 
     CRC_SIZE = 16
+    READ_SIZE = 65536
 
-    def __init__(self, logger, path, callback):
+    def __init__(self, logger, path, callback, offsets=None, max_backlog=None,
+                 max_lines_per_second=None):
         self._path = path
         self._f = None
         self._inode = None
         self._size = 0
+        self._mtime = None
         self._crc = None
+        self._offset = 0
+        # Beginning of a line whose end hasn't been written yet
+        self._buffer = ''
+        self._reopen = False
         self._log = logger
         self._callback = callback
+        self._watcher = get_file_watcher()
+        self._watch_version = None
+        self._offsets = offsets
+        self._saved_offset = None
+        self._max_backlog = max_backlog
+        self._max_lines_per_second = max_lines_per_second
+        self._line_budget = None
+        self._line_budget_time = None
 
-    def _open_file(self, move_end=False, pos=False):
-
-        already_open = False
-        # close and reopen to handle logrotate
+    def _open_file(self, move_end=False):
         if self._f is not None:
             self._f.close()
             self._f = None
-            already_open = True
 
-        stat = os.stat(self._path)
-        inode = stat[ST_INO]
-        size = stat[ST_SIZE]
+        # Watch the file before opening it, not to miss what happens in between
+        if self._watcher is not None and self._watcher.watch(self._path):
+            self._watch_version = self._watcher.version(self._path)
 
-        # Compute CRC of the beginning of the file
-        crc = None
-        if size >= self.CRC_SIZE:
-            tmp_file = open(self._path, 'r')
-            data = tmp_file.read(self.CRC_SIZE)
-            crc = binascii.crc32(data)
-
-        if already_open:
-            # Check if file has been removed
-            if self._inode is not None and inode != self._inode:
-                self._log.debug("File removed, reopening")
-                move_end = False
-                pos = False
-
-            # Check if file has been truncated
-            elif self._size > 0 and size < self._size:
-                self._log.debug("File truncated, reopening")
-                move_end = False
-                pos = False
-
-            # Check if file has been truncated and too much data has
-            # alrady been written (copytruncate and opened files...)
-            if size >= self.CRC_SIZE and self._crc is not None and crc != self._crc:
-                self._log.debug("Begining of file modified, reopening")
-                move_end = False
-                pos = False
+        self._f = io.open(self._path, 'rb', buffering=0)
+        stat = os.fstat(self._f.fileno())
+        self._inode = stat.st_ino
+        self._size = stat.st_size
+        self._mtime = stat.st_mtime
+        self._offset = 0
+        self._buffer = ''
+        self._reopen = False
 
-        self._inode = inode
-        self._size = size
-        self._crc = crc
+        # Compute CRC of the beginning of the file
+        self._crc = self._read_crc() if self._size >= self.CRC_SIZE else None
 
-        self._f = open(self._path, 'r')
         if move_end:
             self._log.debug("Opening file %s" % (self._path))
-            self._f.seek(0, os.SEEK_END)
-        elif pos:
-            self._log.debug("Reopening file %s at %s" % (self._path, pos))
-            self._f.seek(pos)
+            self._offset = self._f.seek(0, os.SEEK_END)
 
         return True
 
+    def _resume(self):
+        """
+        Move to the offset saved for the file, if it is still the same file
+        """
+        saved = self._offsets.get(self._path)
+        if saved is None:
+            return False
+
+        inode, crc, offset = saved
+        if inode == self._inode and offset <= self._size and (crc is None or crc == self._crc):
+            self._log.debug("Resuming file %s at %s" % (self._path, offset))
+            self._offset = self._f.seek(offset)
+        else:
+            self._log.debug("File %s rotated or truncated since last read, reading it from the beginning" % self._path)
+            self._offset = self._f.seek(0)
+
+        # Skip what is over the maximum backlog, up to the next complete line
+        if self._max_backlog and self._size - self._offset > self._max_backlog:
+            self._log.info("Skipping %s bytes of %s written while it wasn't tailed" %
+                           (self._size - self._max_backlog - self._offset, self._path))
+            self._offset = self._f.seek(self._size - self._max_backlog - 1)
+            while True:
+                data = self._f.read(self.READ_SIZE)
+                if not data:
+                    break
+                newline = data.find('\n')
+                if newline != -1:
+                    self._offset += newline + 1
+                    break
+                self._offset += len(data)
+            self._f.seek(self._offset)
+
+        return True
+
+    def _save_offset(self):
+        if self._offsets is None:
+            return
+
+        # Lines are processed once complete, don't count the unfinished one
+        state = (self._inode, self._crc, self._offset - len(self._buffer))
+        if state != self._saved_offset:
+            self._offsets.update(self._path, *state)
+            self._saved_offset = state
+
+    def _refill_line_budget(self):
+        if not self._max_lines_per_second:
+            return
+
+        now = time.time()
+        if self._line_budget_time is None:
+            self._line_budget = self._max_lines_per_second
+        else:
+            self._line_budget = min(
+                self._line_budget + (now - self._line_budget_time) * self._max_lines_per_second,
+                LINE_BUDGET_MAX_SECONDS * self._max_lines_per_second
+            )
+        self._line_budget_time = now
+
+    def _rewind(self, lines):
+        """
+        Go back to the beginning of `lines`, the last ones read, to read them
+        again later
+        """
+        self._offset -= len('\n'.join(lines)) + 1 + len(self._buffer)
+        self._buffer = ''
+        self._f.seek(self._offset)
+
+    def _read_crc(self):
+        self._f.seek(0)
+        data = self._f.read(self.CRC_SIZE)
+        self._f.seek(self._offset)
+        return binascii.crc32(data)
+
+    def _flush_line(self):
+        """
+        Process the unfinished line left by a file being truncated or rotated
+        """
+        if self._buffer:
+            self._callback(self._buffer.strip(chr(0)))
+            self._buffer = ''
+
+    def _check_file(self):
+        """
+        Look for a rotation or a truncation of the file, once all of it has
+        been read
+        """
+        if self._watcher is not None:
+            version = self._watcher.version(self._path)
+            if version is not None and version == self._watch_version:
+                # Nothing happened to the file
+                return
+            self._watch_version = version
+
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            # Moved away and not created again yet, stick to the current one
+            return
+
+        # Check if file has been removed
+        if stat.st_ino != self._inode:
+            self._log.debug("File removed, reopening")
+            # Finish reading the rotated file before moving on
+            self._reopen = True
+            return
+
+        if stat.st_size == self._size and stat.st_mtime == self._mtime:
+            return
+        self._size = stat.st_size
+        self._mtime = stat.st_mtime
+
+        # Check if file has been truncated
+        truncated = stat.st_size < self._offset
+        if truncated:
+            self._log.debug("File truncated, reopening")
+
+        # Check if file has been truncated and too much data has
+        # alrady been written (copytruncate and opened files...)
+        elif stat.st_size >= self.CRC_SIZE:
+            crc = self._read_crc()
+            if self._crc is not None and crc != self._crc:
+                self._log.debug("Begining of file modified, reopening")
+                truncated = True
+            self._crc = crc
+
+        if truncated:
+            self._flush_line()
+            self._offset = self._f.seek(0)
+            self._crc = self._read_crc() if stat.st_size >= self.CRC_SIZE else None
+
     def tail(self, line_by_line=True, move_end=True):
         """Read line-by-line and run callback on each line.
         line_by_line: yield each time a callback has returned True
-        move_end: start from the last line of the log"""
+        move_end: start from the last line of the log
+
+        The file stays open and is read by chunks, a line is only processed
+        once its end has been written."""
         try:
-            self._open_file(move_end=move_end)
+            # Instead of starting from the end, resume where the tailing stopped
+            resume = move_end and self._offsets is not None
+            self._open_file(move_end=move_end and not resume)
+            if resume and not self._resume():
+                self._offset = self._f.seek(0, os.SEEK_END)
+            self._refill_line_budget()
 
             while True:
-                pos = self._f.tell()
-                line = self._f.readline()
-                if line:
-                    line = line.strip(chr(0))  # a truncate may have create holes in the file
-                    if self._callback(line.rstrip("\n")):
-                        if line_by_line:
+                data = self._f.read(self.READ_SIZE)
+                if data:
+                    self._offset += len(data)
+                    lines = (self._buffer + data).split('\n')
+                    self._buffer = lines.pop()
+                    for i, line in enumerate(lines):
+                        if self._line_budget is not None:
+                            if self._line_budget < 1:
+                                break
+                            self._line_budget -= 1
+                        line = line.strip(chr(0))  # a truncate may have create holes in the file
+                        if self._callback(line) and line_by_line:
                             yield True
-                            pos = self._f.tell()
-                            self._open_file(move_end=False, pos=pos)
-                        else:
-                            continue
                     else:
                         continue
-                else:
-                    yield True
-                    assert pos == self._f.tell()
-                    self._open_file(move_end=False, pos=pos)
+                    # Over the rate limit, leave the other lines for later
+                    self._rewind(lines[i:])
+
+                elif self._reopen:
+                    self._flush_line()
+                    self._open_file(move_end=False)
+                    continue
+
+                self._save_offset()
+                yield True
+                self._refill_line_budget()
+                self._check_file()
 
         except Exception, e:
             # log but survive